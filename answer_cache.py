@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Cosine similarity above which a new question reuses a cached answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+# (session_id, model_name) -> OrderedDict of normalized question -> entry, least recently used first
+_buckets = {}
+# Global recency order across buckets for the size limit: (session_id, model_name, question) -> None
+_lru = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "exact_hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _drop(bucket_key, question):
+    bucket = _buckets.get(bucket_key)
+    if bucket is not None:
+        bucket.pop(question, None)
+        if not bucket:
+            del _buckets[bucket_key]
+    _lru.pop((bucket_key[0], bucket_key[1], question), None)
+
+def lookup_answer(session_id, model_name, question, question_vector, index_version, threshold=None):
+    """
+    Returns a cached answer for this session and model if the question matches a previous one
+    exactly or its embedding is within the similarity threshold, else None.
+    Entries made against another version of the session index are discarded.
+    """
+    entry = lookup_answer_entry(session_id, model_name, question, question_vector, index_version, threshold)
+    return entry["answer"] if entry is not None else None
+
+def lookup_answer_entry(session_id, model_name, question, question_vector, index_version, threshold=None):
+    """Like lookup_answer, but returns {"answer", "sources"}; sources is None if they weren't stored."""
+    if threshold is None:
+        threshold = ANSWER_CACHE_THRESHOLD
+    bucket_key = (session_id, model_name)
+    normalized = _normalize_question(question)
+    now = time.time()
+
+    with _lock:
+        bucket = _buckets.get(bucket_key)
+        if not bucket:
+            _stats["misses"] += 1
+            return None
+
+        for cached_question, entry in list(bucket.items()):
+            if entry["index_version"] != index_version or now - entry["created"] > ANSWER_CACHE_TTL_SECONDS:
+                _drop(bucket_key, cached_question)
+                _stats["invalidations"] += 1
+
+        bucket = _buckets.get(bucket_key)
+        if not bucket:
+            _stats["misses"] += 1
+            return None
+
+        best_question = None
+        if normalized in bucket:
+            best_question = normalized
+            _stats["exact_hits"] += 1
+        else:
+            questions = list(bucket.keys())
+            vectors = np.stack([bucket[q]["vector"] for q in questions])
+            scores = vectors @ _unit(question_vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                best_question = questions[best]
+
+        if best_question is None:
+            _stats["misses"] += 1
+            return None
+
+        _stats["hits"] += 1
+        bucket.move_to_end(best_question)
+        _lru.move_to_end((session_id, model_name, best_question))
+        entry = bucket[best_question]
+        return {"answer": entry["answer"], "sources": entry["sources"]}
+
+def store_answer(session_id, model_name, question, question_vector, answer, index_version, sources=None):
+    """
+    Caches an answer, and optionally the source names it was based on, evicting the least
+    recently used entries beyond the size limit.
+    """
+    bucket_key = (session_id, model_name)
+    normalized = _normalize_question(question)
+
+    with _lock:
+        bucket = _buckets.setdefault(bucket_key, OrderedDict())
+        bucket[normalized] = {
+            "vector": _unit(question_vector),
+            "answer": answer,
+            "created": time.time(),
+            "index_version": index_version,
+            "sources": list(sources) if sources is not None else None
+        }
+        bucket.move_to_end(normalized)
+        _lru[(session_id, model_name, normalized)] = None
+        _lru.move_to_end((session_id, model_name, normalized))
+
+        while len(_lru) > ANSWER_CACHE_MAX_ENTRIES:
+            old_session, old_model, old_question = next(iter(_lru))
+            _drop((old_session, old_model), old_question)
+            _stats["evictions"] += 1
+
+def invalidate_answers(session_id):
+    """Drops every cached answer for a session, for all models."""
+    with _lock:
+        for bucket_key in [key for key in _buckets if key[0] == session_id]:
+            for question in list(_buckets[bucket_key]):
+                _drop(bucket_key, question)
+                _stats["invalidations"] += 1
+
+def get_answer_cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_lru)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -1,12 +1,21 @@
 import streamlit as st
 import os
-from rag_engine import get_documents_text, get_text_chunks, get_vector_store, user_input
-from chat_utils import load_chat_history, group_chat_history, save_chat_session, get_new_session_id, delete_chat_session
+from rag_engine import user_input_stream
+from ingest_jobs import submit_ingest_job, get_job, get_session_jobs, cancel_job
+from chat_utils import list_chat_sessions, load_session_messages, group_chat_history, save_chat_session, get_new_session_id, delete_chat_session, start_compaction_thread
 from datetime import datetime, timedelta
 import uuid
 import extra_streamlit_components as stx
-from video_utils import extract_frames, get_video_summary
-import tempfile
+from video_utils import VIDEO_MODEL, get_video_summary, summarize_long_video
+from video_cache import clear_video_cache, get_cached_frames, get_cached_video_info, get_summary, store_summary, store_video
+from embedding_utils import get_embedding_cache_stats, warm_up_embeddings
+from index_utils import get_index_cache_stats, get_index_version
+from tracing import get_counters, get_recent_traces, get_stage_totals, reset_metrics
+
+# Videos up to this length get one request with evenly spaced frames; longer ones use map-reduce
+SHORT_VIDEO_MAX_SECONDS = 10
+# Sessions shown in the sidebar before "Show more"
+HISTORY_PAGE_SIZE = 20
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -16,6 +25,16 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# --- Optional Embedding Warm-up ---
+# Loads the shared embedding model once per process so the first question doesn't pay the cold start
+if os.getenv("WARMUP_EMBEDDINGS", "").lower() in ("1", "true", "yes"):
+    warm_up_embeddings()
+
+# --- Optional Background Compaction ---
+# Purges expired sessions and orphaned index folders; one thread per process
+if os.getenv("HISTORY_COMPACTION_INTERVAL_HOURS"):
+    start_compaction_thread(float(os.getenv("HISTORY_COMPACTION_INTERVAL_HOURS")))
+
 # --- State Initialization ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -27,6 +46,13 @@ if "confirm_delete" not in st.session_state:
     st.session_state.confirm_delete = None
 if "uploader_key" not in st.session_state:
     st.session_state.uploader_key = str(uuid.uuid4())
+if "ingest_job_id" not in st.session_state:
+    st.session_state.ingest_job_id = None
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+if "video_uploads" not in st.session_state:
+    # file_id of the current video upload -> (content hash, cached path)
+    st.session_state.video_uploads = {}
 
 # --- Device ID Management ---
 cookie_manager = stx.CookieManager(key="cookie_manager")
@@ -164,6 +190,7 @@ def render_sidebar():
             st.session_state.processing_complete = False
             st.session_state.confirm_delete = None
             st.session_state.uploader_key = str(uuid.uuid4())
+            st.session_state.ingest_job_id = None
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -182,24 +209,24 @@ def render_sidebar():
         if pdf_docs:
             st.markdown('<div class="primary-btn">', unsafe_allow_html=True)
             if st.button("⚡ Process Files", use_container_width=True):
-                with st.spinner("Analyzing documents..."):
-                    raw_text = get_documents_text(pdf_docs)
-                    text_chunks = get_text_chunks(raw_text)
-                    get_vector_store(text_chunks, st.session_state.session_id)
-                    st.session_state.processing_complete = True
-                    st.toast("Documents processed successfully!", icon="✅")
+                # Indexed by a background worker; reruns with the same files reuse the job
+                st.session_state.ingest_job_id = submit_ingest_job(st.session_state.session_id, pdf_docs, user_id=device_id)
             st.markdown('</div>', unsafe_allow_html=True)
+
+        if st.session_state.ingest_job_id:
+            render_ingest_progress()
         
         st.divider()
 
         # Chat History
         st.markdown("#### 🕒 Recent")
-        history = load_chat_history(user_id=device_id)
+        # Cached titles and timestamps only; messages are loaded when a chat is opened
+        history = list_chat_sessions(user_id=device_id)
         
         if not history:
             st.caption("No recent chats found.")
         else:
-            grouped_history = group_chat_history(history)
+            grouped_history = group_chat_history(history[:st.session_state.history_limit])
             
             for group_name, sessions in grouped_history.items():
                 if sessions:
@@ -221,15 +248,13 @@ def render_sidebar():
                                 use_container_width=True,
                                 help=session['timestamp']
                             ):
-                                st.session_state.messages = session["messages"]
+                                st.session_state.messages = load_session_messages(session["id"])
                                 st.session_state.session_id = session["id"]
                                 st.session_state.confirm_delete = None
-                                index_path = f"faiss_indexes/{session['id']}"
-                                if os.path.exists(index_path):
-                                    st.session_state.processing_complete = True
-                                else:
-                                    st.session_state.processing_complete = False
+                                st.session_state.processing_complete = get_index_version(session["id"]) is not None
                                 st.session_state.uploader_key = str(uuid.uuid4())
+                                active_jobs = get_session_jobs(session["id"], active_only=True)
+                                st.session_state.ingest_job_id = active_jobs[0]["id"] if active_jobs else None
                                 st.rerun()
                                 
                         with col_del:
@@ -248,6 +273,11 @@ def render_sidebar():
                                     st.session_state.confirm_delete = session["id"]
                                     st.rerun()
 
+            if len(history) > st.session_state.history_limit:
+                if st.button(f"Show more ({len(history) - st.session_state.history_limit})", use_container_width=True):
+                    st.session_state.history_limit += HISTORY_PAGE_SIZE
+                    st.rerun()
+
         st.divider()
         
         # Mode Selection
@@ -278,6 +308,89 @@ def render_sidebar():
             )
             st.session_state.selected_model = model_mapping[selected_model_name]
 
+        # Per-stage timings from the tracing ring buffer, see tracing.py
+        if os.getenv("SHOW_DEBUG_PANEL", "").lower() in ("1", "true", "yes"):
+            render_debug_panel()
+
+@st.fragment(run_every=1.0)
+def render_ingest_progress():
+    """Polls the background ingestion job once a second until it finishes."""
+    job = get_job(st.session_state.ingest_job_id)
+    if job is None or job["session_id"] != st.session_state.session_id:
+        st.session_state.ingest_job_id = None
+        return
+
+    if job["status"] == "done":
+        st.session_state.ingest_job_id = None
+        st.session_state.processing_complete = True
+        st.toast("Documents processed successfully!", icon="✅")
+        st.rerun(scope="app")
+    elif job["status"] == "failed":
+        st.error(f"Processing failed: {job['error']}")
+        if st.button("Dismiss", key="dismiss_job"):
+            st.session_state.ingest_job_id = None
+            st.rerun(scope="app")
+    elif job["status"] == "cancelled":
+        st.session_state.ingest_job_id = None
+        st.toast("Processing cancelled.", icon="🛑")
+        st.rerun(scope="app")
+    else:
+        if job["status"] == "queued":
+            st.caption("⏳ Waiting for a worker...")
+        elif job["stage"] == "saving":
+            st.caption(f"💾 Saving index ({job['chunks_embedded']} chunks)...")
+        else:
+            st.caption(f"📄 {job['pages_extracted']} pages extracted · 🧠 {job['chunks_embedded']} chunks embedded")
+        if job["cancel_requested"]:
+            st.caption("Cancelling...")
+        elif st.button("Cancel", key="cancel_job", use_container_width=True):
+            cancel_job(job["id"])
+
+def render_debug_panel():
+    st.divider()
+    with st.expander("🔍 Debug: pipeline timings"):
+        # Before anything is drawn, so the panel shows the cleared state right away
+        if st.button("Reset metrics", key="reset_metrics"):
+            reset_metrics()
+        traces = get_recent_traces(limit=3)
+        if not traces:
+            st.caption("No traces recorded yet.")
+        for spans in traces:
+            root = spans[0]
+            st.markdown(f"**{root['name']}** · {root['duration_ms']:.0f} ms")
+            st.table([
+                {
+                    "stage": " " * record["depth"] + record["name"],
+                    "ms": round(record["duration_ms"], 1),
+                    "details": ", ".join(f"{k}={v}" for k, v in {**record["attrs"], **record["counters"]}.items())
+                }
+                for record in spans
+            ])
+
+        totals = get_stage_totals()
+        if totals:
+            st.markdown("**Totals since start**")
+            st.table([
+                {
+                    "stage": name,
+                    "calls": stage["count"],
+                    "mean ms": round(stage["total_seconds"] * 1000 / stage["count"], 1),
+                    "max ms": round(stage["max_seconds"] * 1000, 1),
+                    "errors": stage["errors"]
+                }
+                for name, stage in sorted(totals.items())
+            ])
+        counters = get_counters()
+        if counters:
+            st.json(counters)
+
+        st.markdown("**Caches**")
+        st.table([{"cache": "session indexes", **get_index_cache_stats()}])
+        st.table([{"cache": "embeddings", **get_embedding_cache_stats()}])
+        if st.button("Clear video cache", key="clear_video_cache"):
+            clear_video_cache()
+            st.session_state.video_uploads = {}
+
 # --- Main Content ---
 def main():
     inject_custom_css()
@@ -290,36 +403,61 @@ def main():
         video_file = st.file_uploader("Upload a video", type=["mp4", "avi", "mov", "mkv"])
         
         if video_file:
-            # Save temp file
-            tfile = tempfile.NamedTemporaryFile(delete=False) 
-            tfile.write(video_file.read())
-            video_path = tfile.name
+            # Stored once per distinct video; reruns reuse the path, probed info, frames and summary
+            stored = st.session_state.video_uploads.get(video_file.file_id)
+            if stored is None or not os.path.exists(stored[1]):
+                suffix = os.path.splitext(video_file.name)[1].lower()
+                stored = store_video(video_file.getvalue(), suffix)
+                st.session_state.video_uploads = {video_file.file_id: stored}
+            video_key, video_path = stored
             
             st.video(video_path)
             
-            # Check duration
-            import cv2
-            cap = cv2.VideoCapture(video_path)
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps if fps > 0 else 0
-            cap.release()
-            
-            if duration > 10:
-                st.error(f"⚠️ Video is too long ({duration:.1f}s). Please upload a video shorter than 10 seconds.")
+            # Check duration; longer videos are summarized segment by segment
+            duration = get_cached_video_info(video_key, video_path)["duration"]
+            is_long = duration > SHORT_VIDEO_MAX_SECONDS
+            if is_long:
+                st.caption(f"Long video ({duration / 60:.1f} min): it will be summarized in parts and then combined.")
+                summary_params = None
             else:
-                if st.button("✨ Summarize Video", type="primary"):
+                # Scene sampling suits cuts and slides; long videos sample each segment evenly
+                sampling = st.radio(
+                    "Frame sampling",
+                    ["uniform", "scene"],
+                    format_func=lambda mode: {"uniform": "Evenly spaced", "scene": "Scene changes"}[mode],
+                    horizontal=True
+                )
+                summary_params = {"sampling": sampling}
+
+            summary_kind = "long" if is_long else "short"
+            summary = get_summary(video_key, VIDEO_MODEL, summary_kind, summary_params)
+            if summary is None and st.button("✨ Summarize Video", type="primary"):
+                if is_long:
+                    progress = st.progress(0.0, text="Extracting frames and analyzing...")
+
+                    def show_progress(stage, done, total):
+                        if stage == "segments":
+                            progress.progress(done / total, text=f"Summarized {done} of {total} parts...")
+                        else:
+                            progress.progress(1.0, text="Combining the parts...")
+
+                    summary = summarize_long_video(
+                        video_path, os.getenv("OPENROUTER_API_KEY"), progress_callback=show_progress
+                    )
+                    progress.empty()
+                else:
                     with st.spinner("Extracting frames and analyzing..."):
-                        frames = extract_frames(video_path)
+                        frames = get_cached_frames(video_key, video_path, mode=sampling)
                         if frames:
                             summary = get_video_summary(frames, os.getenv("OPENROUTER_API_KEY"))
-                            st.markdown("### 📝 Summary")
-                            st.markdown(summary)
                         else:
                             st.error("Could not extract frames from the video.")
-            
-            # Cleanup
-            tfile.close()
+                if summary is not None:
+                    store_summary(video_key, VIDEO_MODEL, summary_kind, summary, summary_params)
+
+            if summary is not None:
+                st.markdown("### 📝 Summary")
+                st.markdown(summary)
             
     else:
         st.title("Chat with Documents")
@@ -349,18 +487,16 @@ def main():
                 # RENDER DISABLED CHAT INPUT to show "Busy" state
                 st.chat_input("Thinking...", disabled=True)
                 
-                # Generate response immediately
+                # Generate response immediately, rendering tokens as they arrive
                 with st.chat_message("assistant", avatar="✨"):
-                    with st.spinner("Thinking..."):
-                        try:
-                            response = user_input(
-                                st.session_state.messages[-1]["content"], 
-                                st.session_state.get("selected_model", "openai/gpt-oss-20b:free"),
-                                st.session_state.session_id
-                            )
-                        except Exception as e:
-                            response = f"⚠️ An error occurred: {str(e)}"
-                        
+                    try:
+                        response = st.write_stream(user_input_stream(
+                            st.session_state.messages[-1]["content"], 
+                            st.session_state.get("selected_model", "openai/gpt-oss-20b:free"),
+                            st.session_state.session_id
+                        ))
+                    except Exception as e:
+                        response = f"⚠️ An error occurred: {str(e)}"
                         st.markdown(response)
                 
                 st.session_state.messages.append({"role": "assistant", "content": response})
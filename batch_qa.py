@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from answer_cache import lookup_answer_entry, store_answer
+from context_builder import CONTEXT_CANDIDATES
+from embedding_utils import get_embeddings
+from http_client import MODEL_MAX_CONCURRENCY
+from index_utils import get_index_version, load_vector_store
+from lexical_index import HYBRID_FETCH_K, search_vectors
+from rag_engine import answer_from_documents, retrieve_documents
+from tracing import count, span
+
+DEFAULT_MODEL = "openai/gpt-oss-20b:free"
+
+def iter_answers(questions, session_id, model_name=DEFAULT_MODEL, max_concurrency=None, k=CONTEXT_CANDIDATES, use_cache=True):
+    """
+    Answers many questions against one session index and yields a result dict per
+    question as it finishes (not in input order): {"index", "question", "answer",
+    "sources", "cached", "error", "seconds"}. All questions are embedded in one pass and
+    searched with one FAISS call; retrieval then runs here, and LLM calls run on up to
+    max_concurrency threads (default MODEL_MAX_CONCURRENCY), also bounded per model by
+    http_client. A question whose retrieval or LLM call fails yields its error instead of
+    stopping the batch. Cached answers carry the sources stored with them, or None when
+    they are unknown.
+    """
+    questions = list(questions)
+    if not questions:
+        return
+
+    with span("batch_qa", session_id=session_id, model=model_name, questions=len(questions)):
+        embeddings = get_embeddings()
+        with span("index.load"):
+            vector_store = load_vector_store(session_id, embeddings)
+        if vector_store is None:
+            raise ValueError(f"Session {session_id} has no index")
+
+        with span("embed_batch", chunks=len(questions)):
+            question_vectors = embeddings.embed_documents(questions)
+        with span("search", queries=len(questions)):
+            all_positions = search_vectors(vector_store, question_vectors, max(k, HYBRID_FETCH_K))
+        index_version = get_index_version(session_id)
+
+        def answer(i, docs):
+            start = time.perf_counter()
+            result = {"index": i, "question": questions[i], "answer": None, "cached": False, "error": None,
+                      "sources": sorted({doc.metadata.get("source") for doc in docs} - {None})}
+            try:
+                result["answer"] = answer_from_documents(docs, questions[i], model_name)
+                store_answer(session_id, model_name, questions[i], question_vectors[i], result["answer"],
+                             index_version, sources=result["sources"])
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                count("batch_qa_errors")
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency or MODEL_MAX_CONCURRENCY)) as executor:
+            futures = []
+            for i, question in enumerate(questions):
+                if use_cache:
+                    cached = lookup_answer_entry(session_id, model_name, question, question_vectors[i], index_version)
+                    if cached is not None:
+                        yield {"index": i, "question": question, "answer": cached["answer"], "sources": cached["sources"],
+                               "cached": True, "error": None, "seconds": 0.0}
+                        continue
+                # Retrieval is cheap next to the LLM call and stays on this thread
+                start = time.perf_counter()
+                try:
+                    with span("retrieve"):
+                        docs = retrieve_documents(
+                            vector_store, session_id, question, question_vectors[i], model_name, k,
+                            vector_positions=all_positions[i]
+                        )
+                except Exception as e:
+                    count("batch_qa_errors")
+                    yield {"index": i, "question": question, "answer": None, "sources": [], "cached": False,
+                           "error": f"{type(e).__name__}: {e}", "seconds": round(time.perf_counter() - start, 3)}
+                    continue
+                futures.append(executor.submit(answer, i, docs))
+
+            for future in as_completed(futures):
+                yield future.result()
+
+def answer_questions(questions, session_id, model_name=DEFAULT_MODEL, max_concurrency=None, k=CONTEXT_CANDIDATES, use_cache=True):
+    """Like iter_answers but returns the results as a list in input order."""
+    results = list(iter_answers(questions, session_id, model_name, max_concurrency, k, use_cache))
+    return sorted(results, key=lambda result: result["index"])
+
+def read_questions(path):
+    """
+    Reads questions from a text file (one per line) or a JSONL file of objects with a
+    "question" field. Returns (questions, records); records keep any extra JSONL fields.
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+            else:
+                record = {"question": line}
+            records.append(record)
+    return [record["question"] for record in records], records
+
+def write_jsonl(results, path, records=None):
+    """
+    Writes one JSON object per result as it arrives, merged with the matching input
+    record, so a long run can be followed (or resumed by hand) while it is still going.
+    Returns the number of results written.
+    """
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            line = dict(records[result["index"]]) if records else {}
+            line.update(result)
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            f.flush()
+            written += 1
+    return written
+
+if __name__ == "__main__":
+    # Usage: python batch_qa.py <session_id> questions.txt|questions.jsonl [--output answers.jsonl]
+    parser = argparse.ArgumentParser(description="Answer a file of questions against a session index")
+    parser.add_argument("session_id")
+    parser.add_argument("questions", help="Text file with one question per line, or JSONL with a 'question' field")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--output", default="answers.jsonl")
+    parser.add_argument("--concurrency", type=int, default=None, help=f"LLM calls in flight (default {MODEL_MAX_CONCURRENCY})")
+    parser.add_argument("--k", type=int, default=CONTEXT_CANDIDATES, help="Candidate chunks per question")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the answer cache lookup")
+    args = parser.parse_args()
+
+    if not os.getenv("OPENROUTER_API_KEY"):
+        print("OPENROUTER_API_KEY is not set; requests will be rejected")
+    questions, records = read_questions(args.questions)
+    start = time.perf_counter()
+    results = iter_answers(questions, args.session_id, args.model, args.concurrency, args.k, not args.no_cache)
+    written = write_jsonl(results, args.output, records)
+    print(f"Wrote {written} answers to {args.output} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,342 @@
+"""
+Offline benchmark for ingestion and question answering.
+
+Generates a synthetic PDF/DOCX/TXT corpus, runs it through the same functions the app uses
+and writes latency percentiles, throughput, peak RSS and index size as JSON. The LLM is
+replaced by fake_openai_server, so no network access or API key is needed.
+
+    python benchmark.py --docs 4 --pages 20 --queries 50 --output bench.json
+    python benchmark.py --hash-embeddings   # skip the sentence-transformers model
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module; peak RSS is reported as None there
+    resource = None
+
+BENCHMARK_SESSION_ID = "benchmark"
+BENCHMARK_MODEL = "fake-model"
+
+_WORDS = (
+    "invoice payment refund account billing customer order shipping warehouse supplier "
+    "contract clause liability warranty delivery schedule report quarter revenue margin "
+    "forecast budget audit compliance policy retention encryption backup recovery incident "
+    "latency throughput cluster replica index query token embedding vector document"
+).split()
+
+class BenchmarkUpload(io.BytesIO):
+    """In-memory stand-in for Streamlit's UploadedFile."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+class HashEmbeddings(Embeddings):
+    """Deterministic pseudo-random unit vectors, for measuring everything except the model."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+def _sentences(rng, count):
+    for _ in range(count):
+        words = rng.choice(_WORDS, size=int(rng.integers(8, 20)))
+        code = f"ERR_{int(rng.integers(1000, 9999))}"
+        yield " ".join(words).capitalize() + f" ({code})."
+
+def make_txt(rng, pages, sentences_per_page=40):
+    return "\n\n".join(" ".join(_sentences(rng, sentences_per_page)) for _ in range(pages)).encode("utf-8")
+
+def make_docx(rng, pages, sentences_per_page=40):
+    from docx import Document as DocxDocument
+
+    document = DocxDocument()
+    for _ in range(pages):
+        # A few paragraphs per "page"; DOCX has no fixed pagination
+        for _ in range(4):
+            document.add_paragraph(" ".join(_sentences(rng, sentences_per_page // 4)))
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def make_pdf(rng, pages, sentences_per_page=40):
+    """A minimal text PDF (Helvetica, one content stream per page) that pypdf can extract."""
+    objects = []
+    page_ids = []
+    font_id = 3
+    objects.append(None)  # 1: catalog, filled in below
+    objects.append(None)  # 2: page tree
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for _ in range(pages):
+        lines = []
+        line = ""
+        for sentence in _sentences(rng, sentences_per_page):
+            for word in sentence.split():
+                if len(line) + len(word) > 90:
+                    lines.append(line)
+                    line = ""
+                line = f"{line} {word}".strip()
+        lines.append(line)
+
+        text_ops = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        for text_line in lines[:70]:
+            escaped = text_line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            text_ops.append(f"({escaped}) Tj T*")
+        text_ops.append("ET")
+        stream = "\n".join(text_ops).encode("latin-1")
+
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (content_id, font_id)
+        )
+        page_ids.append(len(objects))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref_offset = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return output.getvalue()
+
+def build_corpus(docs_per_type=2, pages=20, seed=0):
+    """Returns upload objects: docs_per_type each of PDF, DOCX and TXT with the given page count."""
+    rng = np.random.default_rng(seed)
+    makers = (("pdf", make_pdf), ("docx", make_docx), ("txt", make_txt))
+    return [
+        BenchmarkUpload(f"synthetic_{i}.{extension}", maker(rng, pages))
+        for i in range(docs_per_type)
+        for extension, maker in makers
+    ]
+
+def make_questions(count, seed=1):
+    """Distinct questions, so every query misses the answer cache and runs the full pipeline."""
+    rng = np.random.default_rng(seed)
+    return [
+        f"What does the document say about {' and '.join(rng.choice(_WORDS, size=2))} "
+        f"for ERR_{int(rng.integers(1000, 9999))} (question {i})?"
+        for i in range(count)
+    ]
+
+def latency_summary(samples):
+    """Percentiles in milliseconds from a list of durations in seconds."""
+    if not samples:
+        return None
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3)
+    }
+
+def get_peak_rss_bytes():
+    """Peak resident memory of this process and of finished worker processes, in bytes."""
+    if resource is None:
+        return None
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    }
+
+def get_folder_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def run_benchmark(docs_per_type=2, pages=20, queries=50, repeats=3, hash_embeddings=False,
+                  max_workers=None, index_strategy=None, seed=0):
+    """
+    Runs every stage `repeats` times (queries once per question) in a scratch directory.
+    Returns the results dict that main() writes as JSON.
+    """
+    import embedding_utils
+    import index_utils
+    import rag_engine
+    from answer_cache import get_answer_cache_stats
+    from native_index import quantization_report
+    from fake_openai_server import start_fake_server
+
+    work_dir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    server, base_url = start_fake_server()
+    previous = (rag_engine.OPENROUTER_BASE_URL, index_utils.INDEX_ROOT, os.environ.get("OPENROUTER_API_KEY"))
+    rag_engine.OPENROUTER_BASE_URL = base_url
+    index_utils.INDEX_ROOT = os.path.join(work_dir, "faiss_indexes")
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+    try:
+        model_name = embedding_utils.EMBEDDING_MODEL_NAME
+        if hash_embeddings:
+            embedding_utils._models[model_name] = HashEmbeddings()
+        model, model_load_seconds = _timed(embedding_utils.get_embeddings, model_name)
+        # A cold on-disk embedding cache per run, so repeats measure the same work
+        def fresh_cached_embeddings(run):
+            cache = embedding_utils.EmbeddingCache(model_name, cache_dir=os.path.join(work_dir, f"embedding_cache_{run}"))
+            embedding_utils._cached_models[model_name] = embedding_utils.CachedEmbeddings(model, cache)
+
+        corpus = build_corpus(docs_per_type, pages, seed)
+        corpus_bytes = sum(len(doc.getvalue()) for doc in corpus)
+        total_pages = docs_per_type * 3 * pages
+
+        timings = {"get_documents_text": [], "get_text_chunks": [], "get_vector_store": []}
+        text = ""
+        chunks = []
+        for run in range(repeats):
+            text, seconds = _timed(rag_engine.get_documents_text, corpus, max_workers=max_workers)
+            timings["get_documents_text"].append(seconds)
+            chunks, seconds = _timed(rag_engine.get_text_chunks, text)
+            timings["get_text_chunks"].append(seconds)
+            fresh_cached_embeddings(run)
+            index_utils.clear_index_cache()
+            _, seconds = _timed(rag_engine.get_vector_store, chunks, BENCHMARK_SESSION_ID, index_strategy)
+            timings["get_vector_store"].append(seconds)
+
+        index_path = index_utils.get_index_path(BENCHMARK_SESSION_ID)
+        index_bytes = get_folder_bytes(index_path)
+
+        query_timings = []
+        answers = 0
+        for question in make_questions(queries, seed + 1):
+            answer, seconds = _timed(rag_engine.user_input, question, BENCHMARK_MODEL, BENCHMARK_SESSION_ID)
+            query_timings.append(seconds)
+            answers += bool(answer)
+
+        def throughput(samples, amount):
+            median = float(np.median(samples)) if samples else 0.0
+            return round(amount / median, 3) if median else None
+
+        return {
+            "benchmark_version": 2,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "docs_per_type": docs_per_type,
+                "pages_per_doc": pages,
+                "queries": queries,
+                "repeats": repeats,
+                "hash_embeddings": hash_embeddings,
+                "max_workers": max_workers,
+                "index_strategy": index_strategy,
+                "seed": seed
+            },
+            "corpus": {
+                "documents": len(corpus),
+                "pages": total_pages,
+                "bytes": corpus_bytes,
+                "characters": len(text),
+                "chunks": len(chunks)
+            },
+            "model_load_seconds": round(model_load_seconds, 3),
+            "stages": {
+                "get_documents_text": {
+                    "latency": latency_summary(timings["get_documents_text"]),
+                    "pages_per_second": throughput(timings["get_documents_text"], total_pages),
+                    "mb_per_second": throughput(timings["get_documents_text"], corpus_bytes / 1e6)
+                },
+                "get_text_chunks": {
+                    "latency": latency_summary(timings["get_text_chunks"]),
+                    "chunks_per_second": throughput(timings["get_text_chunks"], len(chunks))
+                },
+                "get_vector_store": {
+                    "latency": latency_summary(timings["get_vector_store"]),
+                    "chunks_per_second": throughput(timings["get_vector_store"], len(chunks))
+                },
+                "user_input": {
+                    "latency": latency_summary(query_timings),
+                    "queries_per_second": throughput(query_timings, 1),
+                    "answered": answers,
+                    "answer_cache": get_answer_cache_stats()
+                }
+            },
+            "index_bytes_on_disk": index_bytes,
+            # Memory saved vs recall lost by fp16/int8 vectors and compressed texts on this corpus
+            "quantization": quantization_report(index_path),
+            "peak_rss_bytes": get_peak_rss_bytes()
+        }
+    finally:
+        server.shutdown()
+        rag_engine.OPENROUTER_BASE_URL, index_utils.INDEX_ROOT = previous[0], previous[1]
+        if previous[2] is None:
+            os.environ.pop("OPENROUTER_API_KEY", None)
+        index_utils.clear_index_cache()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmark")
+    parser.add_argument("--docs", type=int, default=2, help="Documents generated per type (PDF, DOCX, TXT)")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per generated document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each ingestion stage")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction worker processes")
+    parser.add_argument("--index-strategy", choices=("auto", "flat", "hnsw", "ivfpq"), default=None)
+    parser.add_argument("--hash-embeddings", action="store_true", help="Use deterministic hash vectors instead of the model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.docs, args.pages, args.queries, args.repeats, args.hash_embeddings,
+        args.workers, args.index_strategy, args.seed
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps(results["stages"], indent=4))
+    print(f"Results written to {args.output}")
@@ -1,44 +1,190 @@
 import json
+import logging
 import os
 import shutil
+import sqlite3
+import argparse
+import threading
+import time
+from contextlib import closing
 from datetime import datetime, timedelta
 import uuid
+from index_utils import INDEX_ROOT, get_index_path, evict_vector_store
+import shared_store
+from answer_cache import invalidate_answers
 
+logger = logging.getLogger(__name__)
+
+# Legacy single-file store, only read by the migration
 HISTORY_FILE = "chat_history.json"
+HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "chat_history.db")
+RETENTION_DAYS = 7
+# Index folders without a session row are only treated as orphans after this long,
+# a fresh upload has an index before its first message is saved
+ORPHAN_GRACE_HOURS = 24
+
+# Sidebar listings are cached per user and dropped whenever the history is written;
+# the TTL keeps the 7-day window moving in long-lived processes
+HISTORY_CACHE_TTL_SECONDS = 300
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+# user_id -> (loaded_at, session summaries newest first)
+_summary_cache = {}
+_summary_cache_lock = threading.Lock()
+
+def invalidate_history_cache():
+    with _summary_cache_lock:
+        _summary_cache.clear()
+
+def _connect():
+    """Opens the history database in WAL mode, creating the schema on first use."""
+    is_new = not os.path.exists(HISTORY_DB)
+    conn = sqlite3.connect(HISTORY_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+
+    if HISTORY_DB not in _schema_ready:
+        with _schema_lock:
+            if HISTORY_DB not in _schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        id TEXT PRIMARY KEY,
+                        user_id TEXT,
+                        title TEXT NOT NULL,
+                        timestamp TEXT NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_sessions_user_ts ON sessions (user_id, timestamp);
+                    CREATE INDEX IF NOT EXISTS idx_sessions_ts ON sessions (timestamp);
+                    CREATE TABLE IF NOT EXISTS messages (
+                        session_id TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        PRIMARY KEY (session_id, seq)
+                    );
+                """)
+                conn.commit()
+                _schema_ready.add(HISTORY_DB)
+                # First run against a new database: carry over the old JSON history
+                if is_new and os.path.exists(HISTORY_FILE):
+                    _import_sessions(conn, _read_json_sessions(HISTORY_FILE))
+    return conn
+
+def _read_json_sessions(json_path):
+    try:
+        with open(json_path, "r") as f:
+            return json.load(f).get("sessions", [])
+    except (json.JSONDecodeError, IOError):
+        return []
+
+def _import_sessions(conn, sessions):
+    """Inserts sessions in the old JSON shape, skipping ids already in the database."""
+    imported = 0
+    with conn:
+        for session in sessions:
+            try:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO sessions (id, user_id, title, timestamp) VALUES (?, ?, ?, ?)",
+                    (session["id"], session.get("user_id"), session.get("title") or "New Chat", session["timestamp"])
+                )
+            except KeyError:
+                continue
+            if cursor.rowcount == 0:
+                continue
+            conn.executemany(
+                "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session["id"], i, m["role"], m["content"]) for i, m in enumerate(session.get("messages", []))]
+            )
+            imported += 1
+    return imported
+
+def migrate_json_history(json_path=HISTORY_FILE):
+    """Imports sessions from a chat_history.json file. Returns the number of sessions imported."""
+    with closing(_connect()) as conn:
+        imported = _import_sessions(conn, _read_json_sessions(json_path))
+    invalidate_history_cache()
+    return imported
+
+def _load_messages(conn, session_ids):
+    messages = {session_id: [] for session_id in session_ids}
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(session_ids), 500):
+        part = session_ids[start:start + 500]
+        placeholders = ",".join("?" * len(part))
+        for row in conn.execute(
+            f"SELECT session_id, role, content FROM messages WHERE session_id IN ({placeholders}) ORDER BY session_id, seq",
+            part
+        ):
+            messages[row["session_id"]].append({"role": row["role"], "content": row["content"]})
+    return messages
 
 def load_chat_history(user_id=None):
     """Loads chat history, filters by user_id and 7-day retention."""
-    if not os.path.exists(HISTORY_FILE):
+    seven_days_ago = (datetime.now() - timedelta(days=RETENTION_DAYS)).isoformat()
+
+    try:
+        with closing(_connect()) as conn:
+            if user_id:
+                rows = conn.execute(
+                    "SELECT id, user_id, title, timestamp FROM sessions WHERE user_id = ? AND timestamp > ? ORDER BY timestamp DESC",
+                    (user_id, seven_days_ago)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, user_id, title, timestamp FROM sessions WHERE timestamp > ? ORDER BY timestamp DESC",
+                    (seven_days_ago,)
+                ).fetchall()
+            messages = _load_messages(conn, [row["id"] for row in rows])
+    except sqlite3.Error:
         return []
 
+    # Newest first, same shape as the old JSON sessions
+    return [
+        {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "timestamp": row["timestamp"],
+            "title": row["title"],
+            "messages": messages[row["id"]]
+        }
+        for row in rows
+    ]
+
+def list_chat_sessions(user_id=None):
+    """
+    Like load_chat_history but without the messages: id, user_id, title and timestamp of
+    each session, newest first. Served from an in-process cache until the history changes.
+    """
+    now = time.time()
+    with _summary_cache_lock:
+        cached = _summary_cache.get(user_id)
+        if cached is not None and now - cached[0] < HISTORY_CACHE_TTL_SECONDS:
+            return cached[1]
+
+    seven_days_ago = (datetime.now() - timedelta(days=RETENTION_DAYS)).isoformat()
+    query = "SELECT id, user_id, title, timestamp FROM sessions WHERE timestamp > ?"
+    params = [seven_days_ago]
+    if user_id:
+        query += " AND user_id = ?"
+        params.append(user_id)
     try:
-        with open(HISTORY_FILE, "r") as f:
-            data = json.load(f)
-            sessions = data.get("sessions", [])
-    except (json.JSONDecodeError, IOError):
+        with closing(_connect()) as conn:
+            sessions = [dict(row) for row in conn.execute(query + " ORDER BY timestamp DESC", params)]
+    except sqlite3.Error:
         return []
 
-    # Filter sessions older than 7 days
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    valid_sessions = []
-    
-    for session in sessions:
-        try:
-            session_date = datetime.fromisoformat(session["timestamp"])
-            if session_date > seven_days_ago:
-                # Filter by user_id if provided
-                if user_id:
-                    if session.get("user_id") == user_id:
-                        valid_sessions.append(session)
-                else:
-                    valid_sessions.append(session)
-        except (ValueError, KeyError):
-            continue
-            
-    # Sort by timestamp descending (newest first)
-    valid_sessions.sort(key=lambda x: x["timestamp"], reverse=True)
-    
-    return valid_sessions
+    with _summary_cache_lock:
+        _summary_cache[user_id] = (now, sessions)
+    return sessions
+
+def load_session_messages(session_id):
+    """The messages of one session, loaded when it is opened."""
+    try:
+        with closing(_connect()) as conn:
+            return _load_messages(conn, [session_id])[session_id]
+    except sqlite3.Error:
+        return []
 
 def group_chat_history(sessions):
     """Groups sessions into Today, Yesterday, and Previous 7 Days."""
@@ -68,20 +214,12 @@ def group_chat_history(sessions):
     return grouped
 
 def save_chat_session(session_id, messages, user_id=None, title=None):
-    """Saves or updates a chat session."""
-    if not os.path.exists(HISTORY_FILE):
-        sessions = []
-    else:
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                data = json.load(f)
-                sessions = data.get("sessions", [])
-        except (json.JSONDecodeError, IOError):
-            sessions = []
-    
-    existing_session = next((s for s in sessions if s["id"] == session_id), None)
+    """
+    Saves or updates a chat session.
+    Only messages beyond those already stored are inserted, so each turn is an append.
+    """
     timestamp = datetime.now().isoformat()
-    
+
     if not title and messages:
         first_user_msg = next((m for m in messages if m["role"] == "user"), None)
         if first_user_msg:
@@ -92,52 +230,202 @@ def save_chat_session(session_id, messages, user_id=None, title=None):
     elif not title:
         title = "New Chat"
 
-    if existing_session:
-        existing_session["messages"] = messages
-        existing_session["timestamp"] = timestamp
-        if existing_session["title"] == "New Chat" and title != "New Chat":
-             existing_session["title"] = title
-        if user_id and "user_id" not in existing_session:
-             existing_session["user_id"] = user_id
-    else:
-        new_session = {
-            "id": session_id,
-            "user_id": user_id,
-            "timestamp": timestamp,
-            "title": title,
-            "messages": messages
-        }
-        sessions.insert(0, new_session)
-    
     try:
-        with open(HISTORY_FILE, "w") as f:
-            json.dump({"sessions": sessions}, f, indent=4)
-    except IOError:
+        with closing(_connect()) as conn, conn:
+            existing_session = conn.execute(
+                "SELECT title, user_id FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+
+            if existing_session:
+                new_title = existing_session["title"]
+                if new_title == "New Chat" and title != "New Chat":
+                    new_title = title
+                conn.execute(
+                    "UPDATE sessions SET timestamp = ?, title = ?, user_id = COALESCE(user_id, ?) WHERE id = ?",
+                    (timestamp, new_title, user_id, session_id)
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO sessions (id, user_id, title, timestamp) VALUES (?, ?, ?, ?)",
+                    (session_id, user_id, title, timestamp)
+                )
+
+            stored_count = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if stored_count > len(messages):
+                # History was shortened in the UI; rewrite it
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                stored_count = 0
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, i, m["role"], m["content"]) for i, m in enumerate(messages) if i >= stored_count]
+            )
+    except sqlite3.Error:
         pass
+    invalidate_history_cache()
 
 def get_new_session_id():
     return str(uuid.uuid4())
 
 def delete_chat_session(session_id):
-    """Deletes chat session from JSON and removes associated vector store."""
-    # 1. Remove from JSON
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                data = json.load(f)
-                sessions = data.get("sessions", [])
-            
-            sessions = [s for s in sessions if s["id"] != session_id]
-            
-            with open(HISTORY_FILE, "w") as f:
-                json.dump({"sessions": sessions}, f, indent=4)
-        except (json.JSONDecodeError, IOError):
-            pass
+    """Deletes chat session from the history database and removes associated vector store."""
+    # 1. Remove from the database
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+    except sqlite3.Error:
+        pass
+    invalidate_history_cache()
 
-    # 2. Remove specific Vector Store folder
-    index_path = f"faiss_indexes/{session_id}"
+    # 2. Remove specific Vector Store folder and drop it and its answers from the in-process caches
+    evict_vector_store(session_id)
+    invalidate_answers(session_id)
+    if shared_store.SHARED_STORE_ENABLED:
+        # Tombstoned only; compact_history reclaims the space
+        shared_store.delete_session(session_id)
+    index_path = get_index_path(session_id)
     if os.path.exists(index_path):
         try:
             shutil.rmtree(index_path)
         except OSError:
-            pass
\ No newline at end of file
+            pass
+
+def _folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _db_size():
+    return sum(
+        os.path.getsize(path) for path in (HISTORY_DB, HISTORY_DB + "-wal")
+        if os.path.exists(path)
+    )
+
+def compact_history(dry_run=False, retention_days=RETENTION_DAYS, orphan_grace_hours=ORPHAN_GRACE_HOURS):
+    """
+    Purges sessions past the retention window and index folders that no session references.
+    With dry_run nothing is deleted and the report shows what would be reclaimed.
+    Returns a report dict with the rows and bytes reclaimed.
+    """
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    report = {
+        "dry_run": dry_run,
+        "expired_sessions": 0,
+        "deleted_messages": 0,
+        "orphaned_indexes": 0,
+        "index_bytes": 0,
+        "db_bytes": 0
+    }
+
+    db_size_before = _db_size()
+    with closing(_connect()) as conn, conn:
+        expired_ids = {row["id"] for row in conn.execute("SELECT id FROM sessions WHERE timestamp <= ?", (cutoff,))}
+        live_ids = {row["id"] for row in conn.execute("SELECT id FROM sessions WHERE timestamp > ?", (cutoff,))}
+        message_rows, message_bytes = conn.execute(
+            """SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages
+               WHERE session_id NOT IN (SELECT id FROM sessions WHERE timestamp > ?)""",
+            (cutoff,)
+        ).fetchone()
+        report["expired_sessions"] = len(expired_ids)
+        report["deleted_messages"] = message_rows
+
+        if not dry_run:
+            # Also drops messages whose session row is already gone
+            conn.execute(
+                "DELETE FROM messages WHERE session_id NOT IN (SELECT id FROM sessions WHERE timestamp > ?)",
+                (cutoff,)
+            )
+            conn.execute("DELETE FROM sessions WHERE timestamp <= ?", (cutoff,))
+            invalidate_history_cache()
+
+    if dry_run:
+        report["db_bytes"] = message_bytes
+    elif expired_ids or message_rows:
+        with closing(_connect()) as conn:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        report["db_bytes"] = max(0, db_size_before - _db_size())
+
+    # Index folders: expired sessions, plus folders nothing references once they're past the grace period
+    grace_cutoff = time.time() - orphan_grace_hours * 3600
+    if os.path.isdir(INDEX_ROOT):
+        for entry in os.scandir(INDEX_ROOT):
+            if not entry.is_dir():
+                continue
+            if entry.name in live_ids:
+                continue
+            if entry.name not in expired_ids and entry.stat().st_mtime > grace_cutoff:
+                continue
+
+            report["orphaned_indexes"] += 1
+            report["index_bytes"] += _folder_size(entry.path)
+            if not dry_run:
+                evict_vector_store(entry.name)
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    # Shared store: tombstone expired sessions and, past the grace period, sessions with chunks
+    # but no chat row, then drop tombstoned chunks from the shards
+    if shared_store.SHARED_STORE_ENABLED:
+        shared_ids = {
+            session_id for session_id, version in shared_store.list_sessions().items()
+            if session_id in expired_ids or (session_id not in live_ids and version <= grace_cutoff)
+        }
+        report["shared_sessions"] = len(shared_ids)
+        if dry_run:
+            report["shared_tombstoned_chunks"] = shared_store.get_shared_stats()["tombstoned"]
+        else:
+            for session_id in shared_ids:
+                shared_store.delete_session(session_id)
+            report["shared_store"] = shared_store.compact()
+
+    report["bytes_reclaimed"] = report["index_bytes"] + report["db_bytes"]
+    return report
+
+_compaction_thread = None
+
+def start_compaction_thread(interval_hours=24):
+    """Runs compact_history every interval_hours on a daemon thread. Only one thread is started per process."""
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return _compaction_thread
+
+    def run():
+        while True:
+            try:
+                report = compact_history()
+                logger.info("History compaction: %s", report)
+            except Exception:
+                # Keep the thread alive; the next run may succeed
+                logger.exception("History compaction failed")
+            time.sleep(interval_hours * 3600)
+
+    _compaction_thread = threading.Thread(target=run, name="history-compaction", daemon=True)
+    _compaction_thread.start()
+    return _compaction_thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat history maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Import sessions from a chat_history.json file")
+    migrate_parser.add_argument("json_path", nargs="?", default=HISTORY_FILE)
+
+    compact_parser = subparsers.add_parser("compact", help="Purge expired sessions and orphaned index folders")
+    compact_parser.add_argument("--dry-run", action="store_true", help="Report what would be reclaimed without deleting")
+    compact_parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    compact_parser.add_argument("--orphan-grace-hours", type=float, default=ORPHAN_GRACE_HOURS)
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        count = migrate_json_history(args.json_path)
+        print(f"Imported {count} sessions from {args.json_path} into {HISTORY_DB}")
+    else:
+        report = compact_history(args.dry_run, args.retention_days, args.orphan_grace_hours)
+        print(json.dumps(report, indent=4))
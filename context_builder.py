@@ -0,0 +1,103 @@
+import os
+import numpy as np
+from langchain_core.documents import Document
+
+# Context tokens per model offered in the sidebar; anything else uses CONTEXT_TOKEN_BUDGET
+MODEL_TOKEN_BUDGETS = {
+    "openai/gpt-oss-20b:free": 4000,
+    "qwen/qwen3-coder:free": 4000
+}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Chunks retrieved as candidates before packing
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+# 1.0 ranks purely by relevance, lower values favour chunks unlike those already picked
+MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# A chunk that doesn't fit is trimmed into the leftover budget only if at least this much is left
+MIN_TRIM_TOKENS = 64
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    """tiktoken's cl100k encoding if available (it may need a download), else None."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def trim_to_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def get_token_budget(model_name):
+    return MODEL_TOKEN_BUDGETS.get(model_name, CONTEXT_TOKEN_BUDGET)
+
+def mmr_order(query_vector, doc_vectors, lambda_mult=MMR_LAMBDA):
+    """Orders candidates by maximal marginal relevance: relevant to the query, unlike each other."""
+    doc_vectors = np.asarray(doc_vectors, dtype=np.float32)
+    doc_vectors = doc_vectors / np.maximum(np.linalg.norm(doc_vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = doc_vectors @ query
+    redundancy = np.full(len(doc_vectors), -np.inf, dtype=np.float32)
+    remaining = list(range(len(doc_vectors)))
+    order = []
+    while remaining:
+        penalty = np.where(np.isinf(redundancy[remaining]), 0.0, redundancy[remaining])
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * penalty
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        redundancy = np.maximum(redundancy, doc_vectors @ doc_vectors[best])
+    return order
+
+def build_context(docs, query_vector, doc_vectors, token_budget, lambda_mult=MMR_LAMBDA):
+    """
+    Picks and trims candidate chunks (given best first) to fit token_budget.
+    With doc_vectors the picks follow MMR order, otherwise relevance order.
+    Returns the packed Documents and a stats dict with the tokens used against the budget
+    and the tokens saved against sending every candidate whole.
+    """
+    token_counts = [count_tokens(doc.page_content) for doc in docs]
+    if doc_vectors is not None and len(docs) > 1:
+        order = mmr_order(query_vector, doc_vectors, lambda_mult)
+    else:
+        order = list(range(len(docs)))
+
+    packed = []
+    used = 0
+    for i in order:
+        remaining = token_budget - used
+        if token_counts[i] <= remaining:
+            packed.append(docs[i])
+            used += token_counts[i]
+        elif remaining >= MIN_TRIM_TOKENS:
+            text = trim_to_tokens(docs[i].page_content, remaining)
+            packed.append(Document(page_content=text, metadata={**docs[i].metadata, "trimmed": True}))
+            used += count_tokens(text)
+            break
+        else:
+            break
+
+    stats = {
+        "candidates": len(docs),
+        "packed": len(packed),
+        "budget": token_budget,
+        "tokens_used": used,
+        "tokens_saved": sum(token_counts) - used
+    }
+    return packed, stats
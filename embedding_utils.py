@@ -0,0 +1,324 @@
+import os
+import re
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Persistent chunk-embedding cache shared by every session
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+_models = {}
+_cached_models = {}
+_load_stats = {}
+_lock = threading.Lock()
+
+def _get_rss_bytes():
+    """Returns the resident memory of this process in bytes, or None if unknown."""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def get_embeddings(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Returns the process-wide embeddings instance for model_name.
+    The model is loaded once on first use and shared by every Streamlit session.
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        model = _models.get(model_name)
+        if model is not None:
+            return model
+
+        rss_before = _get_rss_bytes()
+        start = time.perf_counter()
+        model = HuggingFaceEmbeddings(model_name=model_name)
+        load_seconds = time.perf_counter() - start
+        rss_after = _get_rss_bytes()
+
+        rss_delta = None
+        if rss_before is not None and rss_after is not None:
+            rss_delta = rss_after - rss_before
+
+        _load_stats[model_name] = {
+            "model_name": model_name,
+            "load_seconds": load_seconds,
+            "rss_delta_bytes": rss_delta,
+            "rss_bytes": rss_after,
+            "loaded_at": time.time()
+        }
+        _models[model_name] = model
+
+        memory_note = f", +{rss_delta / (1024 * 1024):.1f} MB RSS" if rss_delta is not None else ""
+        logger.info("Loaded embedding model '%s' in %.2fs%s", model_name, load_seconds, memory_note)
+
+    return model
+
+def warm_up_embeddings(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Loads the model and runs one dummy embedding so the first real query
+    does not pay the cold-start cost. Safe to call on every rerun.
+    """
+    if model_name in _load_stats and _load_stats[model_name].get("warm"):
+        return get_embedding_stats(model_name)
+
+    model = get_embeddings(model_name)
+    start = time.perf_counter()
+    model.embed_query("warm up")
+    with _lock:
+        _load_stats[model_name]["warm"] = True
+        _load_stats[model_name]["warm_up_seconds"] = time.perf_counter() - start
+    return get_embedding_stats(model_name)
+
+def get_embedding_stats(model_name=None):
+    """Returns load time and memory stats for one model, or for all loaded models."""
+    with _lock:
+        if model_name is not None:
+            stats = _load_stats.get(model_name)
+            return dict(stats) if stats else None
+        return {name: dict(stats) for name, stats in _load_stats.items()}
+
+class EmbeddingCache:
+    """
+    Content-addressed store of chunk vectors for one model.
+    Vectors live in an append-only float32 file read through a memory map; a SQLite table
+    maps sha256(chunk text) to its row and tracks last use for size-based LRU eviction.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.folder = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        os.makedirs(self.folder, exist_ok=True)
+        self.vectors_path = os.path.join(self.folder, "vectors.f32")
+        self.db_path = os.path.join(self.folder, "index.sqlite")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @contextmanager
+    def _connect(self, write=False):
+        """Yields a connection inside one transaction; write=True takes the lock across processes."""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_dim(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    @staticmethod
+    def _lookup_rows(conn, hashes):
+        rows = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            for text_hash, row in conn.execute(
+                f"SELECT hash, row FROM vectors WHERE hash IN ({placeholders})", part
+            ):
+                rows[text_hash] = row
+        return rows
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes):
+        """Returns {hash: vector} for the hashes that are cached."""
+        found = {}
+        if not hashes:
+            return found
+
+        with self._lock, self._connect(write=True) as conn:
+            dim = self._get_dim(conn)
+            rows = {}
+            if dim is not None and os.path.exists(self.vectors_path):
+                rows = self._lookup_rows(conn, list(dict.fromkeys(hashes)))
+
+            if rows:
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, dim)
+                for text_hash, row in rows.items():
+                    found[text_hash] = np.array(vectors[row])
+                del vectors
+                now = time.time()
+                conn.executemany(
+                    "UPDATE vectors SET last_used = ? WHERE hash = ?", [(now, h) for h in rows]
+                )
+
+            for text_hash in hashes:
+                if text_hash in found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, hashes, vectors):
+        """Appends new vectors to the store, skipping hashes that are already cached."""
+        if not hashes:
+            return
+
+        pending = {}
+        for text_hash, vector in zip(hashes, np.asarray(vectors, dtype=np.float32)):
+            pending.setdefault(text_hash, vector)
+
+        # The write transaction serialises writers across processes, row numbers depend on the file length
+        with self._lock, self._connect(write=True) as conn:
+            dim = self._get_dim(conn)
+            if dim is None:
+                dim = len(next(iter(pending.values())))
+                conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+
+            existing = self._lookup_rows(conn, list(pending))
+            new_items = [(h, v) for h, v in pending.items() if h not in existing]
+            if not new_items:
+                return
+
+            with open(self.vectors_path, "ab") as f:
+                first_row = f.tell() // (dim * 4)
+                f.write(np.stack([v for _, v in new_items]).tobytes())
+
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO vectors (hash, row, last_used) VALUES (?, ?, ?)",
+                [(h, first_row + i, now) for i, (h, _) in enumerate(new_items)]
+            )
+            self._evict_if_needed(conn, dim)
+
+    def _evict_if_needed(self, conn, dim):
+        """
+        When the vector file exceeds max_bytes, keeps the most recently used rows
+        filling 80% of the limit and rewrites the file compactly. Caller holds the write lock.
+        """
+        if os.path.getsize(self.vectors_path) <= self.max_bytes:
+            return
+
+        keep_rows = max(1, int(self.max_bytes * 0.8) // (dim * 4))
+        kept = conn.execute(
+            "SELECT hash, row, last_used FROM vectors ORDER BY last_used DESC LIMIT ?", (keep_rows,)
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, dim)
+        tmp_path = self.vectors_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for _, row, _ in kept:
+                f.write(np.asarray(vectors[row]).tobytes())
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+
+        conn.execute("DELETE FROM vectors")
+        conn.executemany(
+            "INSERT INTO vectors (hash, row, last_used) VALUES (?, ?, ?)",
+            [(text_hash, i, last_used) for i, (text_hash, _, last_used) in enumerate(kept)]
+        )
+        self.evictions += total - len(kept)
+
+    def get_stats(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        lookups = self.hits + self.misses
+        return {
+            "model_name": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size
+        }
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so embed_documents only computes vectors for chunks
+    that are not already in the EmbeddingCache. Queries are never cached.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        hashes = [EmbeddingCache.hash_text(text) for text in texts]
+        found = self.cache.get_many(hashes)
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(list(missing.keys()), new_vectors)
+            for text_hash, vector in zip(missing.keys(), new_vectors):
+                found[text_hash] = vector
+
+        return [list(map(float, found[text_hash])) for text_hash in hashes]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+def get_cached_embeddings(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Returns the shared model wrapped with the on-disk embedding cache.
+    Use it for ingestion so re-uploaded documents cost only hashing and lookups.
+    """
+    model = _cached_models.get(model_name)
+    if model is not None:
+        return model
+
+    embeddings = get_embeddings(model_name)
+    with _lock:
+        if model_name not in _cached_models:
+            _cached_models[model_name] = CachedEmbeddings(embeddings, EmbeddingCache(model_name))
+        return _cached_models[model_name]
+
+def get_embedding_cache_stats(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Returns the size of the on-disk embedding cache and this process's hit/miss counts,
+    which stay at zero where ingestion runs in worker processes.
+    """
+    model = _cached_models.get(model_name)
+    cache = model.cache if model else EmbeddingCache(model_name)
+    return cache.get_stats()
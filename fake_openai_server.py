@@ -0,0 +1,148 @@
+"""
+Minimal OpenAI-compatible chat completions server for local testing and benchmarks.
+Point the app at it with OPENROUTER_BASE_URL=http://127.0.0.1:<port>/v1
+
+    python fake_openai_server.py --port 8765 --reply "Hello from the fake model" --token-delay 0.02
+    python fake_openai_server.py --latency 2 --rate-limit-every 5   # slow, every 5th request gets a 429
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "This is a fake answer generated for local testing."
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Set per server in start_fake_server
+    reply = DEFAULT_REPLY
+    token_delay = 0.0
+    latency = 0.0
+    rate_limit_every = 0
+    retry_after = 1.0
+    # Shared across handler instances: {"requests": n}
+    counters = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.counters["lock"]:
+            self.counters["requests"] += 1
+            request_number = self.counters["requests"]
+        if self.rate_limit_every and request_number % self.rate_limit_every == 0:
+            body = json.dumps({"error": {"message": "Rate limit exceeded", "code": 429}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Retry-After", str(self.retry_after))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        model = request.get("model", "fake-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(self.reply.split()), "total_tokens": 0}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send_event(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_event({"role": "assistant", "content": ""})
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            send_event({"content": word if i == 0 else " " + word})
+        send_event({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def start_fake_server(port=0, reply=DEFAULT_REPLY, token_delay=0.0, latency=0.0, rate_limit_every=0, retry_after=1.0):
+    """
+    Starts the fake server on a background thread.
+    With rate_limit_every=n every n-th request is answered with a 429 and Retry-After.
+    Returns (server, base_url); call server.shutdown() when done.
+    """
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "reply": reply,
+        "token_delay": token_delay,
+        "latency": latency,
+        "rate_limit_every": rate_limit_every,
+        "retry_after": retry_after,
+        "counters": {"requests": 0, "lock": threading.Lock()}
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every n-th request with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(
+        args.port, args.reply, args.token_delay, args.latency, args.rate_limit_every, args.retry_after
+    )
+    print(f"Fake OpenAI-compatible server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from tracing import count
+
+# Shared by every request to OpenRouter (or any OpenAI-compatible endpoint)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "1.0"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "30"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# Requests in flight per model; free-tier models are rate limited per key
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "4"))
+MODEL_CONCURRENCY_LIMITS = {}
+
+_lock = threading.Lock()
+_session = None
+_httpx_client = None
+_model_slots = {}
+
+def get_session():
+    """Process-wide requests session with a keep-alive connection pool."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # Retries are done in post_chat_completion so they can respect the rate-limit gate
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get_httpx_client():
+    """Process-wide httpx client for the OpenAI SDK behind ChatOpenAI."""
+    global _httpx_client
+    with _lock:
+        if _httpx_client is None:
+            _httpx_client = httpx.Client(
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+            )
+        return _httpx_client
+
+def _get_model_slot(model_name):
+    with _lock:
+        slot = _model_slots.get(model_name)
+        if slot is None:
+            limit = MODEL_CONCURRENCY_LIMITS.get(model_name, MODEL_MAX_CONCURRENCY)
+            slot = _model_slots[model_name] = threading.BoundedSemaphore(max(1, limit))
+        return slot
+
+@contextmanager
+def model_slot(model_name):
+    """Blocks while the model already has its maximum number of requests in flight."""
+    slot = _get_model_slot(model_name)
+    start = time.perf_counter()
+    slot.acquire()
+    waited = time.perf_counter() - start
+    if waited > 0.01:
+        count("model_slot_waits")
+    try:
+        yield
+    finally:
+        slot.release()
+
+def backoff_seconds(attempt):
+    """Exponential back-off with full jitter for the given retry attempt (0-based)."""
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+class RateLimitGate:
+    """
+    Shared back-off for concurrent requests to one endpoint. A 429 (or a response saying
+    no requests are left) pauses every worker until the limit resets, instead of each
+    worker hammering the endpoint with its own retries.
+    """
+
+    def __init__(self):
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.time()
+            if delay <= 0:
+                return
+            time.sleep(min(delay, 1.0))
+
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.time() + seconds)
+        count("rate_limit_pauses")
+
+    def observe(self, response):
+        """Reads Retry-After / X-RateLimit-* headers from a response."""
+        retry_after = response.headers.get("Retry-After")
+        if response.status_code == 429:
+            try:
+                self.pause(float(retry_after))
+            except (TypeError, ValueError):
+                self.pause(HTTP_BACKOFF_BASE_SECONDS)
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                # OpenRouter sends the reset time in epoch milliseconds
+                self.pause(max(0.0, int(response.headers["X-RateLimit-Reset"]) / 1000 - time.time()))
+            except (KeyError, ValueError):
+                pass
+
+# One gate per endpoint, shared by every caller in the process
+_gates = {}
+
+def get_rate_limit_gate(base_url):
+    with _lock:
+        if base_url not in _gates:
+            _gates[base_url] = RateLimitGate()
+        return _gates[base_url]
+
+def _parse_completion(response):
+    """
+    Returns (content, None) for a usable body, else (None, (status, message)). OpenRouter
+    can answer 200 with {"error": {"code": 429, ...}} or a body that isn't JSON at all.
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        return None, (502, f"invalid JSON body: {response.text[:200]}")
+    if isinstance(body, dict) and body.get("error"):
+        error = body["error"]
+        if not isinstance(error, dict):
+            return None, (502, str(error)[:200])
+        try:
+            status = int(error.get("code"))
+        except (TypeError, ValueError):
+            status = 502
+        return None, (status, str(error.get("message", error))[:200])
+    try:
+        content = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None, (502, f"unexpected response body: {response.text[:200]}")
+    if content is None:
+        return None, (502, "response has no message content")
+    return content, None
+
+def post_chat_completion(base_url, api_key, data, max_retries=None, timeout=None):
+    """
+    POSTs a chat completion over the pooled session, holding one of the model's concurrency
+    slots, and retries timeouts, connection errors, 429 and 5xx responses with jittered
+    exponential back-off. A 200 whose body is not JSON, lacks a message or carries an
+    "error" object counts as a failure with that error's code (502 if it has none), so it
+    is retried the same way. Returns the message content; every failure surfaces as
+    RuntimeError, with the last error once retries run out or straight away for other 4xx.
+    """
+    max_retries = HTTP_MAX_RETRIES if max_retries is None else max_retries
+    url = f"{base_url}/chat/completions"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = json.dumps(data)
+    gate = get_rate_limit_gate(base_url)
+    session = get_session()
+    count("http_request_bytes", len(payload))
+
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            with model_slot(data.get("model")):
+                response = session.post(
+                    url, headers=headers, data=payload,
+                    timeout=timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+                )
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            count("http_response_bytes", len(response.content))
+            gate.observe(response)
+            status = response.status_code
+            error = f"{status} - {response.text[:200]}"
+            if status == 200:
+                content, failure = _parse_completion(response)
+                if failure is None:
+                    return content
+                status, message = failure
+                error = f"{status} - {message}"
+                if status == 429:
+                    gate.pause(HTTP_BACKOFF_BASE_SECONDS)
+            if status != 429 and status < 500:
+                raise RuntimeError(error)
+        if attempt < max_retries:
+            count("http_retries")
+            time.sleep(backoff_seconds(attempt))
+    raise RuntimeError(error)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import faiss
+
+INDEX_STRATEGIES = ("auto", "flat", "hnsw", "ivfpq")
+INDEX_STRATEGY = os.getenv("INDEX_STRATEGY", "auto")
+INDEX_PARAMS_FILE = "index_params.json"
+
+# "auto" keeps exact search for small sessions and switches as the chunk count grows
+HNSW_MIN_CHUNKS = int(os.getenv("HNSW_MIN_CHUNKS", "50000"))
+IVFPQ_MIN_CHUNKS = int(os.getenv("IVFPQ_MIN_CHUNKS", "500000"))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_NBITS = 8
+# k-means wants ~39 training points per centroid; 256 PQ centroids need about this many vectors
+IVFPQ_MIN_TRAIN = 256 * 39
+
+def choose_index_strategy(chunk_count, strategy=None):
+    """Resolves "auto" (or None) to a concrete index type for the given number of chunks."""
+    strategy = strategy or INDEX_STRATEGY
+    if strategy not in INDEX_STRATEGIES:
+        raise ValueError(f"Unknown index strategy '{strategy}', expected one of {INDEX_STRATEGIES}")
+    if strategy == "ivfpq" and chunk_count < IVFPQ_MIN_TRAIN:
+        # Too few vectors to train product quantization; HNSW is the next best approximate index
+        strategy = "hnsw"
+    if strategy != "auto":
+        return strategy
+    if chunk_count >= IVFPQ_MIN_CHUNKS:
+        return "ivfpq"
+    if chunk_count >= HNSW_MIN_CHUNKS:
+        return "hnsw"
+    return "flat"
+
+def get_index_type(index):
+    if not isinstance(index, faiss.Index):
+        # native_index.RescoredIndex: a quantized stand-in for a flat index
+        return "flat"
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    return "flat"
+
+def _pq_subquantizers(dim):
+    """Largest sub-quantizer count with at least 8 dimensions each that divides dim."""
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def build_faiss_index(vectors, strategy):
+    """
+    Builds an index of the given concrete type over vectors.
+    Returns the index and the parameters used, which are saved next to the index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+
+    if strategy == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        params = {"M": HNSW_M, "efConstruction": HNSW_EF_CONSTRUCTION, "efSearch": HNSW_EF_SEARCH}
+    elif strategy == "ivfpq":
+        nlist = max(1, min(int(4 * np.sqrt(count)), count // 39))
+        m = _pq_subquantizers(dim)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, m, PQ_NBITS)
+        start = time.perf_counter()
+        index.train(vectors)
+        index.nprobe = min(IVF_NPROBE, nlist)
+        # Keeps reconstruct() working for MMR packing and rebuilds
+        index.make_direct_map()
+        params = {
+            "nlist": nlist, "m": m, "nbits": PQ_NBITS, "nprobe": index.nprobe,
+            "train_size": count, "train_seconds": round(time.perf_counter() - start, 3)
+        }
+    else:
+        index = faiss.IndexFlatL2(dim)
+        params = {}
+
+    if count:
+        index.add(vectors)
+    return index, params
+
+def reconstruct_all(index):
+    """Every stored vector (approximate for IVF-PQ), in position order."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+def apply_index_strategy(vector_store, strategy=None):
+    """
+    Rebuilds the store's index as the type the strategy calls for, if it differs.
+    Positions are preserved, so the docstore mapping and BM25 index stay valid.
+    Without a strategy the one recorded in the store's parameters is kept.
+    Returns the parameters record to persist with the index.
+    """
+    params = getattr(vector_store, "index_params", None)
+    # Without an explicit strategy, keep whatever the session was built with
+    strategy = strategy or (params or {}).get("strategy") or INDEX_STRATEGY
+    count = vector_store.index.ntotal
+    target = choose_index_strategy(count, strategy)
+    current = get_index_type(vector_store.index)
+
+    if target != current or params is None or params.get("strategy") != strategy:
+        if target != current:
+            vector_store.index, build_params = build_faiss_index(reconstruct_all(vector_store.index), target)
+        else:
+            build_params = {}
+        params = {
+            "strategy": strategy,
+            "type": target,
+            "params": build_params,
+            "chunk_count": count,
+            "built_at": time.time()
+        }
+    else:
+        params = dict(params, chunk_count=count)
+
+    vector_store.index_params = params
+    return params
+
+def remove_positions(vector_store, positions):
+    """
+    Removes FAISS positions from the store. Flat indexes remove in place through
+    FAISS.delete; HNSW can't delete, so other types are rebuilt from the remaining
+    vectors with the same trained parameters.
+    """
+    doc_ids = [vector_store.index_to_docstore_id[position] for position in positions]
+    if get_index_type(vector_store.index) == "flat":
+        vector_store.delete(doc_ids)
+        return
+
+    removed = set(positions)
+    keep = [position for position in range(vector_store.index.ntotal) if position not in removed]
+    vectors = np.vstack([vector_store.index.reconstruct(position) for position in keep]) if keep else None
+
+    new_index = faiss.clone_index(vector_store.index)
+    new_index.reset()
+    if vectors is not None:
+        new_index.add(vectors)
+    vector_store.index = new_index
+    vector_store.index_to_docstore_id = {
+        i: vector_store.index_to_docstore_id[position] for i, position in enumerate(keep)
+    }
+    vector_store.docstore.delete(doc_ids)
+
+def save_index_params(folder_path, params):
+    with open(os.path.join(folder_path, INDEX_PARAMS_FILE), "w") as f:
+        json.dump(params, f, indent=4)
+
+def load_index_params(folder_path, index=None):
+    """Reads the persisted parameters and re-applies the search-time settings to index."""
+    path = os.path.join(folder_path, INDEX_PARAMS_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            params = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return None
+
+    if isinstance(index, faiss.Index):
+        typed = faiss.downcast_index(index)
+        build_params = params.get("params", {})
+        if isinstance(typed, faiss.IndexHNSWFlat) and "efSearch" in build_params:
+            typed.hnsw.efSearch = build_params["efSearch"]
+        elif isinstance(typed, faiss.IndexIVFPQ) and "nprobe" in build_params:
+            typed.nprobe = build_params["nprobe"]
+    return params
+
+def recall_latency_report(vectors, k=10, query_count=200, strategies=("flat", "hnsw", "ivfpq")):
+    """
+    Builds each index type over vectors and measures recall@k against exact search and
+    mean query latency. Queries are stored vectors with a little noise added, so they
+    resemble real questions that land near existing chunks.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(query_count, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for strategy in strategies:
+        resolved = choose_index_strategy(len(vectors), strategy)
+        if resolved != strategy:
+            report.append({"strategy": strategy, "skipped": f"needs at least {IVFPQ_MIN_TRAIN} vectors"})
+            continue
+
+        start = time.perf_counter()
+        index, params = build_faiss_index(vectors, strategy)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query.reshape(1, -1), k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        _, found = index.search(queries, k)
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        report.append({
+            "strategy": strategy,
+            "params": params,
+            "recall_at_k": hits / (len(queries) * k),
+            "mean_query_ms": latency_ms,
+            "build_seconds": build_seconds,
+            "index_bytes": faiss.serialize_index(index).nbytes
+        })
+    return {"vectors": len(vectors), "k": k, "queries": len(queries), "results": report}
+
+if __name__ == "__main__":
+    # Usage: python index_strategies.py <session_id> [--k 10] [--queries 200]
+    from index_utils import get_index_path
+    from native_index import get_data_folder
+
+    parser = argparse.ArgumentParser(description="Recall@k vs latency report for FAISS index types")
+    parser.add_argument("session_id", help="Session whose index vectors are used as the corpus")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    index = faiss.read_index(os.path.join(get_data_folder(get_index_path(args.session_id)), "index.faiss"))
+    print(json.dumps(recall_latency_report(reconstruct_all(index), args.k, args.queries), indent=4))
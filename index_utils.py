@@ -0,0 +1,350 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from embedding_utils import EmbeddingCache
+from lexical_index import LexicalIndex
+from index_strategies import apply_index_strategy, load_index_params, remove_positions, save_index_params
+from native_index import (
+    POSITIONS_FILE, VECTOR_QUANTIZATION, VersionWriter, close_native, get_current_version, get_data_folder,
+    is_native_index, iter_metadata, load_native, make_writable, publish_version, write_version
+)
+import shared_store
+
+INDEX_ROOT = "faiss_indexes"
+
+# Limits for the in-process cache of loaded session indexes
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INDEX_CACHE_MAX_ENTRIES", "16"))
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0}
+
+def get_index_path(session_id):
+    return f"{INDEX_ROOT}/{session_id}"
+
+def _get_index_version(index_path):
+    """
+    The live version folder named by the session's CURRENT file; for legacy folders the
+    latest modification time of the folder and the files inside it.
+    """
+    version = get_current_version(index_path)
+    if version is not None:
+        return version
+    try:
+        mtimes = [os.path.getmtime(index_path)]
+        for entry in os.scandir(index_path):
+            if entry.is_file():
+                mtimes.append(entry.stat().st_mtime)
+        return max(mtimes)
+    except OSError:
+        return None
+
+def get_index_version(session_id):
+    """Changes whenever the session's index is rewritten on disk; None if it has no index."""
+    if shared_store.SHARED_STORE_ENABLED:
+        return shared_store.get_session_version(session_id)
+    return _get_index_version(get_index_path(session_id))
+
+def _estimate_store_bytes(vector_store):
+    """
+    Rough resident size of a FAISS store: raw vectors plus docstore text.
+    Memory-mapped vectors and texts left in SQLite are page cache, not counted.
+    """
+    size = 0
+    index = getattr(vector_store, "index", None)
+    if hasattr(index, "resident_bytes"):
+        size += index.resident_bytes()
+    elif index is not None and not getattr(vector_store, "index_mmapped", False):
+        size += index.ntotal * index.d * 4
+
+    docstore = getattr(vector_store, "docstore", None)
+    if hasattr(docstore, "resident_bytes"):
+        return size + docstore.resident_bytes()
+    for doc in getattr(docstore, "_dict", {}).values():
+        size += len(doc.page_content) + len(str(doc.metadata))
+    return size
+
+def _evict_over_limits():
+    """Drops least recently used entries until both limits are satisfied. Caller holds the lock."""
+    total_bytes = sum(entry["size"] for entry in _cache.values())
+    while _cache and (len(_cache) > INDEX_CACHE_MAX_ENTRIES or total_bytes > INDEX_CACHE_MAX_BYTES):
+        if len(_cache) == 1:
+            # Always keep the entry that was just used, even if it alone is over the byte limit
+            break
+        _, entry = _cache.popitem(last=False)
+        close_native(entry["store"])
+        total_bytes -= entry["size"]
+        _cache_stats["evictions"] += 1
+
+def cache_vector_store(session_id, vector_store, lexical_index=None, version=None):
+    """Stores an already loaded (or freshly built) vector store and its BM25 index in the cache."""
+    version = getattr(vector_store, "index_version", None) or version or _get_index_version(get_index_path(session_id))
+    size = _estimate_store_bytes(vector_store)
+    if lexical_index is not None:
+        size += lexical_index.nbytes()
+    with _cache_lock:
+        _cache[session_id] = {
+            "store": vector_store,
+            "lexical": lexical_index,
+            "version": version,
+            "size": size
+        }
+        _cache.move_to_end(session_id)
+        _evict_over_limits()
+
+def load_vector_store(session_id, embeddings):
+    """
+    Returns the vector store for session_id, loading it from disk only when it
+    is not cached or the index folder changed since it was loaded.
+    Returns None if the session has no index.
+    Native indexes (see native_index) are memory-mapped; older pickled folders still load
+    until they are converted or saved again.
+    With VECTOR_STORE_MODE=shared the session's view of the shared store is returned instead.
+    """
+    if shared_store.SHARED_STORE_ENABLED:
+        return shared_store.get_session_store(session_id, embeddings)
+
+    index_path = get_index_path(session_id)
+    for attempt in range(2):
+        try:
+            return _load_vector_store(session_id, index_path, embeddings)
+        except FileNotFoundError:
+            # A save published a new version and removed the one being opened; read the pointer again
+            if attempt:
+                raise
+            time.sleep(0.05)
+
+def _load_vector_store(session_id, index_path, embeddings):
+    version = _get_index_version(index_path)
+    if version is None:
+        evict_vector_store(session_id)
+        return None
+
+    with _cache_lock:
+        entry = _cache.get(session_id)
+        if entry is not None and entry["version"] == version:
+            _cache.move_to_end(session_id)
+            _cache_stats["hits"] += 1
+            return entry["store"]
+        if entry is not None:
+            _cache_stats["reloads"] += 1
+        else:
+            _cache_stats["misses"] += 1
+
+    if is_native_index(index_path):
+        vector_store = load_native(index_path, embeddings)
+    else:
+        vector_store = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+    data_path = get_data_folder(index_path)
+    vector_store.index_params = load_index_params(data_path, vector_store.index)
+    cache_vector_store(session_id, vector_store, LexicalIndex.load(data_path), version)
+    return vector_store
+
+def get_lexical_index(session_id, vector_store):
+    """
+    Returns the BM25 index belonging to the session's cached vector store.
+    Indexes saved before lexical indexing existed get one built in memory on first use.
+    """
+    if shared_store.SHARED_STORE_ENABLED:
+        return shared_store.get_lexical_index(vector_store)
+    with _cache_lock:
+        entry = _cache.get(session_id)
+        if entry is not None and entry["store"] is vector_store and entry["lexical"] is not None:
+            return entry["lexical"]
+
+    lexical_index = LexicalIndex.from_vector_store(vector_store)
+    with _cache_lock:
+        entry = _cache.get(session_id)
+        if entry is not None and entry["store"] is vector_store:
+            entry["lexical"] = lexical_index
+            entry["size"] += lexical_index.nbytes()
+    return lexical_index
+
+def _update_lexical_index(session_id, index_path, old_version, rowids, added):
+    """
+    BM25 index for a new version, derived from the old version's index where possible:
+    rows that left are dropped and only the newly stored chunks are tokenized. Falls back
+    to a full build when the positions were reordered (or there is no old index).
+    """
+    old_lexical = None
+    old_rowids = None
+    if old_version is not None:
+        with _cache_lock:
+            entry = _cache.get(session_id)
+            if entry is not None and entry["version"] == old_version:
+                old_lexical = entry["lexical"]
+        old_path = os.path.join(index_path, old_version)
+        if old_lexical is None:
+            old_lexical = LexicalIndex.load(old_path)
+        old_rowids = np.load(os.path.join(old_path, POSITIONS_FILE))
+
+    if old_lexical is not None and len(old_lexical.doc_lengths) == len(old_rowids):
+        kept = np.isin(old_rowids, rowids)
+        kept_count = int(kept.sum())
+        # FAISS.delete and remove_positions keep the order of what's left; new chunks are appended
+        if np.array_equal(rowids[:kept_count], old_rowids[kept]) and len(added) == len(rowids) - kept_count \
+                and all(position >= kept_count for position in added):
+            lexical_index = old_lexical.remove_documents(np.flatnonzero(~kept))
+            return lexical_index.add_documents([added[position] for position in sorted(added)])
+    return None
+
+def save_vector_store(session_id, vector_store, index_strategy=None):
+    """
+    Saves the index as a new version of the session folder (see native_index): chunks not
+    stored yet are appended to chunks.db, the index file and a BM25 index go into a fresh
+    version folder, and the CURRENT pointer is swapped atomically, so a crash or a
+    concurrent reader never sees a half-written or missing index. The BM25 index is
+    updated from the previous version's, tokenizing only the new chunks.
+    The FAISS index is first converted to the type index_strategy calls for ("auto" picks by
+    chunk count, see index_strategies) and its parameters are saved alongside.
+    Legacy pickled or format 1/2 sessions are migrated on their next save. Also refreshes
+    the cache entry with the saved, memory-mapped copy and returns it.
+    """
+    index_path = get_index_path(session_id)
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    old_version = get_current_version(index_path)
+
+    params = apply_index_strategy(vector_store, index_strategy)
+    version, rowids, added = write_version(index_path, vector_store)
+    lexical_index = _update_lexical_index(session_id, index_path, old_version, rowids, added)
+    if lexical_index is None:
+        if len(added) == len(rowids):
+            lexical_index = LexicalIndex.build([added[position] for position in range(len(rowids))])
+        else:
+            lexical_index = LexicalIndex.from_vector_store(vector_store)
+    return _publish(session_id, index_path, version, params, lexical_index, vector_store)
+
+def _publish(session_id, index_path, version, params, lexical_index, vector_store):
+    """Completes a written version with its parameters and BM25 index, makes it live and caches it."""
+    version_path = os.path.join(index_path, version)
+    save_index_params(version_path, params)
+    lexical_index.save(version_path)
+    # Let go of the old version's files first; Windows can't remove files that are still open
+    evict_vector_store(session_id)
+    close_native(vector_store)
+    publish_version(index_path, version)
+
+    # Reopen from disk so the cached copy shares pages instead of holding the vectors and texts
+    saved_store = load_native(index_path, vector_store.embedding_function)
+    saved_store.index_params = load_index_params(version_path, saved_store.index)
+    cache_vector_store(session_id, saved_store, lexical_index, version)
+    return saved_store
+
+class SessionIndexWriter:
+    """
+    Builds a session's next index version from embedded batches (see native_index.VersionWriter),
+    so ingesting an upload never holds its chunk texts or vectors in memory. The BM25 index is
+    carried over from the base store's version; new texts are tokenized max_pending_bytes at a
+    time. commit() publishes the version like save_vector_store; abort() drops it.
+    """
+
+    def __init__(self, session_id, embeddings, base_store=None, max_pending_bytes=64 * 1024 * 1024):
+        self.session_id = session_id
+        self.embeddings = embeddings
+        self.index_path = get_index_path(session_id)
+        self.max_pending_bytes = max_pending_bytes
+        self.index_params = getattr(base_store, "index_params", None)
+        os.makedirs(INDEX_ROOT, exist_ok=True)
+        self.writer = VersionWriter(self.index_path, base_store)
+        self.lexical_index = LexicalIndex.build([])
+        if base_store is not None:
+            rowids = np.frombuffer(self.writer.rowids, dtype=np.int64)
+            self.lexical_index = _update_lexical_index(
+                session_id, self.index_path, get_current_version(self.index_path), rowids, {}
+            ) or LexicalIndex.from_vector_store(base_store)
+        self.pending_texts = []
+        self.pending_bytes = 0
+
+    @property
+    def count(self):
+        return self.writer.count
+
+    def add(self, texts, metadatas, vectors):
+        self.writer.add(texts, metadatas, vectors)
+        self.pending_texts.extend(texts)
+        self.pending_bytes += sum(len(text) for text in texts) * 4
+        if self.pending_bytes >= self.max_pending_bytes:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        self.lexical_index = self.lexical_index.add_documents(self.pending_texts)
+        self.pending_texts = []
+        self.pending_bytes = 0
+
+    def commit(self, index_strategy=None):
+        """Publishes the version and returns the saved store."""
+        self._merge_pending()
+        version, _ = self.writer.finish()
+        vector_store = load_native(self.index_path, self.embeddings, version=version)
+        vector_store.index_params = self.index_params
+        streamed_index = vector_store.index
+        params = apply_index_strategy(vector_store, index_strategy)
+        if vector_store.index is not streamed_index or VECTOR_QUANTIZATION != "none":
+            # HNSW, IVF-PQ and quantized indexes are built in memory, once, from the streamed vectors
+            streamed_version = version
+            version, _, _ = write_version(self.index_path, vector_store)
+            close_native(vector_store)
+            shutil.rmtree(os.path.join(self.index_path, streamed_version), ignore_errors=True)
+        return _publish(self.session_id, self.index_path, version, params, self.lexical_index, vector_store)
+
+    def abort(self):
+        self.writer.abort()
+
+def get_chunk_hashes(vector_store):
+    """Content hashes of every chunk in the store; older indexes without a stored hash are hashed on the fly."""
+    if vector_store is None:
+        return set()
+    hashes = set()
+    for doc_id, metadata in iter_metadata(vector_store.docstore):
+        if metadata.get("hash"):
+            hashes.add(metadata["hash"])
+        else:
+            hashes.add(EmbeddingCache.hash_text(vector_store.docstore.search(doc_id).page_content))
+    return hashes
+
+def get_indexed_sources(vector_store):
+    """Names of the source documents whose chunks are in the store."""
+    if vector_store is None:
+        return []
+    sources = {metadata.get("source") for _, metadata in iter_metadata(vector_store.docstore)}
+    sources.discard(None)
+    return sorted(sources)
+
+def remove_source(vector_store, source):
+    """Deletes every chunk that came from the given source document. Returns the number removed."""
+    doc_ids = {doc_id for doc_id, metadata in iter_metadata(vector_store.docstore) if metadata.get("source") == source}
+    positions = [
+        position for position, doc_id in vector_store.index_to_docstore_id.items()
+        if doc_id in doc_ids
+    ]
+    if positions:
+        # A memory-mapped index can't be modified in place
+        make_writable(vector_store)
+        remove_positions(vector_store, positions)
+    return len(positions)
+
+def evict_vector_store(session_id):
+    """Removes a session's index from the cache and closes its files, e.g. before its folder is deleted."""
+    with _cache_lock:
+        entry = _cache.pop(session_id, None)
+        if entry is not None:
+            close_native(entry["store"])
+
+def clear_index_cache():
+    with _cache_lock:
+        for entry in _cache.values():
+            close_native(entry["store"])
+        _cache.clear()
+
+def get_index_cache_stats():
+    """Returns hit/miss counters plus the current size of the cache."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["entries"] = len(_cache)
+        stats["bytes"] = sum(entry["size"] for entry in _cache.values())
+    return stats
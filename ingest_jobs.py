@@ -0,0 +1,318 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Background ingestion: uploads are copied to disk and indexed by a process pool, so the
+# Streamlit script only submits a job and polls its progress
+INGEST_JOBS_DB = os.getenv("INGEST_JOBS_DB", "ingest_jobs.db")
+INGEST_JOBS_DIR = os.getenv("INGEST_JOBS_DIR", "ingest_jobs")
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+# Finished job records older than this are removed when the queue starts
+INGEST_JOB_RETENTION_DAYS = 7
+# Workers write progress at most this often
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+ACTIVE_STATUSES = ("queued", "running")
+_ACTIVE_PLACEHOLDERS = ", ".join("?" for _ in ACTIVE_STATUSES)
+
+_executor = None
+_executor_lock = threading.Lock()
+# session_id -> deque of job ids; jobs of one session run one after another
+_session_queues = {}
+_futures = {}
+_schema_ready = set()
+
+class JobCancelled(Exception):
+    pass
+
+class StoredUpload:
+    """A spooled upload that looks like Streamlit's UploadedFile to the extraction code."""
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def getvalue(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+def _connect():
+    conn = sqlite3.connect(INGEST_JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            user_id TEXT,
+            upload_hash TEXT NOT NULL,
+            files TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stage TEXT,
+            pages_extracted INTEGER NOT NULL DEFAULT 0,
+            chunks_embedded INTEGER NOT NULL DEFAULT 0,
+            chunks_added INTEGER,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, upload_hash)")
+    if INGEST_JOBS_DB not in _schema_ready:
+        # Databases created before jobs recorded the submitting user
+        if "user_id" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN user_id TEXT")
+        _schema_ready.add(INGEST_JOBS_DB)
+    return conn
+
+def _update_job(job_id, **fields):
+    fields["updated"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with closing(_connect()) as conn, conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+def get_job(job_id):
+    """
+    Returns the job as a dict, or None if it doesn't exist. The first call starts the
+    queue, so jobs left unfinished by a previous run are requeued before they are shown.
+    """
+    _get_executor()
+    return _read_job(job_id)
+
+def _read_job(job_id):
+    """get_job without starting the queue, for use inside worker processes."""
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["files"] = json.loads(job["files"])
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    return job
+
+def get_session_jobs(session_id, active_only=False):
+    """The session's jobs, newest first. Like get_job, the first call starts the queue."""
+    _get_executor()
+    query = "SELECT id FROM jobs WHERE session_id = ?"
+    params = [session_id]
+    if active_only:
+        query += f" AND status IN ({_ACTIVE_PLACEHOLDERS})"
+        params.extend(ACTIVE_STATUSES)
+    with closing(_connect()) as conn:
+        ids = [row["id"] for row in conn.execute(query + " ORDER BY created DESC", params)]
+    return [_read_job(job_id) for job_id in ids]
+
+def hash_uploads(docs):
+    """Order-independent hash of the uploaded files' names and contents."""
+    from ingest_utils import _read_upload
+
+    digests = sorted(
+        f"{doc.name}:{hashlib.sha256(_read_upload(doc)).hexdigest()}" for doc in docs
+    )
+    return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+
+class _JobProgress:
+    """progress_callback for add_documents_to_vector_store, run inside the worker process."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.values = {"pages_extracted": 0, "chunks_embedded": 0}
+        self.stage = "extracting"
+        self.last_write = 0.0
+
+    def __call__(self, stage, value):
+        if stage == "extracted":
+            self.values["pages_extracted"] = value
+        elif stage == "embedded":
+            self.values["chunks_embedded"] = value
+            self.stage = "embedding"
+        elif stage == "saving":
+            self.stage = "saving"
+
+        now = time.monotonic()
+        if stage == "saving" or now - self.last_write >= PROGRESS_INTERVAL_SECONDS:
+            self.last_write = now
+            _update_job(self.job_id, stage=self.stage, **self.values)
+            job = _read_job(self.job_id)
+            if job is not None and job["cancel_requested"]:
+                raise JobCancelled()
+
+def _run_job(job_id):
+    """Worker-process entry point: indexes a spooled upload into its session."""
+    from rag_engine import add_documents_to_vector_store
+
+    job = _read_job(job_id)
+    if job is None:
+        return
+    if job["cancel_requested"]:
+        _update_job(job_id, status="cancelled", stage=None)
+        return
+
+    _update_job(job_id, status="running", stage="extracting")
+    uploads = [StoredUpload(item["path"], item["name"]) for item in job["files"]]
+    try:
+        # The pool already runs jobs in parallel, so each one extracts on a single thread
+        added = add_documents_to_vector_store(
+            uploads, job["session_id"], max_workers=1, progress_callback=_JobProgress(job_id),
+            user_id=job["user_id"]
+        )
+    except JobCancelled:
+        # Nothing to undo: an aborted ingest leaves the session as it was, in both store modes
+        outcome = {"status": "cancelled"}
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        outcome = {"status": "failed", "error": str(e)}
+    else:
+        outcome = {"status": "done", "chunks_added": added}
+    finally:
+        # Before the final status, so a finished job never has its upload still spooled
+        shutil.rmtree(os.path.join(INGEST_JOBS_DIR, job_id), ignore_errors=True)
+    _update_job(job_id, stage=None, **outcome)
+
+def _get_executor():
+    """Starts the pool on first use and requeues jobs left unfinished by a previous run."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            return _executor
+        _executor = ProcessPoolExecutor(max_workers=max(1, INGEST_JOB_WORKERS))
+
+    cutoff = time.time() - INGEST_JOB_RETENTION_DAYS * 86400
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            f"DELETE FROM jobs WHERE status NOT IN ({_ACTIVE_PLACEHOLDERS}) AND updated < ?",
+            (*ACTIVE_STATUSES, cutoff)
+        )
+        unfinished = conn.execute(
+            f"SELECT id, session_id FROM jobs WHERE status IN ({_ACTIVE_PLACEHOLDERS}) ORDER BY created",
+            ACTIVE_STATUSES
+        ).fetchall()
+    for row in unfinished:
+        _update_job(row["id"], status="queued", stage=None)
+        _enqueue(row["id"], row["session_id"])
+    return _executor
+
+def _enqueue(job_id, session_id):
+    with _executor_lock:
+        queue = _session_queues.setdefault(session_id, deque())
+        queue.append(job_id)
+        start = len(queue) == 1
+    if start:
+        _start_next(session_id)
+
+def _start_next(session_id):
+    with _executor_lock:
+        queue = _session_queues.get(session_id)
+        if not queue:
+            _session_queues.pop(session_id, None)
+            return
+        job_id = queue[0]
+        executor = _executor
+
+    try:
+        future = executor.submit(_run_job, job_id)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _update_job(job_id, status="failed", stage=None, error=f"Worker pool unavailable: {e}")
+        _job_finished(session_id, job_id)
+        return
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _on_done(session_id, job_id, f))
+
+def _on_done(session_id, job_id, future):
+    _futures.pop(job_id, None)
+    if not future.cancelled() and future.exception() is not None:
+        # The worker died (e.g. killed for memory) before it could record the failure
+        _update_job(job_id, status="failed", stage=None, error=str(future.exception()))
+    _job_finished(session_id, job_id)
+
+def _job_finished(session_id, job_id):
+    with _executor_lock:
+        queue = _session_queues.get(session_id)
+        if queue and queue[0] == job_id:
+            queue.popleft()
+    _start_next(session_id)
+
+def submit_ingest_job(session_id, docs, user_id=None):
+    """
+    Queues the uploads for indexing into the session and returns the job id.
+    user_id (the browser's device id) is recorded with the chunks in the shared store.
+    Submitting the same files for the same session again returns the existing job
+    unless it failed or was cancelled.
+    """
+    _get_executor()
+    upload_hash = hash_uploads(docs)
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE session_id = ? AND upload_hash = ? AND status IN ('queued', 'running', 'done') "
+            "ORDER BY created DESC LIMIT 1",
+            (session_id, upload_hash)
+        ).fetchone()
+    if row is not None:
+        return row["id"]
+
+    from ingest_utils import _read_upload
+
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(INGEST_JOBS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    files = []
+    for i, doc in enumerate(docs):
+        path = os.path.join(job_dir, f"{i}.upload")
+        with open(path, "wb") as f:
+            f.write(_read_upload(doc))
+        files.append({"name": doc.name, "path": path})
+
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO jobs (id, session_id, user_id, upload_hash, files, status, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, session_id, user_id, upload_hash, json.dumps(files), now, now)
+        )
+    _enqueue(job_id, session_id)
+    return job_id
+
+def cancel_job(job_id):
+    """
+    Cancels a queued job outright; a running job stops at its next progress update and
+    leaves the session index as it was. A job marked running that no worker of this
+    process owns (its run was interrupted) is cancelled outright too.
+    Returns False if the job already finished.
+    """
+    job = get_job(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        return False
+    _update_job(job_id, cancel_requested=1)
+    future = _futures.get(job_id)
+    if future is None or (job["status"] == "queued" and future.cancel()):
+        _update_job(job_id, status="cancelled", stage=None)
+        shutil.rmtree(os.path.join(INGEST_JOBS_DIR, job_id), ignore_errors=True)
+        if future is None:
+            # Still waiting behind another job of the same session
+            with _executor_lock:
+                queue = _session_queues.get(job["session_id"])
+                if queue and job_id in queue and queue[0] != job_id:
+                    queue.remove(job_id)
+    return True
+
+def shutdown_jobs(wait=False):
+    """Stops the pool; unfinished jobs stay queued in the database for the next start."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+        _session_queues.clear()
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,178 @@
+import codecs
+import io
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pypdf import PdfReader
+from docx import Document
+
+# Number of extraction processes; 0 means one per CPU core, 1 forces serial extraction
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+# PDF pages handed to a worker in one task
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "20"))
+# Uploads with fewer pages than this are extracted serially, the pool isn't worth starting
+PARALLEL_MIN_PAGES = 40
+# TXT uploads are read and decoded this many bytes at a time, one record per window
+TXT_WINDOW_BYTES = int(os.getenv("INGEST_TXT_WINDOW_BYTES", str(1024 * 1024)))
+
+def _read_upload(doc):
+    """Returns the raw bytes of an uploaded file (Streamlit UploadedFile or any file object)."""
+    if hasattr(doc, "getvalue"):
+        return doc.getvalue()
+    data = doc.read()
+    if hasattr(doc, "seek"):
+        doc.seek(0)
+    return data
+
+def _extract_pdf_pages(source, file_name, start, end):
+    """Extracts pages [start, end) of a PDF given as a path or bytes."""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    pdf_reader = PdfReader(source)
+    records = []
+    for page_number in range(start, end):
+        text = pdf_reader.pages[page_number].extract_text() or ""
+        records.append({"source": file_name, "page": page_number + 1, "text": text})
+    return records
+
+def _extract_docx_paragraphs(data, file_name):
+    doc_file = Document(io.BytesIO(data))
+    return [
+        {"source": file_name, "page": i + 1, "text": para.text + "\n"}
+        for i, para in enumerate(doc_file.paragraphs)
+    ]
+
+def _open_upload(doc):
+    """Binary file object over an upload; spooled uploads (ingest_jobs) are read from disk."""
+    if hasattr(doc, "path"):
+        return open(doc.path, "rb")
+    return io.BytesIO(_read_upload(doc))
+
+def _iter_txt_windows(doc, file_name, window_bytes=None):
+    """
+    Decodes a TXT upload TXT_WINDOW_BYTES at a time, yielding one record per window (page
+    is the window number), so a large file is never held as one string. A character split
+    across a window edge is completed by the incremental decoder; chunk overlap across
+    windows comes from rag_engine.iter_text_chunks, which re-splits the last chunk of one
+    window together with the next.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    page = 0
+    with _open_upload(doc) as f:
+        while True:
+            data = f.read(window_bytes or TXT_WINDOW_BYTES)
+            text = decoder.decode(data, final=not data)
+            if text:
+                page += 1
+                yield {"source": file_name, "page": page, "text": text}
+            if not data:
+                break
+
+def _run_task(task):
+    kind, args = task
+    if kind == "pdf":
+        return _extract_pdf_pages(*args)
+    if kind == "docx":
+        return _extract_docx_paragraphs(*args)
+    return _iter_txt_windows(*args)
+
+def _plan_tasks(docs, split_pdfs, temp_paths):
+    """
+    Turns the uploads into an ordered list of extraction tasks.
+    When split_pdfs is set, each PDF is spilled to a temp file once and cut into page ranges
+    so workers read it from disk instead of receiving the whole file per task.
+    """
+    tasks = []
+    total_pages = 0
+    for doc in docs:
+        file_name = doc.name
+        if file_name.endswith(".pdf"):
+            data = _read_upload(doc)
+            page_count = len(PdfReader(io.BytesIO(data)).pages)
+            total_pages += page_count
+            if not split_pdfs:
+                tasks.append(("pdf", (data, file_name, 0, page_count)))
+                continue
+
+            tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+            with tmp:
+                tmp.write(data)
+            temp_paths.append(tmp.name)
+            for start in range(0, page_count, PAGES_PER_TASK):
+                end = min(start + PAGES_PER_TASK, page_count)
+                tasks.append(("pdf", (tmp.name, file_name, start, end)))
+        elif file_name.endswith(".docx"):
+            tasks.append(("docx", (_read_upload(doc), file_name)))
+            total_pages += 1
+        elif file_name.endswith(".txt"):
+            # Streamed from the upload by the consumer, never sent to a worker
+            tasks.append(("txt", (doc, file_name)))
+            total_pages += 1
+    return tasks, total_pages
+
+def _resolve_workers(max_workers):
+    if max_workers is None:
+        max_workers = INGEST_WORKERS
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    return max_workers
+
+def iter_document_records(docs, max_workers=None):
+    """
+    Generator form of extract_document_records. Records are yielded in document order
+    as soon as their page range is extracted, and only a small window of tasks is kept
+    in flight so extracted text doesn't pile up ahead of the consumer.
+    """
+    max_workers = _resolve_workers(max_workers)
+    temp_paths = []
+    try:
+        tasks, total_pages = _plan_tasks(docs, max_workers > 1, temp_paths)
+        parallel = max_workers > 1 and len(tasks) > 1 and total_pages >= PARALLEL_MIN_PAGES
+        next_task = 0
+
+        executor = None
+        if parallel:
+            try:
+                executor = ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)))
+            except (OSError, NotImplementedError):
+                pass
+
+        if executor is not None:
+            with executor:
+                pending = deque()
+                submitted = 0
+                while next_task < len(tasks):
+                    # Only pool failures fall back to the serial path; TXT tasks run here and
+                    # their read errors propagate, so no part of a file is silently skipped
+                    try:
+                        while submitted < len(tasks) and len(pending) < max_workers * 2:
+                            task = tasks[submitted]
+                            pending.append(None if task[0] == "txt" else executor.submit(_run_task, task))
+                            submitted += 1
+                        future = pending.popleft()
+                        task_records = None if future is None else future.result()
+                    except (BrokenProcessPool, OSError, NotImplementedError):
+                        # Finish whatever the pool didn't deliver on the serial path
+                        break
+                    yield from _run_task(tasks[next_task]) if task_records is None else task_records
+                    next_task += 1
+
+        for task in tasks[next_task:]:
+            yield from _run_task(task)
+    finally:
+        for path in temp_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def extract_document_records(docs, max_workers=None):
+    """
+    Extracts text from uploaded PDF/DOCX/TXT files as an ordered list of records:
+    {"source": file name, "page": page or paragraph number, "text": text}.
+    PDFs are split into page ranges and extracted across a process pool; small uploads
+    (or max_workers=1) use the serial path.
+    """
+    return list(iter_document_records(docs, max_workers=max_workers))
@@ -0,0 +1,240 @@
+import os
+import re
+import numpy as np
+import faiss
+
+# Reciprocal rank fusion settings for hybrid retrieval
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Candidates taken from each retriever before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+
+LEXICAL_INDEX_FILE = "lexical.npz"
+
+# Words, with hyphens inside a word kept so utm-source stays one token
+_TOKEN_RE = re.compile(r"\w+(?:-\w+)*")
+_PART_RE = re.compile(r"[_-]")
+
+def tokenize(text):
+    """
+    Lowercased word tokens. Identifiers such as gclid_param or utm-source are kept whole
+    and also split into their parts, so either spelling in a question matches.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if "_" in token or "-" in token:
+            tokens.extend(part for part in _PART_RE.split(token) if part)
+    return tokens
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one FAISS store, addressed by FAISS position.
+    Postings are kept as flat numpy arrays (CSR layout) so a query only touches the
+    postings of its own terms.
+    """
+
+    def __init__(self, vocab, offsets, doc_ids, tfs, doc_lengths, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        doc_count = len(doc_lengths)
+        doc_freq = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if doc_count else 0.0
+        # Per-document part of the BM25 denominator, precomputed once
+        if avg_length:
+            self.length_norm = (k1 * (1 - b + b * doc_lengths / avg_length)).astype(np.float32)
+        else:
+            self.length_norm = np.full(doc_count, k1, dtype=np.float32)
+
+    @classmethod
+    def build(cls, texts):
+        term_ids = {}
+        term_parts = []
+        doc_parts = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            ids = [term_ids.setdefault(token, len(term_ids)) for token in tokenize(text)]
+            doc_lengths[doc_id] = len(ids)
+            term_parts.append(np.asarray(ids, dtype=np.int64))
+            doc_parts.append(np.full(len(ids), doc_id, dtype=np.int64))
+
+        doc_count = max(len(texts), 1)
+        if term_parts:
+            keys = np.concatenate(term_parts) * doc_count + np.concatenate(doc_parts)
+        else:
+            keys = np.zeros(0, dtype=np.int64)
+        # Sorting (term, doc) keys groups postings by term; the counts are the term frequencies
+        keys, tfs = np.unique(keys, return_counts=True)
+        postings_terms = keys // doc_count
+        doc_ids = (keys % doc_count).astype(np.int32)
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(postings_terms, minlength=len(term_ids)))
+
+        return cls(term_ids, offsets, doc_ids, tfs.astype(np.float32), doc_lengths)
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """Builds the index from a FAISS store's docstore, in FAISS position order."""
+        texts = []
+        for position in range(vector_store.index.ntotal):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+            texts.append(doc.page_content if hasattr(doc, "page_content") else "")
+        return cls.build(texts)
+
+    def add_documents(self, texts):
+        """
+        Returns a new index with texts appended at the next positions. Only the new texts
+        are tokenized; the existing postings are copied into the merged arrays, and document
+        frequencies and lengths follow from them.
+        """
+        if not texts:
+            return self
+        delta = LexicalIndex.build(texts)
+        vocab = dict(self.vocab)
+        term_map = np.array([vocab.setdefault(term, len(vocab)) for term in delta.vocab], dtype=np.int64)
+
+        old_counts = np.zeros(len(vocab), dtype=np.int64)
+        old_counts[:len(self.vocab)] = np.diff(self.offsets)
+        delta_counts = np.diff(delta.offsets)
+        counts = old_counts.copy()
+        counts[term_map] += delta_counts
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        # Each term's old postings move to the start of its merged range, the new ones follow
+        kept_counts = old_counts[:len(self.vocab)]
+        old_dest = (np.arange(len(self.doc_ids)) - np.repeat(self.offsets[:-1], kept_counts)
+                    + np.repeat(offsets[:len(self.vocab)], kept_counts))
+        doc_ids[old_dest] = self.doc_ids
+        tfs[old_dest] = self.tfs
+        new_dest = (np.arange(len(delta.doc_ids)) - np.repeat(delta.offsets[:-1], delta_counts)
+                    + np.repeat(offsets[term_map] + old_counts[term_map], delta_counts))
+        doc_ids[new_dest] = delta.doc_ids + len(self.doc_lengths)
+        tfs[new_dest] = delta.tfs
+
+        doc_lengths = np.concatenate([self.doc_lengths, delta.doc_lengths])
+        return LexicalIndex(vocab, offsets, doc_ids, tfs, doc_lengths, self.k1, self.b)
+
+    def remove_documents(self, positions):
+        """
+        Returns a new index without the documents at positions; later documents move down,
+        matching FAISS.delete and index_strategies.remove_positions. No text is re-read.
+        """
+        removed = np.zeros(len(self.doc_lengths), dtype=bool)
+        removed[np.asarray(positions, dtype=np.int64)] = True
+        if not removed.any():
+            return self
+        keep = ~removed[self.doc_ids]
+        terms = np.repeat(np.arange(len(self.vocab)), np.diff(self.offsets))
+        offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(terms[keep], minlength=len(self.vocab)))
+        new_positions = (np.cumsum(~removed) - 1).astype(np.int32)
+        return LexicalIndex(
+            self.vocab, offsets, new_positions[self.doc_ids[keep]], self.tfs[keep],
+            self.doc_lengths[~removed], self.k1, self.b
+        )
+
+    def save(self, folder_path):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        np.savez(
+            os.path.join(folder_path, LEXICAL_INDEX_FILE),
+            # Tokens never contain newlines, so the vocabulary is stored as one byte string
+            vocab=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths
+        )
+
+    @classmethod
+    def load(cls, folder_path):
+        """Loads the index saved next to a FAISS store, or returns None if there is none."""
+        path = os.path.join(folder_path, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            raw_vocab = data["vocab"].tobytes().decode("utf-8")
+            terms = raw_vocab.split("\n") if raw_vocab else []
+            return cls(
+                {term: i for i, term in enumerate(terms)},
+                data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"]
+            )
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.doc_ids.nbytes + self.tfs.nbytes + self.doc_lengths.nbytes + self.idf.nbytes
+
+    def search(self, query, k=HYBRID_FETCH_K):
+        """Returns up to k (FAISS position, BM25 score) pairs, best first."""
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        matched = False
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            matched = True
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            # Each document appears once per term, so plain fancy-index addition is safe
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+
+        if not matched:
+            return []
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top]
+
+def search_vectors(vector_store, query_vectors, fetch_k):
+    """One FAISS search for a batch of query vectors; returns the positions array, -1 padded."""
+    vectors = np.asarray(query_vectors, dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    _, positions = vector_store.index.search(vectors, fetch_k)
+    return positions
+
+def fuse_positions(vector_store, lexical_index, query, query_vector, k=4,
+                   vector_weight=None, lexical_weight=None, fetch_k=None, vector_positions=None):
+    """
+    Combines FAISS nearest neighbours with BM25 matches by weighted reciprocal rank fusion.
+    vector_positions are this query's row from an earlier batched search_vectors call.
+    Returns the top k FAISS positions, best first.
+    """
+    vector_weight = HYBRID_VECTOR_WEIGHT if vector_weight is None else vector_weight
+    lexical_weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    fetch_k = max(k, HYBRID_FETCH_K if fetch_k is None else fetch_k)
+
+    fused = {}
+    if vector_positions is None:
+        vector_positions = search_vectors(vector_store, [query_vector], fetch_k)[0]
+    for rank, position in enumerate(int(p) for p in vector_positions if p >= 0):
+        fused[position] = fused.get(position, 0.0) + vector_weight / (RRF_K + rank + 1)
+
+    if lexical_index is not None and lexical_weight > 0:
+        for rank, (position, _) in enumerate(lexical_index.search(query, fetch_k)):
+            fused[position] = fused.get(position, 0.0) + lexical_weight / (RRF_K + rank + 1)
+
+    return sorted(fused, key=fused.get, reverse=True)[:k]
+
+def get_documents_at(vector_store, positions):
+    """Maps FAISS positions to their Documents, skipping any that are missing."""
+    docs = []
+    for position in positions:
+        doc_id = vector_store.index_to_docstore_id.get(position)
+        doc = vector_store.docstore.search(doc_id) if doc_id is not None else None
+        if hasattr(doc, "page_content"):
+            docs.append(doc)
+    return docs
@@ -0,0 +1,735 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections.abc import MutableMapping
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from index_strategies import INDEX_PARAMS_FILE, get_index_type, reconstruct_all
+from lexical_index import LEXICAL_INDEX_FILE
+
+# Pickle-free session index layout. A session folder holds an append-only chunks.db and one
+# folder per saved version (FAISS index file, position -> chunk row map, BM25 index, parameters);
+# the CURRENT file names the live version and is replaced atomically on save.
+NATIVE_INDEX_FILE = "index.faiss"
+CHUNKS_DB_FILE = "chunks.db"
+CURRENT_FILE = "CURRENT"
+POSITIONS_FILE = "positions.npy"
+VERSION_META_FILE = "meta.json"
+VERSION_PREFIX = "v-"
+# Format 1/2 folders kept everything at the top level, chunks keyed by FAISS position
+LEGACY_CHUNKS_DB_FILE = "chunks.sqlite"
+LEGACY_PICKLE_FILE = "index.pkl"
+# Full-precision copy of the vectors, only kept next to a quantized index for re-scoring
+FULL_VECTORS_FILE = "vectors.npy"
+# Version 2 stores chunk texts zlib-compressed; version 1 texts are still read as they are.
+# Version 3 is the versioned layout above.
+FORMAT_VERSION = 3
+# Memory-map index files on load so pages are shared between worker processes
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") != "0"
+# "none", "fp16" or "int8" (per-dimension ranges); only flat indexes are quantized
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Quantized search fetches this many times k candidates, then re-scores them in float32
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+CHUNK_TEXT_COMPRESSION = os.getenv("CHUNK_TEXT_COMPRESSION", "1") != "0"
+# Vectors of an existing index copied into a VersionWriter per step
+COPY_BATCH = 4096
+# Chunk rows read per query when iterating a stored version; stays under SQLite's parameter limit
+STORED_BATCH = 500
+
+_QUANTIZER_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit
+}
+
+def _encode_text(text):
+    return zlib.compress(text.encode("utf-8")) if CHUNK_TEXT_COMPRESSION else text
+
+def _decode_text(value):
+    """Compressed texts come back from SQLite as bytes, uncompressed ones as str."""
+    return zlib.decompress(value).decode("utf-8") if isinstance(value, bytes) else value
+
+class RescoredIndex:
+    """
+    Read-only stand-in for a flat index whose vectors are stored scalar-quantized.
+    Searches over-fetch from the quantized index and re-rank the candidates by exact
+    float32 distance, read from a memory-mapped copy of the full vectors, so only the
+    few rows that are re-scored are paged in. make_writable turns it back into a flat index.
+    """
+
+    def __init__(self, quantized_index, vectors, rescore_factor=None):
+        self.quantized_index = quantized_index
+        self.vectors = vectors
+        self.rescore_factor = rescore_factor or VECTOR_RESCORE_FACTOR
+        self.ntotal = quantized_index.ntotal
+        self.d = quantized_index.d
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        fetch_k = min(self.ntotal, max(k, k * self.rescore_factor))
+        _, candidates = self.quantized_index.search(x, fetch_k)
+
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        positions = np.full((len(x), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(x, candidates)):
+            found = np.sort(found[found >= 0])
+            if not len(found):
+                continue
+            exact = ((np.asarray(self.vectors[found]) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[row, :len(order)] = exact[order]
+            positions[row, :len(order)] = found[order]
+        return distances, positions
+
+    def reconstruct(self, position):
+        return np.array(self.vectors[int(position)], dtype=np.float32)
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count], dtype=np.float32)
+
+    def resident_bytes(self):
+        """Quantized codes only; the full vectors are page cache."""
+        return self.quantized_index.sa_code_size() * self.ntotal
+
+def quantize_index(vectors, quantization):
+    """A scalar-quantized flat index over vectors ("fp16" or "int8")."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], _QUANTIZER_TYPES[quantization], faiss.METRIC_L2)
+    # int8 learns each dimension's min/max; fp16 needs no training data
+    index.train(vectors)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+class _ChunksDB:
+    """
+    Read-only connection to a chunks database, shared by the docstore and position map.
+    close() releases the file handle; a store still in use after that reconnects on its
+    next query.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def query(self, sql, params=()):
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore that reads chunk texts from SQLite on demand instead of holding them in RAM.
+    rowids are the chunk rows of the loaded version, in FAISS position order (None for a
+    format 1/2 folder, whose rows are keyed by position). Adds and deletes are kept in
+    memory until the store is saved again.
+    """
+
+    def __init__(self, chunks_db, rowids=None):
+        self.chunks_db = chunks_db
+        self.rowids = rowids
+        self._added = {}
+        self._deleted = set()
+
+    def search(self, search):
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return f"ID {search} not found."
+        rows = self.chunks_db.query("SELECT text, metadata FROM chunks WHERE doc_id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return Document(page_content=_decode_text(rows[0][0]), metadata=json.loads(rows[0][1]))
+
+    def add(self, texts):
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            if self._added.pop(doc_id, None) is None:
+                self._deleted.add(doc_id)
+
+    def _iter_stored(self, columns):
+        """Stored rows (doc_id, *columns) of the loaded version in position order, STORED_BATCH rows per query."""
+        if self.rowids is None:
+            last = -1
+            while True:
+                rows = self.chunks_db.query(
+                    f"SELECT position, doc_id, {columns} FROM chunks WHERE position > ? ORDER BY position LIMIT ?",
+                    (last, STORED_BATCH)
+                )
+                if not rows:
+                    return
+                for row in rows:
+                    yield row[1:]
+                last = rows[-1][0]
+        # chunks.db also holds rows of other versions, so this version's rows are looked up by id
+        for start in range(0, len(self.rowids), STORED_BATCH):
+            part = self.rowids[start:start + STORED_BATCH].tolist()
+            placeholders = ",".join("?" * len(part))
+            rows = {row[0]: row[1:] for row in self.chunks_db.query(
+                f"SELECT id, doc_id, {columns} FROM chunks WHERE id IN ({placeholders})", part
+            )}
+            for rowid in part:
+                if rowid in rows:
+                    yield rows[rowid]
+
+    def iter_documents(self):
+        """Yields (doc_id, Document) for every chunk, stored and pending."""
+        for doc_id, text, metadata in self._iter_stored("text, metadata"):
+            if doc_id not in self._deleted and doc_id not in self._added:
+                yield doc_id, Document(page_content=_decode_text(text), metadata=json.loads(metadata))
+        yield from list(self._added.items())
+
+    def iter_metadata(self):
+        """Like iter_documents, but yields (doc_id, metadata) without reading the texts."""
+        for doc_id, metadata in self._iter_stored("metadata"):
+            if doc_id not in self._deleted and doc_id not in self._added:
+                yield doc_id, json.loads(metadata)
+        yield from [(doc_id, doc.metadata) for doc_id, doc in self._added.items()]
+
+    def resident_bytes(self):
+        """Only pending documents and the row map live in memory."""
+        size = self.rowids.nbytes if self.rowids is not None else 0
+        return size + sum(len(doc.page_content) + len(str(doc.metadata)) for doc in self._added.values())
+
+class SQLitePositionMap(MutableMapping):
+    """
+    FAISS position -> docstore id, read lazily from SQLite so loading a session doesn't
+    materialise one dict entry per chunk. Positions added later live in memory.
+    """
+
+    def __init__(self, chunks_db, rowids=None):
+        self.chunks_db = chunks_db
+        self.rowids = rowids
+        if rowids is None:
+            self._stored_count = chunks_db.query("SELECT COUNT(*) FROM chunks")[0][0]
+        else:
+            self._stored_count = len(rowids)
+        self._added = {}
+
+    def __getitem__(self, position):
+        if position in self._added:
+            return self._added[position]
+        # FAISS search results are numpy integers
+        if hasattr(position, "__index__") and 0 <= position < self._stored_count:
+            if self.rowids is None:
+                rows = self.chunks_db.query("SELECT doc_id FROM chunks WHERE position = ?", (int(position),))
+            else:
+                rows = self.chunks_db.query("SELECT doc_id FROM chunks WHERE id = ?", (int(self.rowids[position]),))
+            if rows:
+                return rows[0][0]
+        raise KeyError(position)
+
+    def __setitem__(self, position, doc_id):
+        self._added[position] = doc_id
+
+    def __delitem__(self, position):
+        raise TypeError("Positions can't be deleted; FAISS.delete replaces the whole map")
+
+    def __iter__(self):
+        yield from range(self._stored_count)
+        yield from (position for position in self._added if position >= self._stored_count)
+
+    def __len__(self):
+        return self._stored_count + sum(1 for position in self._added if position >= self._stored_count)
+
+    def items(self):
+        # One query instead of one per position, FAISS.delete walks the whole map
+        if self.rowids is None:
+            merged = dict(self.chunks_db.query("SELECT position, doc_id FROM chunks ORDER BY position"))
+        else:
+            doc_ids = dict(self.chunks_db.query("SELECT id, doc_id FROM chunks"))
+            merged = {
+                position: doc_ids[rowid] for position, rowid in enumerate(self.rowids.tolist())
+                if rowid in doc_ids
+            }
+        merged.update(self._added)
+        return merged.items()
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+def iter_documents(docstore):
+    """Yields (doc_id, Document) from either an in-memory or a SQLite docstore."""
+    if hasattr(docstore, "iter_documents"):
+        yield from docstore.iter_documents()
+    else:
+        yield from docstore._dict.items()
+
+def iter_metadata(docstore):
+    """Yields (doc_id, metadata) from either docstore, skipping chunk texts where it can."""
+    if hasattr(docstore, "iter_metadata"):
+        yield from docstore.iter_metadata()
+    else:
+        yield from ((doc_id, doc.metadata) for doc_id, doc in docstore._dict.items())
+
+def get_current_version(folder_path):
+    """Name of the live version folder, or None for a legacy or missing session folder."""
+    try:
+        with open(os.path.join(folder_path, CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def get_data_folder(folder_path):
+    """Folder holding the live index files: the current version folder, or the folder itself for legacy layouts."""
+    version = get_current_version(folder_path)
+    return os.path.join(folder_path, version) if version else folder_path
+
+def is_native_index(folder_path):
+    return (
+        get_current_version(folder_path) is not None
+        or os.path.exists(os.path.join(folder_path, LEGACY_CHUNKS_DB_FILE))
+    )
+
+def _open_chunks_db(folder_path):
+    """Writable connection to the session's chunks.db, created on first use."""
+    conn = sqlite3.connect(os.path.join(folder_path, CHUNKS_DB_FILE))
+    # WAL lets loaded stores keep reading while a save appends rows
+    conn.execute("PRAGMA journal_mode=WAL")
+    with conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL UNIQUE,
+                text NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('format_version', ?)", (str(FORMAT_VERSION),))
+    return conn
+
+def _append_chunks(conn, vector_store):
+    """
+    Inserts the chunks chunks.db doesn't have yet; rows already stored (by doc id) are reused.
+    Returns the chunk row of every FAISS position, and {position: text} for the inserted ones.
+    """
+    stored = dict(conn.execute("SELECT doc_id, id FROM chunks"))
+    position_doc_ids = dict(vector_store.index_to_docstore_id.items())
+    rowids = np.empty(vector_store.index.ntotal, dtype=np.int64)
+    added = {}
+    with conn:
+        for position in range(vector_store.index.ntotal):
+            doc_id = position_doc_ids[position]
+            rowid = stored.get(doc_id)
+            if rowid is None:
+                doc = vector_store.docstore.search(doc_id)
+                if not isinstance(doc, Document):
+                    raise ValueError(f"Docstore is missing chunk {doc_id} at position {position}")
+                rowid = conn.execute(
+                    "INSERT INTO chunks (doc_id, text, metadata) VALUES (?, ?, ?)",
+                    (doc_id, _encode_text(doc.page_content), json.dumps(doc.metadata))
+                ).lastrowid
+                added[position] = doc.page_content
+            rowids[position] = rowid
+    return rowids, added
+
+def write_version(folder_path, vector_store, quantization=None):
+    """
+    Stores the vector store as a new version of the session folder without making it live:
+    chunks not yet in chunks.db are appended, and the index file and position -> row map
+    go into a fresh version folder. Other files (BM25 index, parameters) can be added to
+    that folder before publish_version swaps it in.
+    With quantization "fp16" or "int8" (default: VECTOR_QUANTIZATION) a flat index is
+    written scalar-quantized, plus the full vectors for re-scoring.
+    Returns (version, rowids, added): the version folder name, the chunk row of every
+    FAISS position, and {position: text} for the chunks that were newly stored.
+    """
+    quantization = quantization or VECTOR_QUANTIZATION
+    if quantization not in ("none", *_QUANTIZER_TYPES):
+        raise ValueError(f"Unknown vector quantization '{quantization}', expected none, fp16 or int8")
+    if quantization != "none" and get_index_type(vector_store.index) != "flat":
+        # HNSW keeps its own float32 copy and IVF-PQ is already compressed
+        quantization = "none"
+
+    index = vector_store.index
+    if isinstance(index, RescoredIndex):
+        # Not a faiss.Index; saved unquantized it has to be a real flat index again
+        index = _to_flat_index(index)
+
+    os.makedirs(folder_path, exist_ok=True)
+    conn = _open_chunks_db(folder_path)
+    try:
+        rowids, added = _append_chunks(conn, vector_store)
+    finally:
+        conn.close()
+
+    version = f"{VERSION_PREFIX}{uuid.uuid4().hex}"
+    version_path = os.path.join(folder_path, version)
+    os.makedirs(version_path)
+    index_path = os.path.join(version_path, NATIVE_INDEX_FILE)
+    if quantization == "none":
+        faiss.write_index(index, index_path)
+    else:
+        vectors = reconstruct_all(index)
+        np.save(os.path.join(version_path, FULL_VECTORS_FILE), vectors)
+        faiss.write_index(quantize_index(vectors, quantization), index_path)
+    np.save(os.path.join(version_path, POSITIONS_FILE), rowids)
+    _write_meta(version_path, vector_store._normalize_L2, vector_store.distance_strategy, quantization)
+    return version, rowids, added
+
+def _write_meta(version_path, normalize_L2, distance_strategy, quantization):
+    with open(os.path.join(version_path, VERSION_META_FILE), "w") as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "normalize_L2": bool(normalize_L2),
+            "distance_strategy": distance_strategy.value,
+            "quantization": quantization
+        }, f)
+
+def _flat_index_header(dimension, metric_type, ntotal):
+    """
+    The serialized header of a faiss IndexFlat holding ntotal vectors, taken from an empty
+    index with the vector count and the length of the float array that follows filled in.
+    """
+    header = bytearray(faiss.serialize_index(faiss.IndexFlat(dimension, metric_type)).tobytes())
+    # fourcc, d (int32), ntotal (int64), ..., and last the number of floats (uint64)
+    header[8:16] = struct.pack("<q", ntotal)
+    header[-8:] = struct.pack("<Q", ntotal * dimension)
+    return bytes(header)
+
+class VersionWriter:
+    """
+    Writes a new version of a session folder batch by batch, for uploads too large to hold
+    in memory: each batch's chunk rows go into chunks.db and its vectors are appended to the
+    version's flat index file as they arrive, so only the chunk row of every position is
+    kept. A base store's chunks and vectors are copied in first. HNSW and IVF-PQ indexes
+    only exist in memory, so on such a base the vectors are added to an in-memory copy.
+    finish() completes the version for publish_version; abort() removes it.
+    """
+
+    def __init__(self, folder_path, base_store=None):
+        os.makedirs(folder_path, exist_ok=True)
+        self.version = f"{VERSION_PREFIX}{uuid.uuid4().hex}"
+        self.version_path = os.path.join(folder_path, self.version)
+        os.makedirs(self.version_path)
+        self.conn = _open_chunks_db(folder_path)
+        self.rowids = array("q")
+        self.count = 0
+        self.dimension = None
+        self.index = None
+        self.file = None
+        self.normalize_L2 = bool(getattr(base_store, "_normalize_L2", False))
+        self.distance_strategy = getattr(base_store, "distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE)
+        if self.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+            self.metric_type = faiss.METRIC_INNER_PRODUCT
+        else:
+            self.metric_type = faiss.METRIC_L2
+        if base_store is not None:
+            self._add_base(base_store)
+
+    def _add_base(self, vector_store):
+        rowids, _ = _append_chunks(self.conn, vector_store)
+        self.rowids.extend(rowids.tolist())
+        index = vector_store.index
+        self.dimension = index.d
+        if get_index_type(index) != "flat":
+            self.index = faiss.deserialize_index(faiss.serialize_index(index))
+            self.count = index.ntotal
+            return
+        for start in range(0, index.ntotal, COPY_BATCH):
+            self._write_vectors(index.reconstruct_n(start, min(COPY_BATCH, index.ntotal - start)))
+
+    def _write_vectors(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is not None:
+            self.index.add(vectors)
+        else:
+            if self.file is None:
+                self._open_file(vectors.shape[1])
+            self.file.write(vectors.tobytes())
+            self.file.flush()
+        self.count += len(vectors)
+
+    def _open_file(self, dimension):
+        self.dimension = dimension
+        self.file = open(os.path.join(self.version_path, NATIVE_INDEX_FILE), "wb")
+        # Rewritten with the final counts by finish()
+        self.file.write(_flat_index_header(dimension, self.metric_type, 0))
+
+    def add(self, texts, metadatas, vectors):
+        """Stores one batch of chunks; vectors are the texts' embeddings."""
+        vectors = np.array(vectors, dtype=np.float32)
+        if self.normalize_L2:
+            faiss.normalize_L2(vectors)
+        with self.conn:
+            for text, metadata in zip(texts, metadatas):
+                self.rowids.append(self.conn.execute(
+                    "INSERT INTO chunks (doc_id, text, metadata) VALUES (?, ?, ?)",
+                    (str(uuid.uuid4()), _encode_text(text), json.dumps(metadata))
+                ).lastrowid)
+        self._write_vectors(vectors)
+
+    def finish(self):
+        """Completes the version's files. Returns (version, rowids)."""
+        index_path = os.path.join(self.version_path, NATIVE_INDEX_FILE)
+        if self.index is not None:
+            faiss.write_index(self.index, index_path)
+            self.index = None
+        else:
+            if self.file is None:
+                if self.dimension is None:
+                    raise ValueError("Nothing was written to the new index version")
+                self._open_file(self.dimension)
+            self.file.seek(0)
+            self.file.write(_flat_index_header(self.dimension, self.metric_type, self.count))
+            self.file.close()
+        rowids = np.frombuffer(self.rowids, dtype=np.int64)
+        np.save(os.path.join(self.version_path, POSITIONS_FILE), rowids)
+        _write_meta(self.version_path, self.normalize_L2, self.distance_strategy, "none")
+        self.conn.close()
+        return self.version, rowids
+
+    def abort(self):
+        """Drops the unfinished version; its chunk rows are removed by a later publish."""
+        if self.file is not None:
+            self.file.close()
+        self.conn.close()
+        shutil.rmtree(self.version_path, ignore_errors=True)
+
+def publish_version(folder_path, version):
+    """
+    Makes version live by atomically replacing the CURRENT file, so readers see either the
+    old or the new version, never a missing or half-written one. Then removes older version
+    folders and files of the legacy layout. Chunk rows are only deleted once neither the new
+    nor the previous version uses them, so a reader still on the previous version can fetch
+    its chunks until the next publish. Files still open elsewhere (Windows) are left for the
+    next publish to remove.
+    """
+    previous = get_current_version(folder_path)
+    keep = [np.load(os.path.join(folder_path, version, POSITIONS_FILE))]
+    if previous is not None and previous != version:
+        try:
+            keep.append(np.load(os.path.join(folder_path, previous, POSITIONS_FILE)))
+        except OSError:
+            pass
+
+    tmp_path = os.path.join(folder_path, f".{CURRENT_FILE}.tmp-{uuid.uuid4().hex}")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(folder_path, CURRENT_FILE))
+
+    for entry in os.scandir(folder_path):
+        if entry.name.startswith(VERSION_PREFIX) and entry.name != version and entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        elif entry.name in (LEGACY_PICKLE_FILE, LEGACY_CHUNKS_DB_FILE, NATIVE_INDEX_FILE, FULL_VECTORS_FILE,
+                            LEXICAL_INDEX_FILE, INDEX_PARAMS_FILE):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    conn = sqlite3.connect(os.path.join(folder_path, CHUNKS_DB_FILE))
+    try:
+        stored = np.array([rowid for (rowid,) in conn.execute("SELECT id FROM chunks")], dtype=np.int64)
+        unused = np.setdiff1d(stored, np.concatenate(keep))
+        if len(unused):
+            with conn:
+                conn.executemany("DELETE FROM chunks WHERE id = ?", ((int(rowid),) for rowid in unused))
+    finally:
+        conn.close()
+
+def save_native(folder_path, vector_store, quantization=None):
+    """write_version followed by publish_version. Returns the new version name."""
+    version, _, _ = write_version(folder_path, vector_store, quantization)
+    publish_version(folder_path, version)
+    return version
+
+def load_native(folder_path, embeddings, mmap=None, version=None):
+    """
+    Opens a native session index at its current version (or a legacy format 1/2 folder),
+    or at the given version, e.g. one written but not yet published.
+    The FAISS file is memory-mapped (unless mmap=False) and chunk texts stay in SQLite,
+    so load time doesn't grow with the number of chunks.
+    """
+    if mmap is None:
+        mmap = INDEX_MMAP
+    version = version or get_current_version(folder_path)
+    if version is None:
+        data_path = folder_path
+        chunks_db = _ChunksDB(os.path.join(folder_path, LEGACY_CHUNKS_DB_FILE))
+        meta = dict(chunks_db.query("SELECT key, value FROM meta"))
+        meta = {key: json.loads(meta[key]) if key == "normalize_L2" else meta[key] for key in meta}
+        rowids = None
+    else:
+        data_path = os.path.join(folder_path, version)
+        with open(os.path.join(data_path, VERSION_META_FILE), "r") as f:
+            meta = json.load(f)
+        rowids = np.load(os.path.join(data_path, POSITIONS_FILE))
+        chunks_db = _ChunksDB(os.path.join(folder_path, CHUNKS_DB_FILE))
+
+    index = faiss.read_index(os.path.join(data_path, NATIVE_INDEX_FILE), faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+    if meta.get("quantization", "none") != "none":
+        vectors = np.load(os.path.join(data_path, FULL_VECTORS_FILE), mmap_mode="r" if mmap else None)
+        index = RescoredIndex(index, vectors)
+    vector_store = FAISS(
+        embeddings,
+        index,
+        SQLiteDocstore(chunks_db, rowids),
+        SQLitePositionMap(chunks_db, rowids),
+        normalize_L2=meta.get("normalize_L2", False),
+        distance_strategy=DistanceStrategy(meta.get("distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE.value))
+    )
+    vector_store.index_mmapped = mmap
+    vector_store.index_version = version
+    return vector_store
+
+def close_native(vector_store):
+    """Closes the SQLite handle of a loaded native store, e.g. before its folder is removed."""
+    chunks_db = getattr(getattr(vector_store, "docstore", None), "chunks_db", None)
+    if chunks_db is not None:
+        chunks_db.close()
+
+def _to_flat_index(index):
+    flat_index = faiss.IndexFlatL2(index.d)
+    if index.ntotal:
+        flat_index.add(index.reconstruct_n(0, index.ntotal))
+    return flat_index
+
+def make_writable(vector_store):
+    """
+    Replaces a memory-mapped index with an in-memory copy. FAISS aborts the process if
+    a mapped index is modified, so call this before adding or removing vectors.
+    A quantized index becomes a flat float32 index again; it is re-quantized on save.
+    """
+    if isinstance(vector_store.index, RescoredIndex):
+        vector_store.index = _to_flat_index(vector_store.index)
+        vector_store.index_mmapped = False
+    elif getattr(vector_store, "index_mmapped", False):
+        vector_store.index = faiss.deserialize_index(faiss.serialize_index(vector_store.index))
+        vector_store.index_mmapped = False
+
+def convert_legacy_index(folder_path):
+    """
+    Rewrites a pickled FAISS.save_local folder in the native format, keeping the BM25 index
+    and index parameters. Returns False if the folder is not a pickled index.
+    """
+    if is_native_index(folder_path) or not os.path.exists(os.path.join(folder_path, LEGACY_PICKLE_FILE)):
+        return False
+
+    # Only trusted folders written by this app are converted; this is the last unpickling
+    vector_store = FAISS.load_local(folder_path, None, allow_dangerous_deserialization=True)
+    version, _, _ = write_version(folder_path, vector_store)
+    for name in (LEXICAL_INDEX_FILE, INDEX_PARAMS_FILE):
+        if os.path.exists(os.path.join(folder_path, name)):
+            shutil.copy2(os.path.join(folder_path, name), os.path.join(folder_path, version, name))
+    # The pickle and other top-level files are removed once the new version is live
+    publish_version(folder_path, version)
+    return True
+
+def _load_full_vectors(folder_path):
+    folder_path = get_data_folder(folder_path)
+    full_path = os.path.join(folder_path, FULL_VECTORS_FILE)
+    if os.path.exists(full_path):
+        return np.load(full_path)
+    return reconstruct_all(faiss.read_index(os.path.join(folder_path, NATIVE_INDEX_FILE)))
+
+def quantization_report(folder_path, k=10, query_count=200, quantizations=("none", "fp16", "int8")):
+    """
+    Memory saved versus recall lost for a saved session index: recall@k of each vector
+    quantization against exact float32 search, with and without re-scoring, plus how
+    much the stored chunk texts shrink with compression.
+    """
+    vectors = np.ascontiguousarray(_load_full_vectors(folder_path), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(query_count, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    def recall(found):
+        return sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries))) / (len(queries) * k)
+
+    results = []
+    for quantization in quantizations:
+        if quantization == "none":
+            results.append({
+                "quantization": "none",
+                "vector_bytes": vectors.nbytes,
+                "recall_at_k": 1.0
+            })
+            continue
+        index = quantize_index(vectors, quantization)
+        rescored = RescoredIndex(index, vectors)
+        start = time.perf_counter()
+        _, found = rescored.search(queries, k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        results.append({
+            "quantization": quantization,
+            "vector_bytes": rescored.resident_bytes(),
+            "memory_saved": round(1 - rescored.resident_bytes() / vectors.nbytes, 3),
+            "recall_at_k": recall(found),
+            "recall_at_k_without_rescoring": recall(index.search(queries, k)[1]),
+            "mean_query_ms": latency_ms
+        })
+
+    text_bytes = 0
+    compressed_bytes = 0
+    db_name = CHUNKS_DB_FILE if get_current_version(folder_path) else LEGACY_CHUNKS_DB_FILE
+    chunks_db = _ChunksDB(os.path.join(folder_path, db_name))
+    for (value,) in chunks_db.query("SELECT text FROM chunks"):
+        raw = _decode_text(value).encode("utf-8")
+        text_bytes += len(raw)
+        compressed_bytes += len(value) if isinstance(value, bytes) else len(zlib.compress(raw))
+    chunks_db.close()
+    return {
+        "vectors": len(vectors),
+        "k": k,
+        "queries": len(queries),
+        "rescore_factor": VECTOR_RESCORE_FACTOR,
+        "results": results,
+        "chunk_text_bytes": text_bytes,
+        "chunk_text_compressed_bytes": compressed_bytes
+    }
+
+if __name__ == "__main__":
+    # Usage: python native_index.py convert [faiss_indexes]
+    #        python native_index.py report faiss_indexes/<session_id> [--k 10] [--queries 200]
+    parser = argparse.ArgumentParser(description="Session index maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert pickled session indexes to the native format")
+    convert_parser.add_argument("root", nargs="?", default="faiss_indexes")
+    report_parser = subparsers.add_parser("report", help="Memory vs recall of vector quantization for one session index")
+    report_parser.add_argument("folder")
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print(json.dumps(quantization_report(args.folder, args.k, args.queries), indent=4))
+    else:
+        converted = 0
+        for entry in sorted(os.scandir(args.root), key=lambda e: e.name) if os.path.isdir(args.root) else []:
+            if entry.is_dir() and not entry.name.startswith("."):
+                try:
+                    if convert_legacy_index(entry.path):
+                        converted += 1
+                        print(f"Converted {entry.name}")
+                except Exception as e:
+                    print(f"Failed to convert {entry.name}: {e}")
+        print(f"Converted {converted} index folders in {args.root}")
@@ -1,53 +1,254 @@
 import os
+import queue
+import threading
+import time
+from contextlib import closing
+from itertools import groupby
 from dotenv import load_dotenv
-from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_openai import ChatOpenAI
 from langchain.chains.question_answering import load_qa_chain
 from langchain_core.prompts import PromptTemplate
+from embedding_utils import EmbeddingCache, get_embeddings, get_cached_embeddings
+from ingest_utils import extract_document_records, iter_document_records
+from index_utils import (
+    SessionIndexWriter, load_vector_store, save_vector_store, evict_vector_store,
+    get_chunk_hashes, get_index_version, get_lexical_index, remove_source
+)
+import shared_store
+from lexical_index import HYBRID_LEXICAL_WEIGHT, fuse_positions, get_documents_at
+from context_builder import CONTEXT_CANDIDATES, build_context, get_token_budget
+from answer_cache import lookup_answer, store_answer
+from tracing import count, span
+from http_client import HTTP_MAX_RETRIES, HTTP_READ_TIMEOUT, get_httpx_client, model_slot
 
 load_dotenv()
 
-from docx import Document
-
-def get_documents_text(docs):
-    text = ""
-    for doc in docs:
-        file_name = doc.name
-        if file_name.endswith(".pdf"):
-            pdf_reader = PdfReader(doc)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        elif file_name.endswith(".docx"):
-            doc_file = Document(doc)
-            for para in doc_file.paragraphs:
-                text += para.text + "\n"
-        elif file_name.endswith(".txt"):
-            text += str(doc.read(), "utf-8")
+# Any OpenAI-compatible endpoint works, e.g. fake_openai_server.py for local testing
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Small chunks so the context builder can fill a token budget with only the relevant parts
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+# Ceiling for text and vectors buffered between extraction and the index in streaming ingestion
+INGEST_MAX_MEMORY_MB = int(os.getenv("INGEST_MAX_MEMORY_MB", "256"))
+
+def get_documents_text(docs, max_workers=None):
+    """
+    Returns the concatenated text of the uploaded documents.
+    Extraction runs page by page across a process pool, see ingest_utils.extract_document_records.
+    """
+    with span("extract", documents=len(docs)):
+        records = extract_document_records(docs, max_workers=max_workers)
+        text = "".join(record["text"] for record in records)
+        count("pages_extracted", len(records))
+        count("chars_extracted", len(text))
     return text
 
 def get_text_chunks(text):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    chunks = text_splitter.split_text(text)
+    with span("chunk"):
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        chunks = text_splitter.split_text(text)
+        count("chunks", len(chunks))
     return chunks
 
-def get_vector_store(text_chunks, session_id):
+def iter_text_chunks(records, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Splits a stream of extracted records into chunks without joining the whole upload.
+    Text is buffered a few chunks at a time; the last chunk of each split is carried over
+    so chunks near the buffer edge are re-split together with the text that follows.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    window = chunk_size * 8
+    buffer = []
+    buffered = 0
+
+    for record in records:
+        buffer.append(record["text"])
+        buffered += len(record["text"])
+        if buffered < window:
+            continue
+
+        chunks = text_splitter.split_text("".join(buffer))
+        for chunk in chunks[:-1]:
+            yield chunk
+        buffer = chunks[-1:]
+        buffered = sum(len(chunk) for chunk in buffer)
+
+    if buffer:
+        yield from text_splitter.split_text("".join(buffer))
+
+def get_vector_store(text_chunks, session_id, index_strategy=None, source=None, user_id=None):
     """
     Creates a vector store and saves it in a folder specific to the session_id.
+    index_strategy is "flat", "hnsw", "ivfpq" or "auto" (default: INDEX_STRATEGY).
+    Each chunk's metadata carries source and its content hash, as iter_document_chunks does.
     """
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    
-    # Create directory if it doesn't exist
-    folder_path = f"faiss_indexes/{session_id}"
-    os.makedirs(folder_path, exist_ok=True)
+    metadatas = [{"source": source, "hash": EmbeddingCache.hash_text(chunk)} for chunk in text_chunks]
+    if shared_store.SHARED_STORE_ENABLED:
+        # The shared store is append-only, so rebuilding means tombstoning the old chunks first
+        with span("index.build", chunks=len(text_chunks)):
+            shared_store.delete_session(session_id)
+            shared_store.add_chunks(session_id, zip(text_chunks, metadatas), get_cached_embeddings(), user_id=user_id)
+        return
+
+    with span("index.build", chunks=len(text_chunks)):
+        embeddings = get_cached_embeddings()
+        vector_store = FAISS.from_texts(text_chunks, embedding=embeddings, metadatas=metadatas)
     
-    vector_store.save_local(folder_path)
+    # Saved atomically; also keeps the fresh index in memory so the first question skips the reload
+    with span("index.save"):
+        save_vector_store(session_id, vector_store, index_strategy)
 
-def get_conversational_chain(model_name):
-    prompt_template = """
+def iter_document_chunks(records, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Like iter_text_chunks, but splits each source document on its own and yields
+    (text, metadata) pairs carrying the source name and the chunk's content hash.
+    """
+    for source, source_records in groupby(records, key=lambda record: record["source"]):
+        for chunk in iter_text_chunks(source_records, chunk_size, chunk_overlap):
+            yield chunk, {"source": source, "hash": EmbeddingCache.hash_text(chunk)}
+
+def _count_records(records, progress_callback):
+    """Passes records through, reporting the running page count to progress_callback."""
+    pages = 0
+    for record in records:
+        yield record
+        pages += 1
+        progress_callback("extracted", pages)
+
+def _add_chunks_in_batches(writer, chunks, embeddings, batch_size, max_memory_mb, skip_hashes=None, progress_callback=None):
+    """
+    Embeds (text, metadata) pairs in batches and hands each batch to writer.add(texts,
+    metadatas, vectors), which stores it on disk (see index_utils.SessionIndexWriter).
+    Chunks whose hash is in skip_hashes are dropped.
+    progress_callback("embedded", chunks so far) is called after every batch.
+    Returns the number of chunks added.
+    """
+    if max_memory_mb is None:
+        max_memory_mb = INGEST_MAX_MEMORY_MB
+    # Half of the ceiling for the batch being embedded, half for the writer's pending BM25 texts
+    batch_bytes_limit = max_memory_mb * 1024 * 1024 // 2
+    seen_hashes = set(skip_hashes or ())
+    chunk_count = 0
+    batch = []
+    batch_bytes = 0
+
+    def flush(batch):
+        texts = [text for text, _ in batch]
+        metadatas = [metadata for _, metadata in batch]
+        with span("embed_batch", chunks=len(texts)):
+            vectors = embeddings.embed_documents(texts)
+            count("chunks_embedded", len(texts))
+            count("chars_embedded", sum(len(text) for text in texts))
+        with span("index.add", chunks=len(texts)):
+            writer.add(texts, metadatas, vectors)
+
+    for text, metadata in chunks:
+        if metadata["hash"] in seen_hashes:
+            continue
+        seen_hashes.add(metadata["hash"])
+
+        batch.append((text, metadata))
+        # Worst case for a Python str is 4 bytes per character; vectors are small next to the text
+        batch_bytes += len(text) * 4
+        if len(batch) >= batch_size or batch_bytes >= batch_bytes_limit:
+            flush(batch)
+            chunk_count += len(batch)
+            batch = []
+            batch_bytes = 0
+            if progress_callback:
+                progress_callback("embedded", chunk_count)
+
+    if batch:
+        flush(batch)
+        chunk_count += len(batch)
+        if progress_callback:
+            progress_callback("embedded", chunk_count)
+
+    return chunk_count
+
+def _open_writer(session_id, embeddings, base_store, max_memory_mb):
+    if max_memory_mb is None:
+        max_memory_mb = INGEST_MAX_MEMORY_MB
+    return SessionIndexWriter(session_id, embeddings, base_store, max_pending_bytes=max_memory_mb * 1024 * 1024 // 2)
+
+def add_documents_to_vector_store(docs, session_id, replace_sources=True, batch_size=64, max_memory_mb=None, max_workers=None, index_strategy=None, progress_callback=None, user_id=None):
+    """
+    Appends uploaded documents to the session's existing index instead of rebuilding it.
+    Chunks already in the index (same content hash) are skipped, and with replace_sources
+    the previous chunks of a re-uploaded file are removed first. Only new chunks are
+    embedded; they are written to the next index version batch by batch, which is
+    published atomically once the upload is done.
+    progress_callback(stage, count) receives ("extracted", pages), ("embedded", chunks)
+    and ("saving", chunks); an exception raised from it abandons the update unsaved.
+    user_id is recorded with the chunks in the shared store (VECTOR_STORE_MODE=shared).
+    Returns the number of chunks added.
+    """
+    with span("ingest", session_id=session_id, documents=len(docs)):
+        embeddings = get_cached_embeddings()
+        if shared_store.SHARED_STORE_ENABLED:
+            records = iter_document_records(docs, max_workers=max_workers)
+            if progress_callback:
+                records = _count_records(records, progress_callback)
+            with span("index.add"):
+                chunk_count = shared_store.add_chunks(
+                    session_id, iter_document_chunks(records), embeddings, user_id=user_id,
+                    replace_sources=[doc.name for doc in docs] if replace_sources else (),
+                    batch_size=batch_size, progress_callback=progress_callback
+                )
+            return chunk_count
+
+        with span("index.load"):
+            vector_store = load_vector_store(session_id, embeddings)
+
+        writer = None
+        try:
+            if vector_store is not None and replace_sources:
+                with span("index.remove_sources"):
+                    for doc in docs:
+                        count("chunks_removed", remove_source(vector_store, doc.name))
+
+            writer = _open_writer(session_id, embeddings, vector_store, max_memory_mb)
+            records = iter_document_records(docs, max_workers=max_workers)
+            if progress_callback:
+                records = _count_records(records, progress_callback)
+            chunk_count = _add_chunks_in_batches(
+                writer, iter_document_chunks(records), embeddings, batch_size, max_memory_mb,
+                skip_hashes=get_chunk_hashes(vector_store), progress_callback=progress_callback
+            )
+            if progress_callback:
+                progress_callback("saving", chunk_count)
+        except Exception:
+            # The cached store may have been modified in place; force a reload from disk
+            evict_vector_store(session_id)
+            if writer is not None:
+                writer.abort()
+            raise
+
+        if vector_store is None and not chunk_count:
+            writer.abort()
+            return 0
+
+        with span("index.save"):
+            writer.commit(index_strategy)
+    return chunk_count
+
+def remove_document_from_vector_store(source, session_id):
+    """Removes one source document's chunks from the session index. Returns the number removed."""
+    if shared_store.SHARED_STORE_ENABLED:
+        return shared_store.remove_source(session_id, source)
+    vector_store = load_vector_store(session_id, get_cached_embeddings())
+    if vector_store is None:
+        return 0
+
+    removed = remove_source(vector_store, source)
+    if removed:
+        save_vector_store(session_id, vector_store)
+    return removed
+
+PROMPT_TEMPLATE = """
     Answer the question as detailed as possible from the provided context, make sure to provide all the details, if the answer is not in
     provided context just say, "answer is not available in the context", don't provide the wrong answer\n\n
     Context:\n {context}?\n
@@ -55,30 +256,220 @@ def get_conversational_chain(model_name):
 
     Answer:
     """
-    model = ChatOpenAI(
-        model=model_name,
-        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        openai_api_base="https://openrouter.ai/api/v1",
-        temperature=0.3
-    )
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-    chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
-    return chain
+
+# Chat models and chains are reused across questions, keyed by everything that configures them
+_chat_models = {}
+_chains = {}
+_clients_lock = threading.Lock()
+
+def _client_key(model_name, streaming):
+    return (model_name, streaming, OPENROUTER_BASE_URL, os.getenv("OPENROUTER_API_KEY"))
+
+def get_chat_model(model_name, streaming=False):
+    """
+    Returns a shared ChatOpenAI client for the model. All of them use the pooled
+    keep-alive connection from http_client; the OpenAI SDK retries 429/5xx responses
+    with jittered exponential back-off.
+    """
+    key = _client_key(model_name, streaming)
+    with _clients_lock:
+        model = _chat_models.get(key)
+        if model is None:
+            model = _chat_models[key] = ChatOpenAI(
+                model=model_name,
+                openai_api_key=key[3],
+                openai_api_base=OPENROUTER_BASE_URL,
+                temperature=0.3,
+                streaming=streaming,
+                max_retries=HTTP_MAX_RETRIES,
+                request_timeout=HTTP_READ_TIMEOUT,
+                http_client=get_httpx_client()
+            )
+        return model
+
+def get_conversational_chain(model_name):
+    model = get_chat_model(model_name)
+    key = _client_key(model_name, False)
+    with _clients_lock:
+        chain = _chains.get(key)
+        if chain is None:
+            prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+            chain = _chains[key] = load_qa_chain(model, chain_type="stuff", prompt=prompt)
+        return chain
+
+def retrieve_documents(new_db, session_id, user_question, question_vector, model_name=None, k=CONTEXT_CANDIDATES, vector_positions=None):
+    """
+    Hybrid retrieval: FAISS neighbours fused with BM25 matches from the session's
+    lexical index, so exact identifiers and error codes are found too.
+    Setting HYBRID_LEXICAL_WEIGHT=0 falls back to pure vector search.
+    The k candidates are then packed into the model's token budget, see context_builder.
+    vector_positions skips the FAISS search when the caller already ran it (see batch_qa).
+    """
+    with span("lexical.load"):
+        lexical_index = get_lexical_index(session_id, new_db) if HYBRID_LEXICAL_WEIGHT > 0 else None
+    with span("search", k=k):
+        positions = fuse_positions(
+            new_db, lexical_index, user_question, question_vector, k=k, vector_positions=vector_positions
+        )
+
+    docs = []
+    vectors = []
+    with span("docs.fetch"):
+        for position in positions:
+            found = get_documents_at(new_db, [position])
+            if not found:
+                continue
+            docs.append(found[0])
+            if vectors is not None:
+                try:
+                    vectors.append(new_db.index.reconstruct(position))
+                except RuntimeError:
+                    # Index type without stored vectors; pack in relevance order instead of MMR
+                    vectors = None
+        count("chunks_retrieved", len(docs))
+
+    with span("context.pack") as pack_span:
+        packed, stats = build_context(docs, question_vector, vectors, get_token_budget(model_name))
+        pack_span["attrs"].update(stats)
+        count("context_tokens", stats["tokens_used"])
+        count("context_budget_tokens", stats["budget"])
+        count("context_tokens_saved", stats["tokens_saved"])
+        count("context_chunks_packed", stats["packed"])
+    return packed
 
 def user_input(user_question, model_name, session_id):
     """
     Loads the vector store specifically for the given session_id.
+    Repeated or near-duplicate questions are answered from the per-session answer cache.
     """
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    
-    index_path = f"faiss_indexes/{session_id}"
-    
-    # Check if index exists for this specific session
-    if not os.path.exists(index_path):
-        return "Context not found for this session. Please upload documents to start."
+    with span("chat_turn", session_id=session_id, model=model_name):
+        with span("embeddings.load"):
+            embeddings = get_embeddings()
+        
+        # Served from the in-process cache unless the index changed on disk
+        with span("index.load"):
+            new_db = load_vector_store(session_id, embeddings)
         
-    new_db = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-    docs = new_db.similarity_search(user_question)
-    chain = get_conversational_chain(model_name)
-    response = chain({"input_documents": docs, "question": user_question}, return_only_outputs=True)
-    return response["output_text"]
\ No newline at end of file
+        # Check if index exists for this specific session
+        if new_db is None:
+            return "Context not found for this session. Please upload documents to start."
+
+        with span("embed_query"):
+            question_vector = embeddings.embed_query(user_question)
+        index_version = get_index_version(session_id)
+        with span("answer_cache.lookup") as lookup_span:
+            cached = lookup_answer(session_id, model_name, user_question, question_vector, index_version)
+            lookup_span["attrs"]["hit"] = cached is not None
+        if cached is not None:
+            return cached
+            
+        with span("retrieve"):
+            docs = retrieve_documents(new_db, session_id, user_question, question_vector, model_name)
+        answer = answer_from_documents(docs, user_question, model_name)
+        store_answer(session_id, model_name, user_question, question_vector, answer, index_version,
+                     sources=sorted({doc.metadata.get("source") for doc in docs} - {None}))
+    return answer
+
+def answer_from_documents(docs, user_question, model_name):
+    """Runs the stuff chain over already retrieved documents, holding one of the model's slots."""
+    # Prompt assembly happens inside the stuff chain, so it is part of this span
+    with span("llm.call", model=model_name), model_slot(model_name):
+        chain = get_conversational_chain(model_name)
+        response = chain({"input_documents": docs, "question": user_question}, return_only_outputs=True)
+        count("answer_chars", len(response["output_text"]))
+    return response["output_text"]
+
+# Marks the end of a worker's pieces in the queue user_input_stream reads
+_STREAM_DONE = object()
+
+def user_input_stream(user_question, model_name, session_id):
+    """
+    Streaming variant of user_input: yields the answer piece by piece as the
+    OpenAI-compatible endpoint produces tokens. The prompt is the same one the
+    "stuff" chain builds, so the answers match user_input.
+
+    The pipeline runs on a worker thread that hands pieces over through a queue, so the
+    model slot and the trace spans are never held while the consumer is suspended.
+    Closing the generator stops the worker at the next token; a consumer that just
+    drops it still gets the slot back once the upstream stream ends.
+    """
+    pieces = queue.Queue()
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=_answer_stream_worker, args=(user_question, model_name, session_id, pieces, stop),
+        name="answer-stream", daemon=True
+    )
+    worker.start()
+    try:
+        while True:
+            piece = pieces.get()
+            if piece is _STREAM_DONE:
+                return
+            if isinstance(piece, Exception):
+                raise piece
+            yield piece
+    finally:
+        stop.set()
+
+def _answer_stream_worker(user_question, model_name, session_id, pieces, stop):
+    try:
+        for piece in _answer_stream(user_question, model_name, session_id, stop):
+            pieces.put(piece)
+    except Exception as e:
+        pieces.put(e)
+    finally:
+        pieces.put(_STREAM_DONE)
+
+def _answer_stream(user_question, model_name, session_id, stop):
+    """The streaming pipeline, consumed on the worker thread until it ends or stop is set."""
+    with span("chat_turn", session_id=session_id, model=model_name, streaming=True):
+        with span("embeddings.load"):
+            embeddings = get_embeddings()
+        with span("index.load"):
+            new_db = load_vector_store(session_id, embeddings)
+
+        if new_db is None:
+            yield "Context not found for this session. Please upload documents to start."
+            return
+
+        with span("embed_query"):
+            question_vector = embeddings.embed_query(user_question)
+        index_version = get_index_version(session_id)
+        with span("answer_cache.lookup") as lookup_span:
+            cached = lookup_answer(session_id, model_name, user_question, question_vector, index_version)
+            lookup_span["attrs"]["hit"] = cached is not None
+        if cached is not None:
+            yield cached
+            return
+
+        with span("retrieve"):
+            docs = retrieve_documents(new_db, session_id, user_question, question_vector, model_name)
+        with span("prompt.build"):
+            # Same layout as the stuff chain: page contents joined by blank lines
+            context = "\n\n".join(doc.page_content for doc in docs)
+            prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+            prompt_text = prompt.format(context=context, question=user_question)
+            count("prompt_bytes", len(prompt_text.encode("utf-8")))
+        parts = []
+        with span("llm.stream", model=model_name) as llm_span, model_slot(model_name):
+            model = get_chat_model(model_name, streaming=True)
+            start = time.perf_counter()
+            # Closing the upstream stream drops the HTTP response when the consumer stops early
+            with closing(model.stream(prompt_text)) as stream:
+                for chunk in stream:
+                    if stop.is_set():
+                        llm_span["attrs"]["cancelled"] = True
+                        break
+                    if chunk.content:
+                        if not parts:
+                            llm_span["attrs"]["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                        parts.append(chunk.content)
+                        count("answer_chunks")
+                        yield chunk.content
+            count("answer_chars", sum(len(part) for part in parts))
+
+        # Only complete answers are cached
+        if stop.is_set():
+            return
+        store_answer(session_id, model_name, user_question, question_vector, "".join(parts), index_version,
+                     sources=sorted({doc.metadata.get("source") for doc in docs} - {None}))
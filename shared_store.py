@@ -0,0 +1,597 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import uuid
+import zipfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from lexical_index import LexicalIndex
+
+# Optional consolidated store: every session's chunks live in one SQLite database and a fixed
+# number of FAISS shards, instead of one index folder per session. Enable with VECTOR_STORE_MODE=shared.
+# Memory: compaction writes a snapshot of each shard that processes memory-map, so only the rows
+# added since the last compaction are held in each process's RAM (see _ShardIndex). Each row also
+# keeps its vector in SQLite, on disk only, for processes catching up and for rebuilding shards.
+VECTOR_STORE_MODE = os.getenv("VECTOR_STORE_MODE", "session")
+SHARED_STORE_ENABLED = VECTOR_STORE_MODE == "shared"
+SHARED_STORE_ROOT = os.getenv("SHARED_STORE_ROOT", "shared_index")
+SHARED_SHARDS = int(os.getenv("SHARED_SHARDS", "8"))
+# Sessions up to this many chunks are searched by gathering their vectors; larger ones use
+# FAISS's filtered search over the whole shard
+SMALL_SESSION_CHUNKS = 20000
+# Session views (position map plus BM25 index) kept in memory
+SHARED_VIEW_CACHE_ENTRIES = int(os.getenv("SHARED_VIEW_CACHE_ENTRIES", "32"))
+
+_lock = threading.Lock()
+# shard -> {"index", "upto", "generation"}
+_shards = {}
+_views = OrderedDict()
+_reader = None
+
+def _db_path():
+    return os.path.join(SHARED_STORE_ROOT, "chunks.sqlite")
+
+def _connect():
+    os.makedirs(SHARED_STORE_ROOT, exist_ok=True)
+    conn = sqlite3.connect(_db_path(), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # AUTOINCREMENT so ids are never reused after compaction; shards sync by id order
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shard INTEGER NOT NULL,
+            session_id TEXT NOT NULL,
+            user_id TEXT,
+            source TEXT,
+            hash TEXT NOT NULL,
+            text TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_session ON chunks (session_id, deleted)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_shard ON chunks (shard, id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            version REAL NOT NULL,
+            deleted_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+            shard INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    return conn
+
+def _read_chunk(chunk_id):
+    """Looks up one chunk over a connection kept open for the process."""
+    global _reader
+    with _lock:
+        if _reader is None:
+            _connect().close()
+            _reader = sqlite3.connect(_db_path(), timeout=30, check_same_thread=False)
+        return _reader.execute("SELECT text, metadata FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+
+def _lexical_folder(session_id):
+    return os.path.join(SHARED_STORE_ROOT, "lexical", session_id)
+
+def _load_session_lexical(session_id):
+    """The session's persisted BM25 index and the chunk ids it covers, or (None, None)."""
+    folder = _lexical_folder(session_id)
+    try:
+        ids = np.load(os.path.join(folder, "ids.npy"))
+        lexical_index = LexicalIndex.load(folder)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None, None
+    if lexical_index is None or len(lexical_index.doc_lengths) != len(ids):
+        # Caught between the two file replacements of a concurrent save
+        return None, None
+    return ids, lexical_index
+
+def _save_session_lexical(session_id, ids, lexical_index):
+    folder = _lexical_folder(session_id)
+    tmp_folder = f"{folder}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_folder)
+    try:
+        lexical_index.save(tmp_folder)
+        np.save(os.path.join(tmp_folder, "ids.npy"), ids)
+        os.makedirs(folder, exist_ok=True)
+        for name in os.listdir(tmp_folder):
+            os.replace(os.path.join(tmp_folder, name), os.path.join(folder, name))
+    finally:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+def _sync_session_lexical(conn, session_id, ids=None):
+    """
+    Brings the session's persisted BM25 index in line with its live chunk ids (default: read
+    from the database). Tombstoned chunks are dropped from the postings and only chunks added
+    since the last sync are read and tokenized, so ingestion keeps it current at the cost of
+    the new chunks alone. Returns the index.
+    """
+    if ids is None:
+        ids = np.array(
+            [row[0] for row in conn.execute(
+                "SELECT id FROM chunks WHERE session_id = ? AND deleted = 0 ORDER BY id", (session_id,)
+            )],
+            dtype=np.int64
+        )
+    old_ids, lexical_index = _load_session_lexical(session_id)
+    if lexical_index is not None and np.array_equal(old_ids, ids):
+        return lexical_index
+    # A view loaded before the last ingest mustn't overwrite the newer persisted copy
+    persist = old_ids is None or not len(old_ids) or (len(ids) and ids[-1] >= old_ids[-1])
+
+    if lexical_index is not None:
+        kept = np.isin(old_ids, ids)
+        lexical_index = lexical_index.remove_documents(np.flatnonzero(~kept))
+        old_ids = old_ids[kept]
+        # Ids only grow, so new chunks always come after the ones already indexed
+        if not np.array_equal(ids[:len(old_ids)], old_ids):
+            lexical_index = None
+    if lexical_index is None:
+        old_ids = ids[:0]
+        lexical_index = LexicalIndex.build([])
+
+    new_ids = ids[len(old_ids):]
+    if len(new_ids):
+        texts = dict(conn.execute(
+            "SELECT id, text FROM chunks WHERE session_id = ? AND id >= ? AND deleted = 0",
+            (session_id, int(new_ids[0]))
+        ).fetchall())
+        lexical_index = lexical_index.add_documents([texts.get(int(chunk_id), "") for chunk_id in new_ids])
+    if persist:
+        _save_session_lexical(session_id, ids, lexical_index)
+    return lexical_index
+
+def shard_for(session_id):
+    """Stable across processes, unlike hash()."""
+    return int(hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8], 16) % SHARED_SHARDS
+
+def _snapshot_paths(shard):
+    base = os.path.join(SHARED_STORE_ROOT, f"shard_{shard:03d}")
+    return f"{base}.faiss", f"{base}.json"
+
+def _get_generation(conn, shard):
+    row = conn.execute("SELECT generation FROM shards WHERE shard = ?", (shard,)).fetchone()
+    return row["generation"] if row else 0
+
+class _ShardIndex:
+    """
+    A shard's vectors: the snapshot written by the last compaction, memory-mapped so its
+    pages live in the OS page cache shared by every process, plus the rows added since
+    in an in-memory index. Provides the calls _SessionIndex makes on an IndexIDMap2.
+    """
+
+    def __init__(self, snapshot=None, snapshot_upto=0):
+        self.snapshot = snapshot
+        self.snapshot_upto = snapshot_upto
+        self.delta = None
+
+    @property
+    def d(self):
+        return (self.snapshot or self.delta).d
+
+    @property
+    def ntotal(self):
+        return sum(part.ntotal for part in self._parts())
+
+    @property
+    def delta_ntotal(self):
+        return self.delta.ntotal if self.delta is not None else 0
+
+    def _parts(self):
+        return [part for part in (self.snapshot, self.delta) if part is not None]
+
+    def add_with_ids(self, vectors, ids):
+        # A memory-mapped index can't grow, so new rows always go to the delta
+        if self.delta is None:
+            self.delta = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        self.delta.add_with_ids(vectors, ids)
+
+    def search(self, x, k, params=None):
+        results = [part.search(x, k, params=params) for part in self._parts()]
+        if len(results) == 1:
+            return results[0]
+        # Missing neighbours come back as -1 at float max distance, so they sort last
+        distances = np.hstack([result[0] for result in results])
+        ids = np.hstack([result[1] for result in results])
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def reconstruct(self, chunk_id):
+        part = self.snapshot if self.snapshot is not None and chunk_id <= self.snapshot_upto else self.delta
+        return part.reconstruct(chunk_id)
+
+    def reconstruct_batch(self, ids):
+        """ids in ascending order, as the session's chunk ids are."""
+        split = int(np.searchsorted(ids, self.snapshot_upto, side="right")) if self.snapshot is not None else 0
+        parts = []
+        if split:
+            parts.append(self.snapshot.reconstruct_batch(ids[:split]))
+        if split < len(ids):
+            parts.append(self.delta.reconstruct_batch(ids[split:]))
+        return np.vstack(parts)
+
+    def to_index(self):
+        """Everything in one in-memory IndexIDMap2, for writing a new snapshot."""
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.d))
+        for part in self._parts():
+            vectors = faiss.downcast_index(part.index).reconstruct_n(0, part.ntotal)
+            index.add_with_ids(vectors, faiss.vector_to_array(part.id_map))
+        return index
+
+def _load_snapshot(shard, generation):
+    """Returns (index, upto) from the shard's snapshot if it matches the current generation."""
+    index_path, meta_path = _snapshot_paths(shard)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["generation"] != generation:
+            return None, 0
+        # Compaction replaces the file rather than writing into it, so the mapping stays valid
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC), meta["upto"]
+    except (OSError, ValueError, KeyError, RuntimeError):
+        return None, 0
+
+def _get_shard(conn, shard):
+    """
+    The shard's in-process state with its FAISS index brought up to date with rows other
+    processes added. Reloaded from scratch when a compaction bumped the shard's generation.
+    """
+    generation = _get_generation(conn, shard)
+    with _lock:
+        state = _shards.get(shard)
+        if state is None or state["generation"] != generation:
+            snapshot, upto = _load_snapshot(shard, generation)
+            index = _ShardIndex(snapshot, upto) if snapshot is not None else None
+            state = _shards[shard] = {"index": index, "upto": upto, "generation": generation, "lock": threading.Lock()}
+
+    with state["lock"]:
+        rows = conn.execute(
+            "SELECT id, vector FROM chunks WHERE shard = ? AND id > ? ORDER BY id",
+            (shard, state["upto"])
+        ).fetchall()
+        if rows:
+            vectors = np.vstack([np.frombuffer(row["vector"], dtype=np.float32) for row in rows])
+            if state["index"] is None:
+                state["index"] = _ShardIndex()
+            state["index"].add_with_ids(vectors, np.array([row["id"] for row in rows], dtype=np.int64))
+            state["upto"] = rows[-1]["id"]
+    return state
+
+def _touch_session(conn, session_id, user_id=None):
+    conn.execute(
+        """INSERT INTO sessions (session_id, user_id, version, deleted_at) VALUES (?, ?, ?, NULL)
+           ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, deleted_at = NULL,
+           user_id = COALESCE(excluded.user_id, sessions.user_id)""",
+        (session_id, user_id, time.time())
+    )
+
+def get_session_version(session_id):
+    """Changes whenever the session's chunks change; None if it has no chunks."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT version FROM sessions WHERE session_id = ? AND deleted_at IS NULL", (session_id,)
+        ).fetchone()
+    return row["version"] if row else None
+
+def list_sessions():
+    """{session_id: version} for every session that still has chunks."""
+    with closing(_connect()) as conn:
+        return {
+            row["session_id"]: row["version"]
+            for row in conn.execute("SELECT session_id, version FROM sessions WHERE deleted_at IS NULL")
+        }
+
+def get_session_hashes(session_id, exclude_sources=()):
+    query = "SELECT hash, source FROM chunks WHERE session_id = ? AND deleted = 0"
+    with closing(_connect()) as conn:
+        return {row["hash"] for row in conn.execute(query, (session_id,)) if row["source"] not in exclude_sources}
+
+def get_session_sources(session_id):
+    with closing(_connect()) as conn:
+        return [
+            row["source"] for row in conn.execute(
+                "SELECT DISTINCT source FROM chunks WHERE session_id = ? AND deleted = 0 AND source IS NOT NULL ORDER BY source",
+                (session_id,)
+            )
+        ]
+
+def add_chunks(session_id, chunks, embeddings, user_id=None, replace_sources=(), batch_size=64, skip_hashes=None, progress_callback=None):
+    """
+    Embeds (text, metadata) pairs in batches and appends them to the session's shard.
+    Chunks already in the session (same content hash) or in skip_hashes are dropped.
+    Earlier chunks of the sources in replace_sources are tombstoned once every new chunk
+    is in; if anything raises first, the new chunks are tombstoned instead.
+    progress_callback("embedded", chunks so far) is called after every batch, then
+    ("saving", chunks) before the replaced sources are tombstoned; raising from it keeps
+    the session as it was.
+    Returns the number of chunks added.
+    """
+    shard = shard_for(session_id)
+    replace_sources = set(replace_sources)
+    seen_hashes = get_session_hashes(session_id, replace_sources) | set(skip_hashes or ())
+    with closing(_connect()) as conn:
+        start_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+    added = 0
+    batch = []
+
+    def flush(batch):
+        vectors = np.asarray(embeddings.embed_documents([text for text, _ in batch]), dtype=np.float32)
+        with closing(_connect()) as conn, conn:
+            conn.executemany(
+                """INSERT INTO chunks (shard, session_id, user_id, source, hash, text, metadata, vector)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (shard, session_id, user_id, metadata.get("source"), metadata["hash"], text,
+                     json.dumps(metadata), vector.tobytes())
+                    for (text, metadata), vector in zip(batch, vectors)
+                ]
+            )
+            _touch_session(conn, session_id, user_id)
+
+    try:
+        for text, metadata in chunks:
+            if metadata["hash"] in seen_hashes:
+                continue
+            seen_hashes.add(metadata["hash"])
+            batch.append((text, metadata))
+            if len(batch) >= batch_size:
+                flush(batch)
+                added += len(batch)
+                batch = []
+                if progress_callback:
+                    progress_callback("embedded", added)
+
+        if batch:
+            flush(batch)
+            added += len(batch)
+            if progress_callback:
+                progress_callback("embedded", added)
+        if progress_callback:
+            progress_callback("saving", added)
+    except BaseException:
+        # Ingestion of one session is serialised, so everything past start_id is ours
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "UPDATE chunks SET deleted = 1 WHERE session_id = ? AND id > ? AND deleted = 0",
+                (session_id, start_id)
+            )
+            _touch_session(conn, session_id)
+        raise
+
+    with closing(_connect()) as conn:
+        if replace_sources:
+            with conn:
+                conn.executemany(
+                    "UPDATE chunks SET deleted = 1 WHERE session_id = ? AND source = ? AND id <= ? AND deleted = 0",
+                    [(session_id, source, start_id) for source in replace_sources]
+                )
+                _touch_session(conn, session_id)
+        if added or replace_sources:
+            _sync_session_lexical(conn, session_id)
+    return added
+
+def remove_source(session_id, source):
+    """Tombstones every chunk of the session that came from source. Returns the number removed."""
+    with closing(_connect()) as conn, conn:
+        removed = conn.execute(
+            "UPDATE chunks SET deleted = 1 WHERE session_id = ? AND source = ? AND deleted = 0",
+            (session_id, source)
+        ).rowcount
+        if removed:
+            _touch_session(conn, session_id)
+    if removed:
+        with closing(_connect()) as conn:
+            _sync_session_lexical(conn, session_id)
+    return removed
+
+def delete_session(session_id):
+    """Tombstones all of the session's chunks; compact() reclaims them."""
+    with closing(_connect()) as conn, conn:
+        conn.execute("UPDATE chunks SET deleted = 1 WHERE session_id = ? AND deleted = 0", (session_id,))
+        conn.execute("UPDATE sessions SET deleted_at = ? WHERE session_id = ?", (time.time(), session_id))
+    with _lock:
+        _views.pop(session_id, None)
+    shutil.rmtree(_lexical_folder(session_id), ignore_errors=True)
+
+def compact():
+    """
+    Removes tombstoned chunks from the database and their shards, and writes a fresh snapshot
+    of every shard that changed so other processes start from it instead of the database.
+    Returns a report dict.
+    """
+    report = {"shards_compacted": 0, "chunks_removed": 0, "sessions_removed": 0}
+    with closing(_connect()) as conn:
+        for shard in range(SHARED_SHARDS):
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                removed = conn.execute("DELETE FROM chunks WHERE shard = ? AND deleted = 1", (shard,)).rowcount
+                if removed:
+                    conn.execute(
+                        """INSERT INTO shards (shard, generation) VALUES (?, 1)
+                           ON CONFLICT(shard) DO UPDATE SET generation = generation + 1""",
+                        (shard,)
+                    )
+            report["chunks_removed"] += removed
+            report["shards_compacted"] += 1 if removed else 0
+            index_path, meta_path = _snapshot_paths(shard)
+            # _get_shard reloads the shard without the removed ids since the generation changed
+            state = _get_shard(conn, shard)
+            if state["index"] is None:
+                continue
+            if not removed:
+                # Unchanged shards only get a new snapshot once it is missing or behind
+                _, snapshot_upto = _load_snapshot(shard, state["generation"])
+                if snapshot_upto >= state["upto"]:
+                    continue
+            with state["lock"]:
+                tmp_path = f"{index_path}.{os.getpid()}.tmp"
+                faiss.write_index(state["index"].to_index(), tmp_path)
+                os.replace(tmp_path, index_path)
+                with open(f"{meta_path}.{os.getpid()}.tmp", "w") as f:
+                    json.dump({"generation": state["generation"], "upto": state["upto"]}, f)
+                os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+            # Next use maps the new snapshot instead of keeping this process's copy in memory
+            with _lock:
+                _shards.pop(shard, None)
+
+        with conn:
+            report["sessions_removed"] = conn.execute(
+                """DELETE FROM sessions WHERE deleted_at IS NOT NULL
+                   AND session_id NOT IN (SELECT DISTINCT session_id FROM chunks)"""
+            ).rowcount
+    with _lock:
+        _views.clear()
+    return report
+
+class _SessionDocstore:
+    """Docstore over the shared chunks table, keyed by chunk id."""
+
+    def search(self, search):
+        row = _read_chunk(search)
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+class _SessionIndex:
+    """
+    The FAISS calls retrieval makes (search, reconstruct, ntotal, d), restricted to one
+    session's chunks in a shared shard. Positions are the session's own 0..n-1.
+    """
+
+    def __init__(self, shard_index, ids, lock):
+        self.shard_index = shard_index
+        self.ids = ids
+        self.lock = lock
+        self.ntotal = len(ids)
+        self.d = shard_index.d
+        self._vectors = None
+        self._positions = None
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        # The shard's lock: another thread may be appending rows to it
+        with self.lock:
+            if self.ntotal <= SMALL_SESSION_CHUNKS:
+                if self._vectors is None:
+                    self._vectors = self.shard_index.reconstruct_batch(self.ids)
+            else:
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(self.ids))
+                distances, found_ids = self.shard_index.search(x, k, params=params)
+        if self.ntotal <= SMALL_SESSION_CHUNKS:
+            # Pads with -1 like a FAISS index when the session has fewer than k chunks
+            return faiss.knn(x, self._vectors, k)
+
+        if self._positions is None:
+            self._positions = {int(chunk_id): position for position, chunk_id in enumerate(self.ids)}
+        positions = np.array(
+            [[self._positions.get(int(chunk_id), -1) for chunk_id in row] for row in found_ids], dtype=np.int64
+        )
+        return distances, positions
+
+    def reconstruct(self, position):
+        with self.lock:
+            return self.shard_index.reconstruct(int(self.ids[position]))
+
+class SharedSessionStore:
+    """
+    One session's view of the shared store, shaped like the FAISS vector store the rest of
+    the pipeline expects (index, docstore, index_to_docstore_id).
+    """
+
+    _normalize_L2 = False
+    index_params = None
+
+    def __init__(self, session_id, shard_index, ids, lock, embedding_function, version):
+        self.session_id = session_id
+        self.index = _SessionIndex(shard_index, ids, lock)
+        self.index_to_docstore_id = {position: int(chunk_id) for position, chunk_id in enumerate(ids)}
+        self.docstore = _SessionDocstore()
+        self.embedding_function = embedding_function
+        self.version = version
+        self.lexical_index = None
+
+def get_session_store(session_id, embeddings):
+    """Returns the session's view of the shared store, or None if it has no chunks."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT version FROM sessions WHERE session_id = ? AND deleted_at IS NULL", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state = _get_shard(conn, shard_for(session_id))
+        shard_index = state["index"]
+        with _lock:
+            view = _views.get(session_id)
+            if view is not None and view.version == row["version"] and view.index.shard_index is shard_index:
+                _views.move_to_end(session_id)
+                return view
+
+        ids = np.array(
+            [r["id"] for r in conn.execute(
+                "SELECT id FROM chunks WHERE session_id = ? AND deleted = 0 ORDER BY id", (session_id,)
+            )],
+            dtype=np.int64
+        )
+    if not len(ids) or shard_index is None:
+        return None
+
+    view = SharedSessionStore(session_id, shard_index, ids, state["lock"], embeddings, row["version"])
+    with _lock:
+        _views[session_id] = view
+        while len(_views) > SHARED_VIEW_CACHE_ENTRIES:
+            _views.popitem(last=False)
+    return view
+
+def get_lexical_index(view):
+    """
+    BM25 index over the session's chunks, kept with the view. It is the one persisted at
+    ingest; a view that is ahead of or behind it is synced incrementally.
+    """
+    if view.lexical_index is None:
+        with closing(_connect()) as conn:
+            view.lexical_index = _sync_session_lexical(conn, view.session_id, view.index.ids)
+    return view.lexical_index
+
+def get_shared_stats():
+    """Row counts for the debug panel and the CLI."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS chunks, COALESCE(SUM(deleted), 0) AS tombstoned FROM chunks"
+        ).fetchone()
+        sessions = conn.execute("SELECT COUNT(*) FROM sessions WHERE deleted_at IS NULL").fetchone()[0]
+    with _lock:
+        loaded = [state["index"] for state in _shards.values() if state["index"] is not None]
+    return {
+        "chunks": row["chunks"],
+        "tombstoned": row["tombstoned"],
+        "sessions": sessions,
+        "shards_loaded": len(loaded),
+        "vectors_loaded": sum(index.ntotal for index in loaded),
+        # The rest are memory-mapped snapshot rows
+        "vectors_in_memory": sum(index.delta_ntotal for index in loaded),
+        "views_cached": len(_views)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance for the shared vector store.")
+    parser.add_argument("command", choices=["stats", "compact"])
+    args = parser.parse_args()
+    if args.command == "compact":
+        print(compact())
+    print(get_shared_stats())
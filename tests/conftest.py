@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+import cv2
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_utils
+import embedding_utils
+import index_utils
+import shared_store
+from embedding_utils import EmbeddingCache, get_embeddings
+from fake_openai_server import start_fake_server
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by the text, in place of the sentence-transformers model."""
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def _vector(self, text):
+        rng = np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+        vector = rng.standard_normal(384).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+def make_store(texts, source):
+    """An in-memory FAISS store with the metadata rag_engine gives each chunk."""
+    metadatas = [{"source": source, "hash": EmbeddingCache.hash_text(text)} for text in texts]
+    return FAISS.from_texts(texts, embedding=get_embeddings(), metadatas=metadatas)
+
+def store_texts(vector_store):
+    """Chunk texts in FAISS position order."""
+    return [
+        vector_store.docstore.search(vector_store.index_to_docstore_id[position]).page_content
+        for position in range(vector_store.index.ntotal)
+    ]
+
+class Upload:
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.data = text.encode("utf-8")
+
+    def getvalue(self):
+        return self.data
+
+def paragraphs(prefix, count):
+    return "\n\n".join(f"{prefix} paragraph {i} " + "filler words " * 20 for i in range(count))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in an empty folder with fake embeddings; index and cache paths are relative."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(embedding_utils, "HuggingFaceEmbeddings", FakeEmbeddings)
+    monkeypatch.setattr(embedding_utils, "_models", {})
+    monkeypatch.setattr(embedding_utils, "_cached_models", {})
+    index_utils.clear_index_cache()
+    yield tmp_path
+    index_utils.clear_index_cache()
+
+@pytest.fixture
+def fake_server():
+    """Starts fake_openai_server with the given options and returns (server, base_url)."""
+    servers = []
+
+    def start(**options):
+        server, base_url = start_fake_server(**options)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def write_video(path, seconds, fps=10):
+    """A small mp4 whose frames change brightness every frame."""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (64, 48))
+    for i in range(seconds * fps):
+        frame = np.full((48, 64, 3), i % 256, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+
+def request_count(server):
+    """Requests a fake_openai_server has answered so far, 429s included."""
+    return server.RequestHandlerClass.counters["requests"]
+
+@pytest.fixture
+def history_db(workdir, monkeypatch):
+    """A fresh chat history database (and JSON path for the migration) inside workdir."""
+    monkeypatch.setattr(chat_utils, "HISTORY_DB", str(workdir / "chat_history.db"))
+    monkeypatch.setattr(chat_utils, "HISTORY_FILE", str(workdir / "chat_history.json"))
+    monkeypatch.setattr(chat_utils, "_schema_ready", set())
+    chat_utils.invalidate_history_cache()
+    yield chat_utils
+    chat_utils.invalidate_history_cache()
+
+@pytest.fixture
+def shared(workdir, monkeypatch):
+    """Turns on the shared vector store (VECTOR_STORE_MODE=shared) with fresh in-process state."""
+    monkeypatch.setattr(shared_store, "SHARED_STORE_ENABLED", True)
+    monkeypatch.setattr(shared_store, "SHARED_STORE_ROOT", "shared_index")
+    monkeypatch.setattr(shared_store, "_shards", {})
+    monkeypatch.setattr(shared_store, "_views", OrderedDict())
+    monkeypatch.setattr(shared_store, "_reader", None)
+    return shared_store
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import answer_cache
+from answer_cache import invalidate_answers, lookup_answer, lookup_answer_entry, store_answer
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(answer_cache, "_buckets", {})
+    monkeypatch.setattr(answer_cache, "_lru", answer_cache.OrderedDict())
+
+def vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+def test_exact_and_similar_questions_hit():
+    store_answer("s", "m", "What is BM25?", vector(1, 0, 0), "A ranking function", "v1", sources=["a.txt"])
+    assert lookup_answer_entry("s", "m", "  what is bm25? ", vector(0, 1, 0), "v1") == {
+        "answer": "A ranking function", "sources": ["a.txt"]
+    }
+    assert lookup_answer("s", "m", "Explain BM25", vector(0.99, 0.05, 0), "v1") == "A ranking function"
+    assert lookup_answer("s", "m", "Something else", vector(0, 1, 0), "v1") is None
+    assert lookup_answer("s", "other-model", "What is BM25?", vector(1, 0, 0), "v1") is None
+
+def test_new_index_version_invalidates():
+    store_answer("s", "m", "q", vector(1, 0), "old answer", "v1")
+    assert lookup_answer("s", "m", "q", vector(1, 0), "v2") is None
+    # The stale entry is gone, not just skipped
+    assert lookup_answer("s", "m", "q", vector(1, 0), "v1") is None
+
+def test_invalidate_answers_drops_only_that_session():
+    store_answer("s", "m1", "q", vector(1, 0), "a", "v1")
+    store_answer("s", "m2", "q", vector(1, 0), "a", "v1")
+    store_answer("other", "m1", "q", vector(1, 0), "b", "v1")
+    invalidate_answers("s")
+    assert lookup_answer("s", "m1", "q", vector(1, 0), "v1") is None
+    assert lookup_answer("s", "m2", "q", vector(1, 0), "v1") is None
+    assert lookup_answer("other", "m1", "q", vector(1, 0), "v1") == "b"
+
+def test_expired_and_evicted_entries(monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_MAX_ENTRIES", 2)
+    for i in range(3):
+        store_answer("s", "m", f"q{i}", vector(1, i), f"a{i}", "v1")
+    assert lookup_answer("s", "m", "q0", vector(1, 0), "v1", threshold=1.1) is None
+    assert lookup_answer("s", "m", "q2", vector(1, 2), "v1") == "a2"
+
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_TTL_SECONDS", -1)
+    assert lookup_answer("s", "m", "q2", vector(1, 2), "v1") is None
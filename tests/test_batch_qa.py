@@ -0,0 +1,60 @@
+import pytest
+import batch_qa
+import rag_engine
+from fake_openai_server import DEFAULT_REPLY
+from conftest import request_count
+
+QUESTIONS = [
+    "What is the capital of France?", "Where is the Eiffel Tower?", "Which river runs through Paris?", "How old is Paris?"
+]
+
+@pytest.fixture
+def session(workdir, fake_server, monkeypatch):
+    server, base_url = fake_server()
+    monkeypatch.setattr(rag_engine, "OPENROUTER_BASE_URL", base_url)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    rag_engine.get_vector_store(
+        ["Paris is the capital of France.", "The Eiffel Tower is in Paris.", "The Seine runs through Paris."],
+        "session", source="facts.txt"
+    )
+    return server
+
+def fail_for(monkeypatch, name, failures):
+    """Makes batch_qa's call to name raise failures[question] for the questions in failures."""
+    real = getattr(batch_qa, name)
+
+    def wrapper(*args, **kwargs):
+        for question, error in failures.items():
+            if question in args:
+                raise error
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(batch_qa, name, wrapper)
+
+def test_failing_questions_do_not_stop_the_batch(session, monkeypatch):
+    retrieval_failures = {QUESTIONS[1]: OSError("index unreadable")}
+    llm_failures = {QUESTIONS[2]: RuntimeError("upstream 500")}
+    fail_for(monkeypatch, "retrieve_documents", retrieval_failures)
+    fail_for(monkeypatch, "answer_from_documents", llm_failures)
+
+    results = batch_qa.answer_questions(QUESTIONS, "session", model_name="fake-model", max_concurrency=2)
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["error"] for result in results] == [
+        None, "OSError: index unreadable", "RuntimeError: upstream 500", None
+    ]
+    assert [result["answer"] for result in results] == [DEFAULT_REPLY, None, None, DEFAULT_REPLY]
+    assert results[0]["sources"] == ["facts.txt"]
+    assert results[1]["sources"] == []
+    assert request_count(session) == 2
+
+    # Only the answers that succeeded were cached; the failed questions are asked again
+    retrieval_failures.clear()
+    llm_failures.clear()
+    results = batch_qa.answer_questions(QUESTIONS, "session", model_name="fake-model")
+    assert [result["cached"] for result in results] == [True, False, False, True]
+    assert all(result["answer"] == DEFAULT_REPLY for result in results)
+    assert request_count(session) == 4
+
+def test_missing_index_raises(workdir):
+    with pytest.raises(ValueError, match="has no index"):
+        list(batch_qa.iter_answers(["Anything?"], "missing"))
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+def messages(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(count)]
+
+def stored_messages(chat_utils, session_id):
+    with closing(sqlite3.connect(chat_utils.HISTORY_DB)) as conn:
+        return conn.execute("SELECT seq, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+
+def test_json_history_is_imported_on_first_use(history_db):
+    chat_utils = history_db
+    sessions = [
+        {"id": "s1", "user_id": "u1", "title": "First", "timestamp": "2999-01-01T10:00:00", "messages": messages(2)},
+        {"id": "s2", "user_id": "u2", "title": "Second", "timestamp": "2999-01-01T11:00:00", "messages": []},
+        {"title": "No id or timestamp"}
+    ]
+    with open(chat_utils.HISTORY_FILE, "w") as f:
+        json.dump({"sessions": sessions}, f)
+
+    history = chat_utils.load_chat_history("u1")
+    assert [session["id"] for session in history] == ["s1"]
+    assert history[0]["messages"] == messages(2)
+    # Running the migration again skips sessions already imported
+    assert chat_utils.migrate_json_history(chat_utils.HISTORY_FILE) == 0
+    assert [session["id"] for session in chat_utils.load_chat_history()] == ["s2", "s1"]
+
+def test_saves_append_only_new_messages(history_db, monkeypatch):
+    chat_utils = history_db
+    chat_utils.save_chat_session("s1", messages(2), user_id="u1")
+    rows = stored_messages(chat_utils, "s1")
+
+    executed = []
+    real_connect = chat_utils._connect
+
+    def connect():
+        conn = real_connect()
+        conn.set_trace_callback(executed.append)
+        return conn
+
+    monkeypatch.setattr(chat_utils, "_connect", connect)
+    chat_utils.save_chat_session("s1", messages(4), user_id="u1")
+    assert stored_messages(chat_utils, "s1")[:2] == rows
+    assert [seq for seq, _ in stored_messages(chat_utils, "s1")] == [0, 1, 2, 3]
+    assert not any(statement.startswith("DELETE") for statement in executed)
+    inserted = [statement for statement in executed if statement.startswith("INSERT OR REPLACE INTO messages")]
+    assert len(inserted) == 2
+
+def test_title_and_shortened_history(history_db):
+    chat_utils = history_db
+    chat_utils.save_chat_session("s1", [], user_id="u1")
+    chat_utils.save_chat_session("s1", [{"role": "user", "content": "A question that is longer than the title limit"}] + messages(3))
+    session = chat_utils.load_chat_history("u1")[0]
+    assert session["title"] == "A question that is longer than the..."
+
+    chat_utils.save_chat_session("s1", messages(1))
+    assert chat_utils.load_session_messages("s1") == messages(1)
+
+def test_delete_session(history_db):
+    chat_utils = history_db
+    chat_utils.save_chat_session("s1", messages(2), user_id="u1")
+    chat_utils.delete_chat_session("s1")
+    assert chat_utils.load_chat_history("u1") == []
+    assert stored_messages(chat_utils, "s1") == []
+
+def set_timestamp(chat_utils, session_id, when):
+    with closing(sqlite3.connect(chat_utils.HISTORY_DB)) as conn, conn:
+        conn.execute("UPDATE sessions SET timestamp = ? WHERE id = ?", (when.isoformat(), session_id))
+
+def count_connections(chat_utils, monkeypatch):
+    connections = []
+    real_connect = chat_utils._connect
+
+    def connect():
+        connections.append(1)
+        return real_connect()
+
+    monkeypatch.setattr(chat_utils, "_connect", connect)
+    return connections
+
+def test_session_listing_for_the_sidebar(history_db):
+    chat_utils = history_db
+    now = datetime.now()
+    for session_id, user_id, days_ago in [("new", "u1", 0), ("older", "u1", 1), ("expired", "u1", 8), ("other", "u2", 3)]:
+        chat_utils.save_chat_session(session_id, messages(2), user_id=user_id)
+        set_timestamp(chat_utils, session_id, now - timedelta(days=days_ago))
+    chat_utils.invalidate_history_cache()
+
+    sessions = chat_utils.list_chat_sessions("u1")
+    assert [session["id"] for session in sessions] == ["new", "older"]
+    assert set(sessions[0]) == {"id", "user_id", "title", "timestamp"}
+    assert [session["id"] for session in chat_utils.list_chat_sessions()] == ["new", "older", "other"]
+    grouped = chat_utils.group_chat_history(sessions)
+    assert [[session["id"] for session in grouped[name]] for name in grouped] == [["new"], ["older"], []]
+
+    # Messages are only loaded for the session being opened
+    assert chat_utils.load_session_messages("older") == messages(2)
+    assert chat_utils.load_session_messages("missing") == []
+
+def test_session_listing_is_cached_until_history_changes(history_db, monkeypatch):
+    chat_utils = history_db
+    chat_utils.save_chat_session("s1", messages(2), user_id="u1")
+    assert [session["id"] for session in chat_utils.list_chat_sessions("u1")] == ["s1"]
+
+    connections = count_connections(chat_utils, monkeypatch)
+    # Streamlit reruns the script on every interaction; the listing comes from memory
+    for _ in range(5):
+        chat_utils.list_chat_sessions("u1")
+    assert connections == []
+
+    chat_utils.save_chat_session("s2", messages(2), user_id="u1")
+    assert [session["id"] for session in chat_utils.list_chat_sessions("u1")] == ["s2", "s1"]
+    chat_utils.delete_chat_session("s1")
+    assert [session["id"] for session in chat_utils.list_chat_sessions("u1")] == ["s2"]
+
+    # The TTL keeps the retention window moving in long-lived processes
+    connections.clear()
+    monkeypatch.setattr(chat_utils, "HISTORY_CACHE_TTL_SECONDS", 0)
+    chat_utils.list_chat_sessions("u1")
+    assert len(connections) == 1
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+import chat_utils
+from embedding_utils import EmbeddingCache
+from index_utils import get_index_path
+from conftest import FakeEmbeddings
+
+def set_timestamp(session_id, days_ago):
+    with closing(sqlite3.connect(chat_utils.HISTORY_DB)) as conn, conn:
+        timestamp = (datetime.now() - timedelta(days=days_ago)).isoformat()
+        conn.execute("UPDATE sessions SET timestamp = ? WHERE id = ?", (timestamp, session_id))
+
+def make_index_folder(session_id, hours_ago=0):
+    path = get_index_path(session_id)
+    os.makedirs(path)
+    with open(os.path.join(path, "index.faiss"), "wb") as f:
+        f.write(b"x" * 100)
+    mtime = time.time() - hours_ago * 3600
+    os.utime(path, (mtime, mtime))
+    return path
+
+def chunks(session_id, count):
+    texts = [f"{session_id} chunk {i}" for i in range(count)]
+    return [(text, {"source": "a.txt", "hash": EmbeddingCache.hash_text(text)}) for text in texts]
+
+def test_expired_sessions_and_orphaned_indexes(history_db):
+    chat_utils.save_chat_session("old", [{"role": "user", "content": "hello"}])
+    chat_utils.save_chat_session("live", [{"role": "user", "content": "hello"}])
+    set_timestamp("old", chat_utils.RETENTION_DAYS + 1)
+    old_path = make_index_folder("old")
+    live_path = make_index_folder("live", hours_ago=48)
+    orphan_path = make_index_folder("orphan", hours_ago=48)
+    fresh_path = make_index_folder("fresh")
+
+    report = chat_utils.compact_history(dry_run=True)
+    assert (report["expired_sessions"], report["orphaned_indexes"]) == (1, 2)
+    assert os.path.isdir(old_path)
+
+    report = chat_utils.compact_history()
+    assert (report["expired_sessions"], report["deleted_messages"], report["orphaned_indexes"]) == (1, 1, 2)
+    assert report["index_bytes"] == 200
+    assert not os.path.exists(old_path) and not os.path.exists(orphan_path)
+    assert os.path.isdir(live_path) and os.path.isdir(fresh_path)
+    assert [session["id"] for session in chat_utils.load_chat_history()] == ["live"]
+
+def test_shared_sessions_without_a_chat_row_are_removed(history_db, shared):
+    for session_id in ["live", "old", "orphan", "fresh"]:
+        shared.add_chunks(session_id, chunks(session_id, 3), FakeEmbeddings())
+    chat_utils.save_chat_session("live", [{"role": "user", "content": "hello"}])
+    chat_utils.save_chat_session("old", [{"role": "user", "content": "hello"}])
+    set_timestamp("old", chat_utils.RETENTION_DAYS + 1)
+    with closing(shared._connect()) as conn, conn:
+        conn.execute("UPDATE sessions SET version = ? WHERE session_id = 'orphan'", (time.time() - 48 * 3600,))
+
+    report = chat_utils.compact_history(dry_run=True)
+    assert report["shared_sessions"] == 2
+    assert set(shared.list_sessions()) == {"live", "old", "orphan", "fresh"}
+
+    report = chat_utils.compact_history()
+    assert report["shared_sessions"] == 2
+    assert report["shared_store"]["chunks_removed"] == 6
+    assert set(shared.list_sessions()) == {"live", "fresh"}
+    assert shared.get_shared_stats()["chunks"] == 6
+
+def test_compaction_thread_survives_errors(monkeypatch):
+    calls = []
+    second_run = threading.Event()
+
+    def compact_history():
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise ValueError("unexpected")
+        second_run.set()
+        threading.Event().wait()
+
+    monkeypatch.setattr(chat_utils, "compact_history", compact_history)
+    monkeypatch.setattr(chat_utils, "_compaction_thread", None)
+    thread = chat_utils.start_compaction_thread(interval_hours=0.01 / 3600)
+    assert second_run.wait(5)
+    assert thread.is_alive()
+    assert chat_utils.start_compaction_thread() is thread
@@ -0,0 +1,64 @@
+import numpy as np
+from langchain_core.documents import Document
+import rag_engine
+import tracing
+from context_builder import MIN_TRIM_TOKENS, build_context, count_tokens, mmr_order
+from embedding_utils import get_embeddings
+from index_utils import load_vector_store
+
+def make_docs(count, words=200):
+    return [
+        Document(page_content=" ".join(f"word{i}x{j}" for j in range(words)), metadata={"source": f"doc{i}"})
+        for i in range(count)
+    ]
+
+def test_packing_stays_within_budget():
+    docs = make_docs(5)
+    budget = count_tokens(docs[0].page_content) * 2 + MIN_TRIM_TOKENS
+    packed, stats = build_context(docs, None, None, budget)
+
+    assert [doc.metadata["source"] for doc in packed] == ["doc0", "doc1", "doc2"]
+    assert packed[-1].metadata["trimmed"] is True
+    assert "trimmed" not in packed[0].metadata
+    assert stats["tokens_used"] <= budget
+    total = sum(count_tokens(doc.page_content) for doc in docs)
+    assert stats == {
+        "candidates": 5, "packed": 3, "budget": budget, "tokens_used": stats["tokens_used"],
+        "tokens_saved": total - stats["tokens_used"]
+    }
+
+def test_leftover_below_minimum_is_not_trimmed():
+    docs = make_docs(3)
+    budget = count_tokens(docs[0].page_content) + MIN_TRIM_TOKENS - 1
+    packed, stats = build_context(docs, None, None, budget)
+    assert [doc.metadata["source"] for doc in packed] == ["doc0"]
+    assert stats["packed"] == 1
+
+def test_mmr_skips_near_duplicates():
+    query = np.array([1.0, 0.0, 0.0])
+    vectors = np.array([
+        [0.9, 0.1, 0.0],
+        [0.9, 0.1, 0.0],
+        [0.7, 0.0, 0.7],
+    ])
+    assert mmr_order(query, vectors, lambda_mult=0.5) == [0, 2, 1]
+
+    docs = make_docs(3, words=10)
+    packed, stats = build_context(docs, query, vectors, 10000, lambda_mult=0.5)
+    assert [doc.metadata["source"] for doc in packed] == ["doc0", "doc2", "doc1"]
+    assert stats["tokens_saved"] == 0
+
+def test_retrieval_records_tokens_saved(workdir):
+    texts = [doc.page_content for doc in make_docs(8)]
+    rag_engine.get_vector_store(texts, "session", source="docs.txt")
+    store = load_vector_store("session", get_embeddings())
+    saved_before = tracing.get_counters().get("context_tokens_saved", 0)
+    question_vector = get_embeddings().embed_query(texts[0])
+    packed = rag_engine.retrieve_documents(store, "session", texts[0], question_vector, "fake-model")
+
+    pack_span = next(record for record in tracing.get_recent_traces(1)[0] if record["name"] == "context.pack")
+    stats = pack_span["attrs"]
+    assert stats["candidates"] == len(texts)
+    assert stats["tokens_saved"] == sum(count_tokens(text) for text in texts) - stats["tokens_used"] > 0
+    assert tracing.get_counters()["context_tokens_saved"] - saved_before == stats["tokens_saved"]
+    assert len(packed) == stats["packed"]
@@ -0,0 +1,64 @@
+import time
+import numpy as np
+import embedding_utils
+from embedding_utils import CachedEmbeddings, EmbeddingCache, get_cached_embeddings, get_embedding_cache_stats
+from conftest import FakeEmbeddings
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+def test_only_missing_chunks_are_embedded(tmp_path):
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache("model", cache_dir=str(tmp_path)))
+    first = embeddings.embed_documents(["a", "b", "a"])
+    assert model.embedded == ["a", "b"]
+
+    second = embeddings.embed_documents(["b", "c", "a"])
+    assert model.embedded == ["a", "b", "c"]
+    np.testing.assert_allclose(second[0], first[1], rtol=1e-6)
+    np.testing.assert_allclose(second[2], first[0], rtol=1e-6)
+
+    stats = embeddings.cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 4, 3)
+
+def test_cache_is_shared_through_the_folder(tmp_path):
+    CachedEmbeddings(FakeEmbeddings(), EmbeddingCache("model", cache_dir=str(tmp_path))).embed_documents(["a"])
+    model = CountingEmbeddings()
+    CachedEmbeddings(model, EmbeddingCache("model", cache_dir=str(tmp_path))).embed_documents(["a"])
+    assert model.embedded == []
+
+def test_eviction_keeps_recently_used_vectors(tmp_path):
+    row_bytes = 384 * 4
+    cache = EmbeddingCache("model", cache_dir=str(tmp_path), max_bytes=row_bytes * 4)
+    vectors = {text: FakeEmbeddings().embed_query(text) for text in "abcde"}
+    for text in "abcd":
+        cache.put_many([text], [vectors[text]])
+        time.sleep(0.01)
+    cache.get_many(["a"])
+    time.sleep(0.01)
+    cache.put_many(["e"], [vectors["e"]])
+
+    stats = cache.get_stats()
+    # Over the limit: the most recent rows filling 80% of it are kept, the file is rewritten
+    assert stats["entries"] == 3
+    assert stats["bytes"] == 3 * row_bytes
+    assert stats["evictions"] == 2
+    found = cache.get_many(list("abcde"))
+    assert sorted(found) == ["a", "d", "e"]
+    np.testing.assert_allclose(found["a"], vectors["a"], rtol=1e-6)
+    np.testing.assert_allclose(found["e"], vectors["e"], rtol=1e-6)
+
+def test_stats_without_a_cached_model_read_the_disk_cache(workdir, monkeypatch):
+    get_cached_embeddings().embed_documents(["a", "b"])
+    assert get_embedding_cache_stats()["misses"] == 2
+
+    # As in the app process, where the ingest workers did the embedding
+    monkeypatch.setattr(embedding_utils, "_cached_models", {})
+    stats = get_embedding_cache_stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 0, 0)
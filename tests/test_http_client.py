@@ -0,0 +1,27 @@
+import pytest
+import http_client
+from fake_openai_server import DEFAULT_REPLY
+from http_client import post_chat_completion
+from tracing import get_counters
+from conftest import request_count
+
+def chat_data(model="fake-model"):
+    return {"model": model, "messages": [{"role": "user", "content": "hi"}]}
+
+def test_429_is_retried_after_retry_after(fake_server, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_BASE_SECONDS", 0.01)
+    server, base_url = fake_server(rate_limit_every=2, retry_after=0.2)
+    retries = get_counters().get("http_retries", 0)
+
+    assert post_chat_completion(base_url, "key", chat_data()) == DEFAULT_REPLY
+    # The second request is the rate-limited one; the retry waits for Retry-After and succeeds
+    assert post_chat_completion(base_url, "key", chat_data()) == DEFAULT_REPLY
+    assert request_count(server) == 3
+    assert get_counters()["http_retries"] == retries + 1
+
+def test_429_raises_once_retries_run_out(fake_server, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_BASE_SECONDS", 0.01)
+    server, base_url = fake_server(rate_limit_every=1, retry_after=0.01)
+    with pytest.raises(RuntimeError, match="429"):
+        post_chat_completion(base_url, "key", chat_data(), max_retries=2)
+    assert request_count(server) == 3
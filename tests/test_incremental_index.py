@@ -0,0 +1,72 @@
+import os
+from langchain_core.documents import Document
+import native_index
+from embedding_utils import get_embeddings
+from index_utils import (
+    clear_index_cache, get_index_path, get_index_version, get_indexed_sources, get_lexical_index,
+    load_vector_store, remove_source, save_vector_store
+)
+from lexical_index import LexicalIndex
+from native_index import get_current_version, iter_documents, iter_metadata, load_native, make_writable, save_native
+from conftest import make_store, store_texts
+
+def test_versions_are_swapped_on_save(workdir):
+    session_id = "session"
+    save_vector_store(session_id, make_store(["first chunk", "second chunk"], "a.txt"))
+    index_path = get_index_path(session_id)
+    first = get_current_version(index_path)
+    assert get_index_version(session_id) == first
+
+    store = load_vector_store(session_id, get_embeddings())
+    make_writable(store)
+    store.add_texts(["third chunk"], metadatas=[{"source": "b.txt"}])
+    save_vector_store(session_id, store)
+    second = get_current_version(index_path)
+
+    assert second != first
+    assert not os.path.exists(os.path.join(index_path, first))
+    assert get_index_version(session_id) == second
+
+def test_append_and_remove_keep_bm25_in_step(workdir):
+    session_id = "session"
+    save_vector_store(session_id, make_store([f"alpha chunk {i}" for i in range(5)], "a.txt"))
+    store = load_vector_store(session_id, get_embeddings())
+    make_writable(store)
+    store.add_texts([f"beta chunk {i} token-{i}" for i in range(5)], metadatas=[{"source": "b.txt"}] * 5)
+    store = save_vector_store(session_id, store)
+    assert get_indexed_sources(store) == ["a.txt", "b.txt"]
+
+    assert remove_source(store, "a.txt") == 5
+    store = save_vector_store(session_id, store)
+    assert get_indexed_sources(store) == ["b.txt"]
+
+    # Reloaded from disk the incrementally updated BM25 index scores like a fresh build
+    clear_index_cache()
+    store = load_vector_store(session_id, get_embeddings())
+    texts = store_texts(store)
+    assert texts == [f"beta chunk {i} token-{i}" for i in range(5)]
+    lexical_index = get_lexical_index(session_id, store)
+    expected = LexicalIndex.build(texts)
+    for query in ["token-3", "beta", "alpha"]:
+        assert lexical_index.search(query) == expected.search(query)
+
+def test_reader_on_previous_version_keeps_its_chunks_until_next_publish(workdir):
+    first_store = make_store(["old one", "old two"], "a.txt")
+    save_native("native", first_store)
+    reader = load_native("native", get_embeddings())
+
+    save_native("native", make_store(["new one"], "b.txt"))
+    # The swap happened, but the reader's rows survive one more publish
+    assert store_texts(reader) == ["old one", "old two"]
+    doc_id = reader.index_to_docstore_id[0]
+
+    save_native("native", make_store(["newer one"], "c.txt"))
+    assert not isinstance(reader.docstore.search(doc_id), Document)
+
+def test_stored_chunks_are_read_in_batches(workdir, monkeypatch):
+    monkeypatch.setattr(native_index, "STORED_BATCH", 3)
+    texts = [f"chunk {i}" for i in range(10)]
+    save_native("native", make_store(texts, "a.txt"))
+    store = load_native("native", get_embeddings())
+    assert [doc.page_content for _, doc in iter_documents(store.docstore)] == texts
+    assert len(list(iter_metadata(store.docstore))) == 10
@@ -0,0 +1,101 @@
+import io
+import os
+import sqlite3
+import pytest
+import ingest_utils
+import rag_engine
+from embedding_utils import get_embeddings
+from index_utils import get_index_path, get_indexed_sources, get_lexical_index, load_vector_store
+from lexical_index import LexicalIndex
+from native_index import CHUNKS_DB_FILE, NATIVE_INDEX_FILE, VERSION_PREFIX, get_current_version
+from conftest import Upload, paragraphs, store_texts
+
+def test_batches_are_written_to_disk_as_they_are_embedded(workdir):
+    index_path = get_index_path("session")
+    seen = []
+
+    def progress(stage, value):
+        if stage != "embedded":
+            return
+        # Nothing is live yet, but the unpublished version already holds the embedded chunks
+        with sqlite3.connect(os.path.join(index_path, CHUNKS_DB_FILE)) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        versions = [entry for entry in os.scandir(index_path) if entry.name.startswith(VERSION_PREFIX)]
+        index_bytes = os.path.getsize(os.path.join(versions[0].path, NATIVE_INDEX_FILE))
+        seen.append((value, rows, index_bytes, get_current_version(index_path)))
+
+    added = rag_engine.add_documents_to_vector_store(
+        [Upload("a.txt", paragraphs("alpha", 150))], "session", batch_size=4, max_workers=1,
+        progress_callback=progress
+    )
+    assert added == seen[-1][0] > 8
+    for value, rows, index_bytes, current in seen:
+        assert rows == value
+        assert index_bytes >= value * 384 * 4
+        assert current is None
+
+    store = load_vector_store("session", get_embeddings())
+    assert store.index.ntotal == added
+    assert all(text.startswith("alpha paragraph") for text in store_texts(store))
+
+def test_append_replace_and_bm25(workdir):
+    rag_engine.add_documents_to_vector_store([Upload("a.txt", paragraphs("alpha", 10))], "session", max_workers=1)
+    rag_engine.add_documents_to_vector_store([Upload("b.txt", paragraphs("beta", 10))], "session", max_workers=1)
+    rag_engine.add_documents_to_vector_store([Upload("a.txt", paragraphs("gamma", 5))], "session", max_workers=1)
+
+    store = load_vector_store("session", get_embeddings())
+    texts = store_texts(store)
+    assert get_indexed_sources(store) == ["a.txt", "b.txt"]
+    assert not any(text.startswith("alpha") for text in texts)
+    expected = LexicalIndex.build(texts)
+    lexical_index = get_lexical_index("session", store)
+    for query in ["alpha", "beta paragraph 3", "gamma"]:
+        assert lexical_index.search(query) == expected.search(query)
+
+def test_append_to_hnsw_session(workdir):
+    upload = Upload("a.txt", paragraphs("alpha", 10))
+    rag_engine.add_documents_to_vector_store([upload], "session", max_workers=1, index_strategy="hnsw")
+    rag_engine.add_documents_to_vector_store([Upload("b.txt", paragraphs("beta", 10))], "session", max_workers=1)
+
+    store = load_vector_store("session", get_embeddings())
+    assert store.index_params["type"] == "hnsw"
+    texts = store_texts(store)
+    query = get_embeddings().embed_query(texts[-1])
+    assert store.similarity_search_by_vector(query, k=1)[0].page_content == texts[-1]
+
+def test_failed_ingest_leaves_the_index_unchanged(workdir):
+    rag_engine.add_documents_to_vector_store([Upload("a.txt", paragraphs("alpha", 5))], "session", max_workers=1)
+    version = get_current_version(get_index_path("session"))
+
+    def cancel(stage, value):
+        if stage == "embedded":
+            raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        rag_engine.add_documents_to_vector_store(
+            [Upload("b.txt", paragraphs("beta", 5))], "session", max_workers=1, progress_callback=cancel
+        )
+    index_path = get_index_path("session")
+    assert get_current_version(index_path) == version
+    assert [entry.name for entry in os.scandir(index_path) if entry.name.startswith(VERSION_PREFIX)] == [version]
+    assert get_indexed_sources(load_vector_store("session", get_embeddings())) == ["a.txt"]
+
+class FailingFile(io.BytesIO):
+    """Returns one window, then fails like a disk read error."""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise OSError("read error")
+        return super().read(size)
+
+def test_txt_read_error_propagates_from_the_parallel_path(monkeypatch):
+    monkeypatch.setattr(ingest_utils, "PARALLEL_MIN_PAGES", 0)
+    monkeypatch.setattr(ingest_utils, "_open_upload", lambda doc: FailingFile(doc.getvalue()))
+    docs = [Upload("a.txt", "x" * 100), Upload("b.txt", "y" * 100)]
+
+    seen = []
+    with pytest.raises(OSError):
+        for record in ingest_utils.iter_document_records(docs, max_workers=2):
+            seen.append(record)
+    # The first window of a.txt, then the error instead of a serial retry that skips the rest
+    assert seen == [{"source": "a.txt", "page": 1, "text": "x" * 100}]
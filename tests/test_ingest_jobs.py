@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import pytest
+import ingest_jobs
+from embedding_utils import get_embeddings
+from index_utils import get_indexed_sources, load_vector_store
+from conftest import Upload, paragraphs, store_texts
+
+@pytest.fixture
+def jobs(workdir, monkeypatch):
+    """A fresh job queue whose pool runs jobs on threads, so they see the test's fake embeddings."""
+    monkeypatch.setattr(ingest_jobs, "INGEST_JOBS_DB", str(workdir / "ingest_jobs.db"))
+    monkeypatch.setattr(ingest_jobs, "INGEST_JOBS_DIR", str(workdir / "ingest_jobs"))
+    monkeypatch.setattr(ingest_jobs, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(ingest_jobs, "PROGRESS_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(ingest_jobs, "_executor", None)
+    monkeypatch.setattr(ingest_jobs, "_session_queues", {})
+    monkeypatch.setattr(ingest_jobs, "_futures", {})
+    monkeypatch.setattr(ingest_jobs, "_schema_ready", set())
+    yield ingest_jobs
+    ingest_jobs.shutdown_jobs(wait=True)
+
+def wait_for(job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = ingest_jobs.get_job(job_id)
+        if job["status"] not in ingest_jobs.ACTIVE_STATUSES:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+def cancel_when(monkeypatch, stage):
+    """Makes running jobs see a cancel request at their first progress update of stage."""
+
+    class CancellingProgress(ingest_jobs._JobProgress):
+        def __call__(self, progress_stage, value):
+            if progress_stage == stage:
+                ingest_jobs._update_job(self.job_id, cancel_requested=1)
+            super().__call__(progress_stage, value)
+
+    monkeypatch.setattr(ingest_jobs, "_JobProgress", CancellingProgress)
+
+def test_job_runs_to_done_and_duplicates_are_deduped(jobs):
+    uploads = [Upload("a.txt", paragraphs("alpha", 10))]
+    job_id = jobs.submit_ingest_job("session", uploads, user_id="device")
+    job = wait_for(job_id)
+    assert (job["status"], job["stage"], job["error"]) == ("done", None, None)
+    assert job["chunks_added"] == job["chunks_embedded"] > 0
+    assert job["pages_extracted"] > 0
+    assert not os.path.exists(os.path.join(jobs.INGEST_JOBS_DIR, job_id))
+    assert get_indexed_sources(load_vector_store("session", get_embeddings())) == ["a.txt"]
+
+    # The same files again are the same job; other files or another session are new jobs
+    assert jobs.submit_ingest_job("session", [Upload("a.txt", paragraphs("alpha", 10))]) == job_id
+    assert jobs.submit_ingest_job("other", uploads) != job_id
+    second = jobs.submit_ingest_job("session", [Upload("b.txt", paragraphs("beta", 10))])
+    assert second != job_id
+    assert wait_for(second)["status"] == "done"
+    assert [job["id"] for job in jobs.get_session_jobs("session")] == [second, job_id]
+    assert jobs.get_session_jobs("session", active_only=True) == []
+
+def test_failed_job_can_be_submitted_again(jobs):
+    upload = Upload("a.pdf", "not a pdf")
+    job = wait_for(jobs.submit_ingest_job("session", [upload]))
+    assert job["status"] == "failed" and job["error"]
+    assert jobs.submit_ingest_job("session", [upload]) != job["id"]
+
+def test_cancel_while_running_leaves_the_session_unchanged(jobs, monkeypatch):
+    wait_for(jobs.submit_ingest_job("session", [Upload("a.txt", paragraphs("alpha", 10))]))
+    texts = store_texts(load_vector_store("session", get_embeddings()))
+
+    cancel_when(monkeypatch, "embedded")
+    job = wait_for(jobs.submit_ingest_job("session", [Upload("a.txt", paragraphs("gamma", 10))]))
+    assert job["status"] == "cancelled"
+    assert jobs.cancel_job(job["id"]) is False
+    assert store_texts(load_vector_store("session", get_embeddings())) == texts
+
+@pytest.mark.parametrize("stage", ["embedded", "saving"])
+def test_cancel_in_shared_mode_tombstones_the_added_chunks(jobs, shared, monkeypatch, stage):
+    wait_for(jobs.submit_ingest_job("session", [Upload("a.txt", paragraphs("alpha", 10))]))
+    hashes = shared.get_session_hashes("session")
+
+    cancel_when(monkeypatch, stage)
+    uploads = [Upload("a.txt", paragraphs("gamma", 10)), Upload("b.txt", paragraphs("beta", 10))]
+    job = wait_for(jobs.submit_ingest_job("session", uploads))
+    assert job["status"] == "cancelled"
+    assert job["chunks_embedded"] > 0
+    # The replaced source keeps its chunks and nothing from the cancelled upload is live
+    assert shared.get_session_hashes("session") == hashes
+    assert shared.get_session_sources("session") == ["a.txt"]
+
+def test_cancel_a_job_queued_behind_another(jobs, monkeypatch):
+    release = threading.Event()
+
+    class BlockingProgress(jobs._JobProgress):
+        def __call__(self, stage, value):
+            release.wait(10)
+            super().__call__(stage, value)
+
+    monkeypatch.setattr(jobs, "_JobProgress", BlockingProgress)
+    first = jobs.submit_ingest_job("session", [Upload("a.txt", paragraphs("alpha", 5))])
+    second = jobs.submit_ingest_job("session", [Upload("b.txt", paragraphs("beta", 5))])
+    # Jobs of one session run one after another
+    assert jobs.get_job(second)["status"] == "queued"
+
+    assert jobs.cancel_job(second) is True
+    assert jobs.get_job(second)["status"] == "cancelled"
+    release.set()
+    assert wait_for(first)["status"] == "done"
+    assert get_indexed_sources(load_vector_store("session", get_embeddings())) == ["a.txt"]
+    assert not os.path.exists(os.path.join(jobs.INGEST_JOBS_DIR, second))
+
+def test_unfinished_jobs_are_requeued_on_start(jobs):
+    # A job the previous run left marked running, with its upload still spooled
+    job_dir = os.path.join(jobs.INGEST_JOBS_DIR, "stale")
+    os.makedirs(job_dir)
+    path = os.path.join(job_dir, "0.upload")
+    with open(path, "w") as f:
+        f.write(paragraphs("alpha", 5))
+    with closing(jobs._connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO jobs (id, session_id, upload_hash, files, status, stage, created, updated) "
+            "VALUES ('stale', 'session', 'hash', ?, 'running', 'embedding', ?, ?)",
+            (json.dumps([{"name": "a.txt", "path": path}]), time.time(), time.time())
+        )
+
+    job = wait_for("stale")
+    assert (job["status"], job["chunks_added"] > 0) == ("done", True)
+    assert get_indexed_sources(load_vector_store("session", get_embeddings())) == ["a.txt"]
@@ -0,0 +1,44 @@
+import numpy as np
+from lexical_index import LexicalIndex, tokenize
+
+TEXTS = [
+    "The gclid_param is stored with every click",
+    "Error E1234 means the utm-source header is missing",
+    "Campaigns are grouped by utm source and medium",
+    "Nothing relevant in this chunk at all",
+]
+
+def assert_same_scores(index, expected, queries):
+    for query in queries:
+        assert index.search(query, k=10) == expected.search(query, k=10)
+
+def test_tokenize_keeps_identifiers_whole_and_split():
+    assert tokenize("utm-source gclid_param E1234") == [
+        "utm-source", "utm", "source", "gclid_param", "gclid", "param", "e1234"
+    ]
+
+def test_search_ranks_exact_identifier_first():
+    index = LexicalIndex.build(TEXTS)
+    results = index.search("E1234 code")
+    assert [position for position, _ in results] == [1]
+    assert index.search("utm-source")[0][0] == 1
+    assert index.search("unknownword") == []
+
+def test_add_documents_matches_full_build():
+    queries = ["utm source", "gclid", "chunk relevant", "error header"]
+    merged = LexicalIndex.build(TEXTS[:2]).add_documents(TEXTS[2:])
+    expected = LexicalIndex.build(TEXTS)
+    assert_same_scores(merged, expected, queries)
+    np.testing.assert_array_equal(merged.doc_lengths, expected.doc_lengths)
+
+def test_remove_documents_shifts_later_positions():
+    queries = ["utm source", "gclid", "chunk relevant", "error header"]
+    removed = LexicalIndex.build(TEXTS).remove_documents([0, 2])
+    assert_same_scores(removed, LexicalIndex.build([TEXTS[1], TEXTS[3]]), queries)
+
+def test_save_and_load(tmp_path):
+    index = LexicalIndex.build(TEXTS)
+    index.save(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert_same_scores(loaded, index, ["utm-source", "gclid_param", "medium"])
+    assert LexicalIndex.load(str(tmp_path / "missing")) is None
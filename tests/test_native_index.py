@@ -0,0 +1,28 @@
+import numpy as np
+from embedding_utils import get_embeddings
+from native_index import load_native, make_writable, save_native
+from conftest import make_store, store_texts
+
+def test_save_load_round_trip(workdir):
+    texts = [f"chunk {i} about topic {i % 3}" for i in range(10)]
+    store = make_store(texts, "a.txt")
+    save_native("native", store)
+    loaded = load_native("native", get_embeddings())
+
+    assert store_texts(loaded) == texts
+    assert loaded.docstore.search(loaded.index_to_docstore_id[3]).metadata["source"] == "a.txt"
+    query = np.asarray([get_embeddings().embed_query(texts[4])], dtype=np.float32)
+    assert loaded.index.search(query, 1)[1][0][0] == 4
+    np.testing.assert_allclose(loaded.index.reconstruct(7), store.index.reconstruct(7), rtol=1e-6)
+
+def test_int8_round_trip_and_resave_unquantized(workdir):
+    texts = [f"quantized chunk {i}" for i in range(20)]
+    store = make_store(texts, "q.txt")
+    save_native("native", store, quantization="int8")
+    loaded = load_native("native", get_embeddings())
+    query = np.asarray([get_embeddings().embed_query(texts[11])], dtype=np.float32)
+    assert loaded.index.search(query, 1)[1][0][0] == 11
+
+    make_writable(loaded)
+    save_native("native", loaded, quantization="none")
+    assert store_texts(load_native("native", get_embeddings())) == texts
@@ -0,0 +1,101 @@
+import os
+from contextlib import closing
+import numpy as np
+import pytest
+from embedding_utils import EmbeddingCache
+from conftest import FakeEmbeddings
+
+def chunks(prefix, count, source="a.txt"):
+    texts = [f"{prefix} chunk {i}" for i in range(count)]
+    return [(text, {"source": source, "hash": EmbeddingCache.hash_text(text)}) for text in texts]
+
+def view_texts(view):
+    return [view.docstore.search(view.index_to_docstore_id[position]).page_content for position in range(view.index.ntotal)]
+
+def nearest_text(view, text, k=3):
+    query = np.asarray([FakeEmbeddings().embed_query(text)], dtype=np.float32)
+    _, positions = view.index.search(query, k)
+    return [view_texts(view)[position] for position in positions[0] if position >= 0]
+
+@pytest.fixture
+def one_shard(shared, monkeypatch):
+    # Every session shares the shard, so each view must filter out the others
+    monkeypatch.setattr(shared, "SHARED_SHARDS", 1)
+    return shared
+
+@pytest.mark.parametrize("small_session_chunks", [20000, 0])
+def test_search_is_limited_to_the_session(one_shard, monkeypatch, small_session_chunks):
+    shared = one_shard
+    monkeypatch.setattr(shared, "SMALL_SESSION_CHUNKS", small_session_chunks)
+    assert shared.add_chunks("s1", chunks("first", 5), FakeEmbeddings()) == 5
+    assert shared.add_chunks("s2", chunks("second", 3), FakeEmbeddings()) == 3
+    # Chunks already in the session are skipped
+    assert shared.add_chunks("s1", chunks("first", 6), FakeEmbeddings()) == 1
+
+    view = shared.get_session_store("s1", FakeEmbeddings())
+    assert view.index.ntotal == 6
+    assert view_texts(view) == [f"first chunk {i}" for i in range(6)]
+    assert nearest_text(view, "first chunk 2")[0] == "first chunk 2"
+    # Another session's chunk is never returned, even when it is the closest
+    assert all(text.startswith("first") for text in nearest_text(view, "second chunk 1", k=10))
+    assert len(nearest_text(shared.get_session_store("s2", FakeEmbeddings()), "first chunk 1", k=10)) == 3
+
+def test_remove_source_and_delete_session_tombstone(shared):
+    shared.add_chunks("s1", chunks("alpha", 4, "a.txt") + chunks("beta", 2, "b.txt"), FakeEmbeddings())
+    version = shared.get_session_version("s1")
+
+    assert shared.remove_source("s1", "a.txt") == 4
+    assert shared.get_session_version("s1") > version
+    assert shared.get_session_sources("s1") == ["b.txt"]
+    assert view_texts(shared.get_session_store("s1", FakeEmbeddings())) == ["beta chunk 0", "beta chunk 1"]
+    assert shared.get_shared_stats()["tombstoned"] == 4
+
+    shared.delete_session("s1")
+    assert shared.get_session_store("s1", FakeEmbeddings()) is None
+    assert shared.get_session_version("s1") is None
+    stats = shared.get_shared_stats()
+    assert (stats["chunks"], stats["tombstoned"], stats["sessions"]) == (6, 6, 0)
+
+def test_compaction_shrinks_shards_and_maps_the_snapshot(one_shard, monkeypatch):
+    shared = one_shard
+    shared.add_chunks("keep", chunks("keep", 10), FakeEmbeddings())
+    shared.add_chunks("drop", chunks("drop", 30), FakeEmbeddings())
+    shared.compact()
+    snapshot_path, _ = shared._snapshot_paths(0)
+    size = os.path.getsize(snapshot_path)
+
+    shared.delete_session("drop")
+    report = shared.compact()
+    assert report == {"shards_compacted": 1, "chunks_removed": 30, "sessions_removed": 1}
+    assert os.path.getsize(snapshot_path) < size
+    assert shared.get_shared_stats()["chunks"] == 10
+
+    # A fresh process maps the snapshot and holds only rows added after it in memory
+    shared._shards.clear()
+    shared._views.clear()
+    shared.add_chunks("keep", chunks("late", 2), FakeEmbeddings())
+    view = shared.get_session_store("keep", FakeEmbeddings())
+    stats = shared.get_shared_stats()
+    assert (stats["vectors_loaded"], stats["vectors_in_memory"]) == (12, 2)
+    assert nearest_text(view, "keep chunk 4")[0] == "keep chunk 4"
+    assert nearest_text(view, "late chunk 1")[0] == "late chunk 1"
+    np.testing.assert_allclose(view.index.reconstruct(11), FakeEmbeddings().embed_query("late chunk 1"), rtol=1e-6)
+    # Filtered search merges the snapshot's and the in-memory rows' neighbours
+    monkeypatch.setattr(shared, "SMALL_SESSION_CHUNKS", 0)
+    assert nearest_text(view, "late chunk 0")[0] == "late chunk 0"
+    assert nearest_text(view, "keep chunk 9")[0] == "keep chunk 9"
+    assert len(nearest_text(view, "keep chunk 9", k=20)) == 12
+
+def test_user_id_is_recorded_with_chunks_and_session(shared):
+    shared.add_chunks("s1", chunks("alpha", 2), FakeEmbeddings(), user_id="device-1")
+    # Later adds without a user keep the session's owner
+    shared.add_chunks("s1", chunks("beta", 2), FakeEmbeddings())
+    shared.add_chunks("s2", chunks("gamma", 2), FakeEmbeddings(), user_id="device-2")
+
+    with closing(shared._connect()) as conn:
+        owners = dict(conn.execute("SELECT session_id, user_id FROM sessions").fetchall())
+        chunk_users = conn.execute(
+            "SELECT user_id, COUNT(*) FROM chunks GROUP BY user_id ORDER BY user_id"
+        ).fetchall()
+    assert owners == {"s1": "device-1", "s2": "device-2"}
+    assert [tuple(row) for row in chunk_users] == [(None, 2), ("device-1", 2), ("device-2", 2)]
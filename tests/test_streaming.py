@@ -0,0 +1,55 @@
+import time
+import pytest
+import http_client
+import rag_engine
+import tracing
+from fake_openai_server import DEFAULT_REPLY
+
+def test_stream_answer_from_session_index(workdir, fake_server, monkeypatch):
+    _, base_url = fake_server(token_delay=0.001)
+    monkeypatch.setattr(rag_engine, "OPENROUTER_BASE_URL", base_url)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    rag_engine.get_vector_store(["Paris is the capital of France."], "session", source="facts.txt")
+
+    pieces = list(rag_engine.user_input_stream("What is the capital of France?", "fake-model", "session"))
+    assert len(pieces) == len(DEFAULT_REPLY.split(" "))
+    assert "".join(pieces) == DEFAULT_REPLY
+
+    # The same question again comes from the answer cache in one piece
+    assert list(rag_engine.user_input_stream("What is the capital of France?", "fake-model", "session")) == [DEFAULT_REPLY]
+
+@pytest.fixture
+def single_slot(workdir, fake_server, monkeypatch):
+    """A session index and a slow fake endpoint the model may only have one request in flight to."""
+    server, base_url = fake_server(token_delay=0.2)
+    monkeypatch.setattr(rag_engine, "OPENROUTER_BASE_URL", base_url)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(http_client, "MODEL_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(http_client, "_model_slots", {})
+    rag_engine.get_vector_store(["Paris is the capital of France."], "session", source="facts.txt")
+    return http_client._get_model_slot("fake-model")
+
+def test_closing_the_stream_releases_the_model_slot(single_slot):
+    stream = rag_engine.user_input_stream("What is the capital of France?", "fake-model", "session")
+    assert next(stream) == DEFAULT_REPLY.split(" ")[0]
+    start = time.perf_counter()
+    stream.close()
+    assert single_slot.acquire(timeout=5)
+    single_slot.release()
+    # Released at the next token rather than after the rest of the reply
+    assert time.perf_counter() - start < 0.2 * (len(DEFAULT_REPLY.split(" ")) - 2)
+
+    # The interrupted answer wasn't cached, so the same question streams again in full
+    pieces = list(rag_engine.user_input_stream("What is the capital of France?", "fake-model", "session"))
+    assert "".join(pieces) == DEFAULT_REPLY
+    assert len(pieces) > 1
+
+def test_abandoned_stream_releases_the_slot_when_upstream_ends(single_slot):
+    stream = rag_engine.user_input_stream("What is the capital of France?", "fake-model", "session")
+    next(stream)
+    # Neither closed nor collected: the worker still finishes and gives the slot back
+    assert single_slot.acquire(timeout=10)
+    single_slot.release()
+    assert tracing._stack() == []
+    assert "".join(rag_engine.user_input_stream("What is the capital of Spain?", "fake-model", "session")) == DEFAULT_REPLY
+    stream.close()
@@ -0,0 +1,31 @@
+import pytest
+import tracing
+from tracing import count, get_counters, get_recent_traces, get_stage_totals, reset_metrics, span
+
+def test_nested_spans_form_one_trace():
+    reset_metrics()
+    with span("turn", session_id="s"):
+        with span("retrieve"):
+            count("chunks", 3)
+        with pytest.raises(ValueError):
+            with span("llm"):
+                raise ValueError("boom")
+
+    spans = get_recent_traces(1)[0]
+    assert [(record["name"], record["depth"], record["parent"]) for record in spans] == [
+        ("turn", 0, None), ("retrieve", 1, "turn"), ("llm", 1, "turn")
+    ]
+    assert len({record["trace_id"] for record in spans}) == 1
+    assert spans[1]["counters"] == {"chunks": 3}
+    assert spans[2]["error"] == "ValueError"
+    assert get_counters() == {"chunks": 3}
+    assert get_stage_totals()["llm"]["errors"] == 1
+    assert tracing._stack() == []
+
+def test_reset_metrics_clears_everything():
+    with span("stage"):
+        count("calls")
+    reset_metrics()
+    assert get_counters() == {}
+    assert get_stage_totals() == {}
+    assert get_recent_traces() == []
@@ -0,0 +1,82 @@
+import os
+import time
+import pytest
+import video_cache
+from tracing import get_counters
+from conftest import write_video
+
+@pytest.fixture
+def cache(workdir, monkeypatch):
+    monkeypatch.setattr(video_cache, "VIDEO_CACHE_DIR", str(workdir / "video_cache"))
+    return video_cache
+
+def test_same_bytes_are_stored_once(cache, workdir):
+    write_video(workdir / "clip.mp4", seconds=1)
+    data = (workdir / "clip.mp4").read_bytes()
+    hits = get_counters().get("video_cache_hits", 0)
+
+    key, path = cache.store_video(data, ".mp4")
+    mtime = os.path.getmtime(path)
+    assert cache.store_video(data, ".mp4") == (key, path)
+    assert os.path.getmtime(path) == mtime
+    assert get_counters()["video_cache_hits"] == hits + 1
+    assert cache.store_video(data + b"x", ".mp4")[0] != key
+
+def test_info_and_frames_are_computed_once(cache, workdir, monkeypatch):
+    write_video(workdir / "clip.mp4", seconds=2)
+    key, path = cache.store_video((workdir / "clip.mp4").read_bytes(), ".mp4")
+    info = cache.get_cached_video_info(key, path)
+    assert info["frame_count"] == 20
+
+    calls = []
+    extract_frames = cache.extract_frames
+
+    def counting_extract(*args, **kwargs):
+        calls.append(kwargs["mode"])
+        return extract_frames(*args, **kwargs)
+
+    monkeypatch.setattr(cache, "extract_frames", counting_extract)
+    monkeypatch.setattr(cache, "get_video_info", lambda path: pytest.fail("info was not cached"))
+    assert cache.get_cached_video_info(key, path) == info
+    frames = cache.get_cached_frames(key, path, max_frames=4)
+    assert len(frames) == 4
+    assert cache.get_cached_frames(key, path, max_frames=4) == frames
+    cache.get_cached_frames(key, path, max_frames=4, mode="scene")
+    assert calls == ["uniform", "scene"]
+
+def test_only_complete_summaries_are_cached(cache):
+    key, _ = cache.store_video(b"video bytes", ".mp4")
+    assert cache.store_summary(key, "model", "short", "A summary.", {"sampling": "uniform"})
+    assert cache.get_summary(key, "model", "short", {"sampling": "uniform"}) == "A summary."
+    assert cache.get_summary(key, "model", "short", {"sampling": "scene"}) is None
+    assert cache.get_summary(key, "other-model", "short", {"sampling": "uniform"}) is None
+
+    assert not cache.store_summary(key, "model", "long", "Error generating summary: boom")
+    assert not cache.store_summary(key, "model", "long", "Parts.\n\n_2 part(s) of the video could not be summarized._")
+    assert cache.get_summary(key, "model", "long") is None
+    # An evicted entry doesn't come back through a late summary
+    assert not cache.store_summary("missing", "model", "short", "A summary.")
+
+def test_eviction_keeps_recently_used_entries(cache, monkeypatch):
+    monkeypatch.setattr(cache, "VIDEO_CACHE_MAX_ENTRIES", 2)
+    first, _ = cache.store_video(b"first", ".mp4")
+    second, _ = cache.store_video(b"second", ".mp4")
+    old = time.time() - 100
+    os.utime(cache._entry_dir(first), (old, old))
+    os.utime(cache._entry_dir(second), (old - 10, old - 10))
+    # Using an entry moves it to the front
+    cache.store_video(b"second", ".mp4")
+    stale_tmp = os.path.join(cache.VIDEO_CACHE_DIR, "x.tmp-1")
+    with open(stale_tmp, "w") as f:
+        f.write("partial")
+    os.utime(stale_tmp, (old - 7200, old - 7200))
+
+    third, _ = cache.store_video(b"third", ".mp4")
+    assert sorted(os.listdir(cache.VIDEO_CACHE_DIR)) == sorted([second, third])
+
+def test_clear_video_cache(cache):
+    cache.store_video(b"video bytes", ".mp4")
+    cache.clear_video_cache()
+    assert not os.path.exists(cache.VIDEO_CACHE_DIR)
+    key, path = cache.store_video(b"video bytes", ".mp4")
+    assert os.path.exists(path)
@@ -0,0 +1,20 @@
+import video_utils
+from fake_openai_server import DEFAULT_REPLY
+from conftest import request_count, write_video
+
+def test_long_video_map_reduce(tmp_path, fake_server, monkeypatch):
+    monkeypatch.setattr(video_utils, "VIDEO_REDUCE_BATCH", 2)
+    server, base_url = fake_server()
+    video_path = tmp_path / "long.mp4"
+    write_video(video_path, seconds=6)
+
+    progress = []
+    summary = video_utils.summarize_long_video(
+        str(video_path), "key", segment_seconds=1, frames_per_segment=2, base_url=base_url,
+        progress_callback=lambda stage, done, total: progress.append((stage, done, total))
+    )
+    assert summary == DEFAULT_REPLY
+    # 6 segment summaries, then merged in rounds of two: 6 -> 3 -> 2 -> 1
+    assert request_count(server) == 6 + 3 + 2 + 1
+    assert [entry for entry in progress if entry[0] == "segments"][-1] == ("segments", 6, 6)
+    assert [entry for entry in progress if entry[0] == "merge"] == [("merge", 3, 3), ("merge", 2, 2), ("merge", 1, 1)]
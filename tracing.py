@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated exporters: "memory" (ring buffer for the sidebar debug panel), "log", "prometheus"
+TRACE_EXPORTERS = os.getenv("TRACE_EXPORTERS", "memory")
+TRACE_RING_SIZE = int(os.getenv("TRACE_RING_SIZE", "1000"))
+# Written for node_exporter's textfile collector when the "prometheus" exporter is enabled
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "rag_metrics.prom")
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+
+_local = threading.local()
+_lock = threading.Lock()
+_counters = {}
+# stage name -> {"count", "total_seconds", "max_seconds", "errors"}
+_stage_totals = {}
+_exporters = []
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory."""
+
+    def __init__(self, size=TRACE_RING_SIZE):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span):
+        self.spans.append(span)
+
+class LogExporter:
+    """Prints one line per finished span."""
+
+    def export(self, span):
+        details = " ".join(f"{key}={value}" for key, value in {**span["attrs"], **span["counters"]}.items())
+        indent = "  " * span["depth"]
+        status = f" error={span['error']}" if span["error"] else ""
+        print(f"[trace {span['trace_id'][:8]}] {indent}{span['name']} {span['duration_ms']:.1f}ms {details}{status}".rstrip())
+
+class PrometheusTextfileExporter:
+    """
+    Rewrites a Prometheus text-format file with per-stage totals and counters whenever a
+    top-level span finishes. The file is replaced atomically so scrapers never read half of it.
+    """
+
+    def __init__(self, path=PROMETHEUS_TEXTFILE):
+        self.path = path
+
+    def export(self, span):
+        if span["depth"] != 0:
+            return
+        lines = [
+            "# HELP rag_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE rag_stage_seconds summary"
+        ]
+        stages = get_stage_totals()
+        for name, totals in sorted(stages.items()):
+            lines.append(f'rag_stage_seconds_sum{{stage="{name}"}} {totals["total_seconds"]:.6f}')
+            lines.append(f'rag_stage_seconds_count{{stage="{name}"}} {totals["count"]}')
+        lines.append("# TYPE rag_stage_errors_total counter")
+        for name, totals in sorted(stages.items()):
+            lines.append(f'rag_stage_errors_total{{stage="{name}"}} {totals["errors"]}')
+        for name, value in sorted(get_counters().items()):
+            metric = "rag_" + "".join(c if c.isalnum() else "_" for c in name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", self.path, e)
+
+_EXPORTER_TYPES = {
+    "memory": RingBufferExporter,
+    "log": LogExporter,
+    "prometheus": PrometheusTextfileExporter
+}
+
+def register_exporter(exporter):
+    """Adds any object with an export(span_dict) method."""
+    with _lock:
+        _exporters.append(exporter)
+    return exporter
+
+def get_exporters():
+    with _lock:
+        return list(_exporters)
+
+def get_ring_buffer():
+    for exporter in get_exporters():
+        if isinstance(exporter, RingBufferExporter):
+            return exporter
+    return None
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def _export(record):
+    with _lock:
+        totals = _stage_totals.setdefault(record["name"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "errors": 0})
+        totals["count"] += 1
+        seconds = record["duration_ms"] / 1000
+        totals["total_seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], seconds)
+        if record["error"]:
+            totals["errors"] += 1
+        exporters = list(_exporters)
+
+    for exporter in exporters:
+        try:
+            exporter.export(record)
+        except Exception as e:
+            logger.warning("Trace exporter %s failed: %s", type(exporter).__name__, e)
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times the enclosed block as one pipeline stage. Spans opened inside it on the same
+    thread become its children and share its trace id. Yields the span's record, whose
+    "attrs" can be extended while it runs.
+    """
+    if not TRACING_ENABLED:
+        yield {"attrs": {}, "counters": {}}
+        return
+
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    record = {
+        "name": name,
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "parent": parent["name"] if parent else None,
+        "depth": len(stack),
+        "start": time.time(),
+        "duration_ms": 0.0,
+        "attrs": dict(attrs),
+        "counters": {},
+        "error": None
+    }
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        # GeneratorExit means a streaming consumer stopped early, which isn't a failure
+        if not isinstance(e, GeneratorExit):
+            record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        if record in stack:
+            stack.remove(record)
+        _export(record)
+
+def count(name, value=1):
+    """Adds to a process-wide counter and to the innermost open span's counters."""
+    if not TRACING_ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    stack = _stack()
+    if stack:
+        counters = stack[-1]["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+def get_counters():
+    with _lock:
+        return dict(_counters)
+
+def get_stage_totals():
+    with _lock:
+        return {name: dict(totals) for name, totals in _stage_totals.items()}
+
+def get_recent_traces(limit=5):
+    """The last `limit` complete traces from the ring buffer, newest first, spans in start order."""
+    ring = get_ring_buffer()
+    if ring is None:
+        return []
+    traces = {}
+    for record in list(ring.spans):
+        traces.setdefault(record["trace_id"], []).append(record)
+    recent = list(traces.values())[-limit:]
+    return [sorted(spans, key=lambda record: record["start"]) for spans in reversed(recent)]
+
+def reset_metrics():
+    """Clears counters, stage totals and the ring buffer; the debug panel's reset button."""
+    with _lock:
+        _counters.clear()
+        _stage_totals.clear()
+    ring = get_ring_buffer()
+    if ring is not None:
+        ring.spans.clear()
+
+for _name in filter(None, (part.strip() for part in TRACE_EXPORTERS.split(","))):
+    if _name in _EXPORTER_TYPES:
+        register_exporter(_EXPORTER_TYPES[_name]())
+    else:
+        logger.warning("Unknown trace exporter '%s', expected one of %s", _name, sorted(_EXPORTER_TYPES))
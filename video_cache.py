@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from tracing import count
+from video_utils import extract_frames, get_video_info
+
+# Uploaded videos keyed by content hash, with their probed info, sampled frames and summaries,
+# so Streamlit reruns and repeat uploads skip decoding and API calls
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", "video_cache")
+VIDEO_CACHE_MAX_BYTES = int(os.getenv("VIDEO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+VIDEO_CACHE_MAX_ENTRIES = int(os.getenv("VIDEO_CACHE_MAX_ENTRIES", "20"))
+# Leftovers of interrupted writes older than this are removed
+VIDEO_CACHE_TMP_MAX_AGE_SECONDS = 3600
+
+# Summaries starting with these are error messages and are never cached
+_UNCACHEABLE_PREFIXES = ("Error", "No frames")
+_PARTIAL_SUMMARY_NOTES = ("could not be summarized._", "shown one by one._")
+
+_lock = threading.Lock()
+
+def hash_video(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _entry_dir(key):
+    return os.path.join(VIDEO_CACHE_DIR, key)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, value):
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def _touch(key):
+    """Marks the entry as recently used; eviction goes by the folder's mtime."""
+    try:
+        os.utime(_entry_dir(key))
+    except OSError:
+        pass
+
+def _folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def evict(keep=None):
+    """
+    Removes least recently used entries until both limits hold, plus temp files and folders
+    left behind by interrupted writes. The entry named by keep is never removed.
+    Returns the number of entries removed.
+    """
+    if not os.path.isdir(VIDEO_CACHE_DIR):
+        return 0
+    entries = []
+    stale_before = time.time() - VIDEO_CACHE_TMP_MAX_AGE_SECONDS
+    for entry in os.scandir(VIDEO_CACHE_DIR):
+        if ".tmp-" in entry.name:
+            if entry.stat().st_mtime < stale_before:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            continue
+        if entry.is_dir():
+            entries.append((entry.stat().st_mtime, entry.name, _folder_size(entry.path)))
+
+    entries.sort()
+    total_bytes = sum(size for _, _, size in entries)
+    removed = 0
+    for _, name, size in entries:
+        if len(entries) - removed <= VIDEO_CACHE_MAX_ENTRIES and total_bytes <= VIDEO_CACHE_MAX_BYTES:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(VIDEO_CACHE_DIR, name), ignore_errors=True)
+        total_bytes -= size
+        removed += 1
+    if removed:
+        count("video_cache_evictions", removed)
+    return removed
+
+def store_video(data, suffix=""):
+    """
+    Keeps the uploaded bytes under their content hash, writing them only the first time.
+    Returns (key, path); the path stays valid until the entry is evicted.
+    """
+    key = hash_video(data)
+    folder = _entry_dir(key)
+    path = os.path.join(folder, f"video{suffix}")
+    with _lock:
+        if os.path.exists(path):
+            count("video_cache_hits")
+            _touch(key)
+            return key, path
+
+        count("video_cache_misses")
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        evict(keep=key)
+    return key, path
+
+def get_cached_video_info(key, path):
+    """Cached variant of video_utils.get_video_info."""
+    info_path = os.path.join(_entry_dir(key), "info.json")
+    info = _read_json(info_path)
+    if info is None:
+        info = get_video_info(path)
+        _write_json(info_path, info)
+    return info
+
+def get_cached_frames(key, path, max_frames=8, mode="uniform"):
+    """Cached variant of video_utils.extract_frames."""
+    frames_path = os.path.join(_entry_dir(key), f"frames_{mode}_{max_frames}.json")
+    frames = _read_json(frames_path)
+    if frames is None:
+        frames = extract_frames(path, max_frames=max_frames, mode=mode)
+        if frames:
+            _write_json(frames_path, frames)
+    return frames
+
+def _summary_key(model, kind, params):
+    return json.dumps([model, kind, params], sort_keys=True)
+
+def get_summary(key, model, kind, params=None):
+    """The summary made earlier with the same model, kind ("short"/"long") and parameters, or None."""
+    summaries = _read_json(os.path.join(_entry_dir(key), "summaries.json")) or {}
+    summary = summaries.get(_summary_key(model, kind, params))
+    if summary is not None:
+        count("video_summary_cache_hits")
+        _touch(key)
+    return summary
+
+def store_summary(key, model, kind, summary, params=None):
+    """Saves a summary unless it is an error message or only partly succeeded."""
+    if summary.startswith(_UNCACHEABLE_PREFIXES) or summary.endswith(_PARTIAL_SUMMARY_NOTES):
+        return False
+    folder = _entry_dir(key)
+    if not os.path.isdir(folder):
+        return False
+    with _lock:
+        summaries_path = os.path.join(folder, "summaries.json")
+        summaries = _read_json(summaries_path) or {}
+        summaries[_summary_key(model, kind, params)] = summary
+        _write_json(summaries_path, summaries)
+    return True
+
+def clear_video_cache():
+    """Removes every cached video; the debug panel's clear button."""
+    with _lock:
+        shutil.rmtree(VIDEO_CACHE_DIR, ignore_errors=True)
@@ -1,69 +1,204 @@
 import cv2
 import base64
 import os
-import requests
-import json
+import time
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http_client import post_chat_completion
+from tracing import count, span
 
-def extract_frames(video_path, max_frames=8):
+logger = logging.getLogger(__name__)
+
+# "uniform" spaces frames evenly, "scene" picks the frames where the picture changes most
+FRAME_SAMPLING_MODES = ("uniform", "scene")
+# Gaps between samples shorter than this are always grabbed through, longer than the max
+# always seeked; in between, whichever has been cheaper so far in this video is used
+VIDEO_SEEK_MIN_GAP = int(os.getenv("VIDEO_SEEK_MIN_GAP", "8"))
+VIDEO_SEEK_MAX_GAP = int(os.getenv("VIDEO_SEEK_MAX_GAP", "3000"))
+# Scene mode compares one frame in this many against the previous compared frame
+SCENE_STRIDE = int(os.getenv("VIDEO_SCENE_STRIDE", "5"))
+FRAME_ENCODE_WORKERS = int(os.getenv("FRAME_ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+FRAME_MAX_DIM = 768
+
+# Any OpenAI-compatible endpoint works, e.g. fake_openai_server.py for local testing
+VIDEO_API_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+VIDEO_MODEL = "nvidia/nemotron-nano-12b-v2-vl:free"
+# Long-video map-reduce settings
+VIDEO_SEGMENT_SECONDS = float(os.getenv("VIDEO_SEGMENT_SECONDS", "60"))
+VIDEO_FRAMES_PER_SEGMENT = int(os.getenv("VIDEO_FRAMES_PER_SEGMENT", "6"))
+VIDEO_SUMMARY_WORKERS = int(os.getenv("VIDEO_SUMMARY_WORKERS", "4"))
+VIDEO_REDUCE_BATCH = int(os.getenv("VIDEO_REDUCE_BATCH", "20"))
+
+def _resize_frame(frame, max_dim=FRAME_MAX_DIM):
+    # Resize frame to reduce payload size (max dimension 768px)
+    height, width = frame.shape[:2]
+    if max(height, width) > max_dim:
+        scale = max_dim / max(height, width)
+        new_width = int(width * scale)
+        new_height = int(height * scale)
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    return frame
+
+def _encode_frame(frame):
+    """Resizes a decoded BGR frame and returns it as a base64 JPEG data URL."""
+    frame = _resize_frame(frame)
+    # imencode expects BGR, which is what OpenCV decodes to
+    _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+    frame_base64 = base64.b64encode(buffer).decode('utf-8')
+    return f"data:image/jpeg;base64,{frame_base64}"
+
+def _read_frames_at(cap, indices, stats):
+    """
+    Yields (index, frame) for the sorted frame indices. Gaps between samples are crossed
+    by grabbing forward (no colour conversion, no keyframe seek) unless seeking has proven
+    cheaper: the cost of a grabbed frame and of a seek are measured as we go, since which
+    one wins depends on the codec's keyframe interval.
+    """
+    position = 0
+    grab_cost = None
+    seek_cost = None
+    for index in indices:
+        start = time.perf_counter()
+        gap = index - position
+        ok = True
+        if gap < 0 or gap > VIDEO_SEEK_MAX_GAP or (
+            gap >= VIDEO_SEEK_MIN_GAP and grab_cost is not None
+            and (seek_cost is None or seek_cost < gap * grab_cost)
+        ):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = cap.read()
+            position = index + 1
+            stats["seeks"] += 1
+            seek_cost = time.perf_counter() - start
+        else:
+            while position < index and ok:
+                ok = cap.grab()
+                position += 1
+            ok, frame = cap.read() if ok else (False, None)
+            position += 1
+            stats["decoded"] += gap
+            if gap:
+                grab_cost = (time.perf_counter() - start) / (gap + 1)
+        stats["decoded"] += 1
+        stats["decode_seconds"] += time.perf_counter() - start
+        if not ok:
+            return
+        yield index, frame
+
+def _scene_score(frame, previous_histogram):
+    """Histogram distance to the previous compared frame, on a small grayscale thumbnail."""
+    # Striding first keeps the area resize cheap on full-resolution frames
+    stride = max(1, min(frame.shape[0] // 36, frame.shape[1] // 64) // 2)
+    thumbnail = cv2.resize(frame[::stride, ::stride], (64, 36), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    histogram = cv2.calcHist([gray], [0], None, [32], [0, 256])
+    histogram = cv2.normalize(histogram, histogram, 1.0, 0.0, cv2.NORM_L1)
+    if previous_histogram is None:
+        return float("inf"), histogram
+    return float(cv2.compareHist(previous_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA)), histogram
+
+def _scene_frames(cap, start_frame, end_frame, max_frames, stats, stride=SCENE_STRIDE):
+    """
+    One forward pass over [start_frame, end_frame) that scores every stride-th frame by how
+    much it differs from the last scored one. Returns the max_frames highest scoring
+    (index, frame) pairs in time order, at least a few frames apart so one cut isn't
+    picked twice. Only a bounded number of (already resized) candidates is kept.
+    """
+    keep = max_frames * 4
+    min_gap = max(stride, (end_frame - start_frame) // (max_frames * 4))
+    candidates = []
+    previous_histogram = None
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        stats["seeks"] += 1
+
+    for index in range(start_frame, end_frame):
+        started = time.perf_counter()
+        ok = cap.grab()
+        stats["decoded"] += 1
+        if ok and (index - start_frame) % stride == 0:
+            ok, frame = cap.retrieve()
+        else:
+            frame = None
+        stats["decode_seconds"] += time.perf_counter() - started
+        if not ok:
+            break
+        if frame is None:
+            continue
+
+        score, previous_histogram = _scene_score(frame, previous_histogram)
+        if len(candidates) < keep:
+            heapq.heappush(candidates, (score, -index, index, _resize_frame(frame)))
+        elif (score, -index) > candidates[0][:2]:
+            heapq.heapreplace(candidates, (score, -index, index, _resize_frame(frame)))
+
+    picked = []
+    for _, _, index, frame in sorted(candidates, key=lambda entry: entry[:2], reverse=True):
+        if all(abs(index - other) >= min_gap for other, _ in picked):
+            picked.append((index, frame))
+        if len(picked) >= max_frames:
+            break
+    return sorted(picked, key=lambda pair: pair[0])
+
+def extract_frames(video_path, max_frames=8, mode="uniform", max_workers=None):
     """
     Extracts evenly distributed frames from a video file.
+    mode="scene" instead picks the frames where the picture changes most.
+    Frames are decoded in one forward pass and resized/JPEG-encoded on a thread pool;
+    decode speed is reported on the trace span and in the log.
     """
     if not os.path.exists(video_path):
         return []
+    if mode not in FRAME_SAMPLING_MODES:
+        raise ValueError(f"Unknown frame sampling mode '{mode}', expected one of {FRAME_SAMPLING_MODES}")
+
+    with span("video.extract_frames", max_frames=max_frames, mode=mode) as extract_span:
+        frames = _extract_frames(video_path, max_frames, mode, max_workers, extract_span["attrs"])
+        count("video_frames", len(frames))
+        count("video_frame_bytes", sum(len(frame) for frame in frames))
+    return frames
 
+def _extract_frames(video_path, max_frames, mode, max_workers, stats):
+    """Does the work of extract_frames, recording decode and encode statistics in stats."""
     cap = cv2.VideoCapture(video_path)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    if total_frames <= 0:
-        return []
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            return []
 
-    frames = []
-    step = max(1, total_frames // max_frames)
+        stats.update({"decoded": 0, "seeks": 0, "decode_seconds": 0.0})
+        # OpenCV releases the GIL while resizing and encoding, so threads run in parallel
+        with ThreadPoolExecutor(max_workers=max_workers or FRAME_ENCODE_WORKERS) as executor:
+            if mode == "scene":
+                sampled = _scene_frames(cap, 0, total_frames, max_frames, stats)
+            else:
+                step = max(1, total_frames // max_frames)
+                sampled = _read_frames_at(cap, range(0, total_frames, step)[:max_frames], stats)
+            # Encoding overlaps with decoding the next sample
+            futures = [executor.submit(_encode_frame, frame) for _, frame in sampled]
+            start = time.perf_counter()
+            frames = [future.result() for future in futures]
+            stats["encode_wait_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        cap.release()
 
-    for i in range(0, total_frames, step):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Convert to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Resize frame to reduce payload size (max dimension 768px)
-        height, width = frame_rgb.shape[:2]
-        max_dim = 768
-        if max(height, width) > max_dim:
-            scale = max_dim / max(height, width)
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            frame_rgb = cv2.resize(frame_rgb, (new_width, new_height), interpolation=cv2.INTER_AREA)
-        
-        # Encode to base64
-        _, buffer = cv2.imencode('.jpg', frame_rgb, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
-        frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        frames.append(f"data:image/jpeg;base64,{frame_base64}")
-        
-        if len(frames) >= max_frames:
-            break
-            
-    cap.release()
+    decode_seconds = stats.pop("decode_seconds")
+    stats["decode_ms"] = round(decode_seconds * 1000, 1)
+    stats["decode_fps"] = round(stats["decoded"] / decode_seconds, 1) if decode_seconds else None
+    logger.info(
+        "Extracted %d frames (%s) from %d decoded at %s fps, %d seeks",
+        len(frames), mode, stats["decoded"], stats["decode_fps"], stats["seeks"]
+    )
     return frames
 
-def get_video_summary(frames, api_key):
+def get_video_summary(frames, api_key, base_url=None):
     """
     Sends frames to OpenRouter using nvidia/nemotron-nano-12b-v2-vl:free for summarization.
     """
     if not frames:
         return "No frames could be extracted from the video."
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    # Construct the message content with text and images
     # Construct the message content with text and images
     content = [{"type": "text", "text": "These are sequential frames from a video. Please provide a detailed, cohesive summary of the event taking place. Describe the action as a continuous narrative. IMPORTANT: Do NOT mention specific frame numbers (e.g., 'Frame 1', 'In the first frame'). Just describe what happens in the video."}]
     
@@ -76,7 +211,7 @@ def get_video_summary(frames, api_key):
         })
 
     data = {
-        "model": "nvidia/nemotron-nano-12b-v2-vl:free",
+        "model": VIDEO_MODEL,
         "messages": [
             {
                 "role": "user",
@@ -87,12 +222,178 @@ def get_video_summary(frames, api_key):
         "max_tokens": 1024
     }
 
+    with span("video.request", model=data["model"], frames=len(frames)) as request_span:
+        try:
+            # Pooled connection with timeouts and retries, see http_client
+            return post_chat_completion(base_url or VIDEO_API_BASE_URL, api_key, data)
+        except RuntimeError as e:
+            request_span["error"] = "RuntimeError"
+            return f"Error: {str(e)}"
+        except Exception as e:
+            request_span["error"] = type(e).__name__
+            return f"Error generating summary: {str(e)}"
+
+def get_video_info(video_path):
+    """Returns fps, frame count and duration in seconds of a video file."""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return {"fps": fps, "frame_count": frame_count, "duration": frame_count / fps if fps > 0 else 0}
+
+def _format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def iter_segment_frames(video_path, segment_seconds=None, frames_per_segment=None, max_workers=None):
+    """
+    Splits a video into segments of segment_seconds and yields one dict per segment,
+    {"index", "start", "end", "frames"}, as soon as its frames are encoded. All segments
+    are sampled in a single forward pass over the video.
+    """
+    segment_seconds = segment_seconds or VIDEO_SEGMENT_SECONDS
+    frames_per_segment = frames_per_segment or VIDEO_FRAMES_PER_SEGMENT
+    info = get_video_info(video_path)
+    if info["frame_count"] <= 0 or info["fps"] <= 0:
+        return
+
+    segment_length = max(1, int(segment_seconds * info["fps"]))
+    segments = []
+    for index, first in enumerate(range(0, info["frame_count"], segment_length)):
+        last = min(first + segment_length, info["frame_count"])
+        step = (last - first) / frames_per_segment
+        positions = sorted({first + int(step * (i + 0.5)) for i in range(frames_per_segment)})
+        segments.append({
+            "index": index,
+            "start": first / info["fps"],
+            "end": last / info["fps"],
+            "positions": positions
+        })
+    segment_of = {position: segment for segment in segments for position in segment["positions"]}
+
+    stats = {"decoded": 0, "seeks": 0, "decode_seconds": 0.0}
+    cap = cv2.VideoCapture(video_path)
     try:
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code != 200:
-            return f"Error: {response.status_code} - {response.text}"
-        
-        result = response.json()
-        return result['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error generating summary: {str(e)}"
+        with ThreadPoolExecutor(max_workers=max_workers or FRAME_ENCODE_WORKERS) as executor:
+            pending = []
+            for position, frame in _read_frames_at(cap, sorted(segment_of), stats):
+                segment = segment_of[position]
+                segment.setdefault("futures", []).append(executor.submit(_encode_frame, frame))
+                if position == segment["positions"][-1]:
+                    pending.append(segment)
+                # Hand over finished segments in order without waiting for the rest of the video
+                while pending and all(future.done() for future in pending[0]["futures"]):
+                    yield _finish_segment(pending.pop(0))
+            # Also covers a truncated video whose last segment was only partly decoded
+            for segment in segments:
+                if "futures" in segment and "frames" not in segment:
+                    yield _finish_segment(segment)
+    finally:
+        cap.release()
+
+    decode_seconds = stats["decode_seconds"]
+    logger.info(
+        "Sampled %d segments from %d decoded frames at %s fps, %d seeks", len(segments), stats["decoded"],
+        round(stats["decoded"] / decode_seconds, 1) if decode_seconds else None, stats["seeks"]
+    )
+
+def _finish_segment(segment):
+    segment["frames"] = [future.result() for future in segment.pop("futures")]
+    return {key: segment[key] for key in ("index", "start", "end", "frames")}
+
+SEGMENT_PROMPT = "These are sequential frames from the part of a longer video between {start} and {end}. Describe what happens in this part as a continuous narrative, including people, objects, actions and any visible text. IMPORTANT: Do NOT mention specific frame numbers. Just describe what happens."
+REDUCE_PROMPT = "Below are summaries of consecutive parts of one video, each with its time range. Write a detailed, cohesive summary of the whole video as a continuous narrative, noting roughly when the key moments happen. Do not refer to the parts or summaries themselves.\n\n{summaries}"
+
+def _summarize_segment(base_url, api_key, segment):
+    content = [{"type": "text", "text": SEGMENT_PROMPT.format(
+        start=_format_timestamp(segment["start"]), end=_format_timestamp(segment["end"])
+    )}]
+    content.extend({"type": "image_url", "image_url": {"url": frame}} for frame in segment["frames"])
+    data = {
+        "model": VIDEO_MODEL,
+        "messages": [{"role": "user", "content": content}],
+        "temperature": 0.5,
+        "max_tokens": 512
+    }
+    with span("video.map", segment=segment["index"], frames=len(segment["frames"])):
+        return post_chat_completion(base_url, api_key, data)
+
+def _reduce_summaries(base_url, api_key, parts):
+    """Merges [(start, end, summary)] into one summary covering start of the first to end of the last."""
+    summaries = "\n\n".join(
+        f"[{_format_timestamp(start)} - {_format_timestamp(end)}]\n{summary}" for start, end, summary in parts
+    )
+    data = {
+        "model": VIDEO_MODEL,
+        "messages": [{"role": "user", "content": REDUCE_PROMPT.format(summaries=summaries)}],
+        "temperature": 0.5,
+        "max_tokens": 1024
+    }
+    with span("video.reduce", parts=len(parts)):
+        return post_chat_completion(base_url, api_key, data)
+
+def summarize_long_video(video_path, api_key, segment_seconds=None, frames_per_segment=None,
+                         max_workers=None, base_url=None, progress_callback=None):
+    """
+    Map-reduce summary for videos of any length. The video is cut into segments, each
+    segment's frames are summarized by up to max_workers concurrent requests (starting
+    while later segments are still being decoded), and the segment summaries are merged,
+    in rounds of VIDEO_REDUCE_BATCH if there are many. Requests go through http_client, so
+    they share its rate-limit gate, per-model concurrency limit and retries.
+    progress_callback(stage, done, total) is called from the calling thread as segments
+    finish. Returns the summary, or an error message.
+    """
+    base_url = base_url or VIDEO_API_BASE_URL
+    failures = []
+
+    with span("video.long_summary") as summary_span:
+        with ThreadPoolExecutor(max_workers=max_workers or VIDEO_SUMMARY_WORKERS) as executor:
+            futures = {}
+            for segment in iter_segment_frames(video_path, segment_seconds, frames_per_segment):
+                future = executor.submit(_summarize_segment, base_url, api_key, segment)
+                futures[future] = (segment["index"], segment["start"], segment["end"])
+            summary_span["attrs"]["segments"] = len(futures)
+            if not futures:
+                return "No frames could be extracted from the video."
+
+            parts = {}
+            for done, future in enumerate(as_completed(futures), start=1):
+                index, start, end = futures[future]
+                try:
+                    parts[index] = (start, end, future.result())
+                except (RuntimeError, KeyError, ValueError) as e:
+                    # RuntimeError once retries run out; the others from a malformed response body
+                    failures.append(f"{_format_timestamp(start)}-{_format_timestamp(end)}: {e}")
+                if progress_callback:
+                    progress_callback("segments", done, len(futures))
+
+            parts = [parts[index] for index in sorted(parts)]
+            if not parts:
+                return f"Error generating summary: every segment failed ({failures[0]})"
+
+            # Reduce in rounds so no single prompt has to hold every segment summary
+            try:
+                while len(parts) > 1:
+                    batch_size = max(2, VIDEO_REDUCE_BATCH)
+                    batches = [parts[i:i + batch_size] for i in range(0, len(parts), batch_size)]
+                    reduced = list(executor.map(
+                        lambda batch: (batch[0][0], batch[-1][1], _reduce_summaries(base_url, api_key, batch)),
+                        batches
+                    ))
+                    if progress_callback:
+                        progress_callback("merge", len(batches), len(batches))
+                    parts = reduced
+            except (RuntimeError, KeyError, ValueError) as e:
+                # Still better than nothing: the part summaries in order, with their time ranges
+                summary_span["attrs"]["reduce_failed"] = True
+                logger.warning("Video summary merge failed: %s", e)
+                parts = [(parts[0][0], parts[-1][1], "\n\n".join(
+                    f"**{_format_timestamp(start)} - {_format_timestamp(end)}**\n{text}" for start, end, text in parts
+                ) + f"\n\n_The parts could not be combined into one summary ({e}); they are shown one by one._")]
+
+    summary = parts[0][2]
+    if failures:
+        summary += f"\n\n_{len(failures)} part(s) of the video could not be summarized._"
+        logger.warning("Video segments failed: %s", failures)
+    return summary